@@ -37,7 +37,8 @@ logger.addHandler(ch)
 
 def main(args):
     for (dirpath, dirnames, filenames) in os.walk(args["dir"]):
-        localfolders = dirnames
+        # Skip hidden folders, such as the shared template repo kept by tools/github_interact.py
+        localfolders = [d for d in dirnames if not d.startswith(".")]
         break
     logger.info(f"Found {len(localfolders)} student/s")
 
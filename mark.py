@@ -1,12 +1,12 @@
 import argparse
-import importlib
-import importlib.util
 import json
 import logging
+import multiprocessing
 import os
 import sys
 from logging import exception
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
 from pprint import pformat
 try:
@@ -16,6 +16,19 @@ except ImportError:
         # Return transparent tqdm wrapper just to make sure everything works even if tqdm is not installed
         return x
 
+from markutils.blobs import BlobStore, load_results
+from markutils.cache import LogRecorder, ResultCache, folder_hash, marker_hash, replay
+from markutils.capture import OutputCapture
+from markutils.fixtures import FixtureStore
+from markutils import gitrepo
+from markutils.history import TimingHistory, timed
+from markutils.inventory import Inventory
+from markutils.journal import ResultsJournal
+from markutils.resultsdb import ResultsDB
+from markutils.schedule import longest_first, makespan, student_cost, test_costs
+from markutils.plan import PlanError, build_plan, fingerprint
+from markutils.workspace import SharedInputs, scratch_workspace
+
 def ohhimark():
     x = """
 ...................................................&&&&&........................
@@ -97,15 +110,18 @@ logger.addHandler(ch)
 
 pathstub = ""
 
-def weekchecker(fileloc, studentfolder, modulefolder, module_config):
+def weekchecker(fileloc, studentfolder, modulefolder, module_config, inventory=None):
     """Check the structure and contents of a module folder.
 
     :param fileloc: general location of student work.
     :param studentfolder: folder containing specific student work.
     :param modulefolder: folder that should contain module assignments.
     :param module_config: configuration dict containing module config data.
+    :param inventory: Inventory of the student folder (scanned here if not given).
     :return:
     """
+    if inventory is None:
+        inventory = Inventory.scan(os.path.join(fileloc, studentfolder))
 
     deductions = {"value": 0, "reasons": []}
 
@@ -114,16 +130,12 @@ def weekchecker(fileloc, studentfolder, modulefolder, module_config):
     logger.info("  General check of {}...".format(abs_modulefolder))
 
     # Check that folder is present
-    if not os.path.exists(abs_modulefolder):
+    if not inventory.isdir(modulefolder):
         logger.warning("  {} does not exist! Trying to find alternate variants...".format(abs_modulefolder))
         # studentfolder_contents = os.listdir(abs_studentfolder)
         # logger.debug(pformat(studentfolder_contents))
-        localfolders = []
         # Find top level dirs
-        for (dirpath, dirnames, filenames) in os.walk(abs_studentfolder):
-            localfolders = dirnames
-            break
-        matchingfolders = [folder for folder in localfolders if folder.lower() == modulefolder.lower()]
+        matchingfolders = [folder for folder in inventory.find("", modulefolder) if inventory.isdir(folder)]
         if len(matchingfolders) > 0:
             modulefolder = matchingfolders[0]
             logger.info("  Found probable alternate folder: {}!".format(modulefolder))
@@ -136,13 +148,8 @@ def weekchecker(fileloc, studentfolder, modulefolder, module_config):
             return True, None, None, None, None, deductions
 
     # Check for README
-    modulecontents_folders = []
-    modulecontents_files = []
     # Find module-level files and directories
-    for (dirpath, dirnames, filenames) in os.walk(abs_modulefolder):
-        modulecontents_folders = dirnames
-        modulecontents_files = filenames
-        break
+    modulecontents_folders, modulecontents_files = inventory.listdir(modulefolder)
     readmes = [name for name in modulecontents_files if "readme" in name.lower()]
     if len(readmes) == 0:
         logger.warning("  No module-level readme detected!")
@@ -165,7 +172,7 @@ def weekchecker(fileloc, studentfolder, modulefolder, module_config):
     results_folders = [name for name in modulecontents_folders if "results" in name.lower()]
     if len(code_folders) == 0:
         logger.critical("  No code folder detected!")
-        return True, None, None, None, None, 0
+        return True, None, None, None, None, {"value": 0, "reasons": []}
     if len(data_folders) == 0:
         logger.warning("  No data folder detected!")
         deductions["value"] += 1
@@ -183,6 +190,7 @@ def weekchecker(fileloc, studentfolder, modulefolder, module_config):
             pass
         logger.warning("  Creating results folder '{}' based on assumed folder naming scheme...".format(newresults))
         os.mkdir(os.path.join(abs_modulefolder, newresults))
+        inventory.add_dir(os.path.join(modulefolder, newresults))
         results_folders = [newresults]
 
     # Decide on final names of internal folders for later use.
@@ -191,7 +199,7 @@ def weekchecker(fileloc, studentfolder, modulefolder, module_config):
     final_resultsfolder = results_folders[0]
 
     # Check for unwanted files in results
-    results_files = os.listdir(os.path.join(abs_modulefolder, final_resultsfolder))
+    results_files = sum(inventory.listdir(os.path.join(modulefolder, final_resultsfolder)), [])
     results_files = [file for file in results_files if file not in [".gitkeep", ".gitignore"]]
     if len(results_files) > 0:
         logger.warning("  Found {} file/s in results folder: {}".format(len(results_files), pformat(results_files)))
@@ -205,7 +213,7 @@ def weekchecker(fileloc, studentfolder, modulefolder, module_config):
     expected_files = [".gitignore", "readme.md", "readme.txt", "readme" ".gitkeep"] + list(module_config["tests"].keys()) + module_config["extra_files"]
     expected_files = [file.lower() for file in expected_files]
     # Get files in code folder
-    code_files = [file.lower() for _,_,files in os.walk(os.path.join(abs_modulefolder, final_codefolder)) for file in files]
+    code_files = [os.path.basename(file).lower() for file in inventory.files(os.path.join(modulefolder, final_codefolder))]
     code_files = [file for file in code_files if not file.startswith(".")]
 
     # Find unwanted files
@@ -219,11 +227,13 @@ def weekchecker(fileloc, studentfolder, modulefolder, module_config):
     # return structure: fatal error?, code folder, data, results, deductions
     return False, modulefolder, final_codefolder, final_datafolder, final_resultsfolder, deductions
 
-def repochecker(fileloc, studentfolder):
+def repochecker(fileloc, studentfolder, inventory=None, largehistory=False):
     """Check the structure and contents of a repo folder.
 
         :param fileloc: general location of student work.
         :param studentfolder: folder containing specific student work.
+        :param inventory: Inventory of the student folder (scanned here if not given).
+        :param largehistory: also dock points for large files committed to the repo's history and deleted since.
         :return:
         """
     deductions = {"value": 0, "reasons": []}
@@ -235,12 +245,12 @@ def repochecker(fileloc, studentfolder):
         deductions = {"value": 100, "reasons": ["missing_repo"]}
         return True, deductions
 
+    if inventory is None:
+        inventory = Inventory.scan(abs_studentfolder)
+
     # Check for README
-    modulecontents_files = []
     # Find module-level files and directories
-    for (dirpath, dirnames, filenames) in os.walk(abs_studentfolder):
-        modulecontents_files = filenames
-        break
+    _, modulecontents_files = inventory.listdir("")
     readmes = [name for name in modulecontents_files if "readme" in name.lower()]
 
     if len(readmes) == 0:
@@ -259,24 +269,260 @@ def repochecker(fileloc, studentfolder):
     else:
         logger.info("  Found repo-level gitignore: {}".format(gitignores[0]))
 
-    # Find files larger than 100MB
-    # Slightly hacky way to format these nice and quick
-    largefiles = [str(Path(*Path(os.path.join(foldername, file)).parts[2:]))
-                  for foldername, subfolders, filenames in os.walk(abs_studentfolder)
-                  for file in filenames
-                  if os.path.getsize(os.path.join(foldername, file)) > 100000000]
-    largefiles = [file for file in largefiles if not file.startswith(".git/")]
+    # Find files larger than 100MB. In a git repo these come from the sizes of the committed objects, which
+    # also covers files left out of a sparse checkout; otherwise from the inventory (which never includes .git).
+    found = None
+    if os.path.exists(os.path.join(abs_studentfolder, ".git")):
+        found = gitrepo.large_files(abs_studentfolder, 100000000, history=largehistory)
+        if found is None:
+            logger.warning("  Could not read the git objects of {}, only checking the files on disk for size".format(abs_studentfolder))
+    if found is None:
+        largefiles = inventory.large_files(100000000)
+    else:
+        largefiles = ["{} (added in {})".format(relpath, commit) if commit else relpath for relpath, commit in found[0]]
+        if found[1]:
+            logger.warning("  Could not check the size of {} file/s left out of the partial clone".format(len(found[1])))
 
     if len(largefiles) > 0:
         logger.warning("  Found large {} file/s in repo folder (>100MB), -1pt per file\n{}".format(len(largefiles), pformat(largefiles)))
         deductions["value"] += 1 * len(largefiles)
         deductions["reasons"].append("large_files")
 
+    if found is not None and found[2]:
+        removed = ["{} (added in {})".format(relpath, commit) if commit else relpath for relpath, commit in found[2]]
+        logger.warning("  Found {} large file/s (>100MB) deleted from the repo but still in its history, -1pt per file\n{}".format(
+            len(removed), pformat(removed)))
+        deductions["value"] += 1 * len(removed)
+        deductions["reasons"].append("large_files_history")
+
     return False, deductions
 
 
+def run_test(test, fileloc, studentspec, modulespec, scratchloc, cache=None, cachekey=None, fixtures=None, spilldir=None,
+             shared=None):
+    """Run a single test against a scratch copy of a student's module folder.
+
+    :param test: the PlannedTest to run.
+    :param fileloc: general location of student work.
+    :param studentspec: the data of the student, pulled from students.json.
+    :param modulespec: the metadata of the module, including detected folder names.
+    :param scratchloc: folder within which to create the scratch workspace.
+    :param cache: optional ResultCache to reuse results from and store results in.
+    :param cachekey: key of this test within the cache.
+    :param fixtures: FixtureStore holding the fixtures declared by the test, which it can place via testspec["fixtures"].
+    :param spilldir: folder to write the full output of the test's commands to, if it is too long to keep in the results.
+    :param shared: optional SharedInputs of the module folder, so large input files are not copied for every test.
+    :return: tuple of targetfile, the results dict for that test and whether they came from the cache.
+    """
+    targetfile = test.targetfile
+    if cache is not None:
+        cached = cache.get(cachekey)
+        if cached is not None:
+            logger.debug("Reusing cached result for {} ({})".format(targetfile, cachekey))
+            replay(cached["log"], logger)
+            return targetfile, cached["results"], True
+    testspec = dict(test.testspec)
+    placer = None
+    if fixtures is not None:
+        placer = fixtures.placer(test.modulename)
+        testspec["fixtures"] = placer
+    # Tests pass this on to the runner, so that only the head and tail of long output is held in memory.
+    capture = OutputCapture(os.path.join(spilldir, f"{targetfile}.log.gz") if spilldir is not None else None,
+                            **test.testspec.get("output", {}))
+    testspec["capture"] = capture
+    recorder = LogRecorder()
+    logger.addHandler(recorder)
+    try:
+        with scratch_workspace(fileloc, studentspec["folder"], modulespec["folder"], scratchloc,
+                               prefix=f"{os.path.basename(studentspec['folder'])}_{targetfile}_",
+                               inventory=studentspec.get("inventory"), shared=shared,
+                               private=[modulespec[loc] for loc in ("codeloc", "resultsloc") if modulespec.get(loc)]) as workspaceloc:
+            try:
+                runout, lintout, deductions, other = test.func(workspaceloc, targetfile, studentspec, dict(modulespec), testspec)
+            finally:
+                if placer is not None:
+                    placer.cleanup()
+    except Exception as e:
+        logger.debug("TEST ERROR")
+        logger.debug(e, exc_info=True)
+        raise
+    finally:
+        logger.removeHandler(recorder)
+    results = {"stdout": runout, "linterout": lintout, "deductions": deductions, "other": other}
+    if capture.total_bytes:
+        results.update(capture.summary())
+    if cache is not None:
+        cache.put(cachekey, {"results": results, "log": recorder.records})
+    return targetfile, results, False
+
+
+def mark_student(studentid, studentspec, plan, fileloc, logdir, scratchloc, testjobs=1, cache=None, fixtures=None, outputdir=None,
+                 blobs=None, testcosts=None, largehistory=False):
+    """Run the repo, module and test checks for a single student.
+
+    :param studentid: identifier of the student, used for logging and output.
+    :param studentspec: the data of the student, pulled from students.json.
+    :param plan: the marking plan, as returned by build_plan.
+    :param fileloc: general location of student work.
+    :param logdir: folder within which to write the student log.
+    :param scratchloc: folder within which to create per-test scratch workspaces.
+    :param testjobs: number of tests to run at once for this student.
+    :param cache: optional ResultCache of results from previous runs.
+    :param fixtures: FixtureStore holding the fixtures of every test in the plan.
+    :param outputdir: folder to spill over-long test output into (under <studentid>/<moduleid>).
+    :param blobs: optional BlobStore to move long stdout and linter output into, leaving references in the results.
+    :param testcosts: optional {(moduleid, targetfile): predicted seconds}, used to start the longest tests first when testjobs > 1.
+    :param largehistory: also dock points for large files in the history of the student's repo.
+    :return: tuple of studentid, the results dict for that student and the timings of its tests and of each phase of marking it.
+    """
+    timings = {"tests": [], "phases": {}}
+    phases = timings["phases"]
+    # Set up student level logger
+    sfh = logging.FileHandler(os.path.join(logdir, f"{studentid}.log"), mode="w")
+    sfh.setLevel(logging.INFO)
+    sfh.setFormatter(logging.Formatter("%(asctime)s - %(filename)s - %(levelname)s: %(message)s"))
+    logger.addHandler(sfh)
+
+    try:
+        logger.info("Marking {}...".format(studentspec["name"]))
+        # Scan the student's repo once, for use by every check and test from here on.
+        with timed(phases, "scan"):
+            inventory = Inventory.scan(os.path.join(fileloc, studentspec["folder"]))
+        studentspec = dict(studentspec, inventory=inventory)
+        with timed(phases, "repocheck"):
+            repo_results_raw = repochecker(fileloc, studentspec["folder"], inventory, largehistory)
+        repo_results = {"deductions": repo_results_raw[1]}
+        # Record the commit marked, e.g. the deadline snapshot checked out by tools/github_interact.py --before
+        commit = gitrepo.head(os.path.join(fileloc, studentspec["folder"]))
+        if commit is not None:
+            repo_results["commit"] = commit
+        student_results_dict = {"repo_results": repo_results}
+
+        for module in plan:
+            moduleid = module.moduleid
+            if repo_results_raw[0]:
+                # Just skip through if the repo has a catastrophic error.
+                continue
+            logger.info("  Marking {}...".format(moduleid))
+            module_results_dict = {}
+            # Copy the module spec so that folder names detected for one student do not leak into the next.
+            modulespec = dict(module.modulespec)
+
+            # Check week structure if arg given, possibly identify alternate names for code, data, and results folders if required
+            with timed(phases, "weekcheck"):
+                weekchecker_results = weekchecker(fileloc, studentspec["folder"], modulespec["folder"], module.module_config, inventory)
+            module_results_dict["weekchecker_results"] = {"deductions": weekchecker_results[5]}
+
+            if weekchecker_results[0]:
+                logger.critical("Fatal error at week level for {}, skipping...".format(moduleid))
+                student_results_dict[moduleid] = module_results_dict
+                continue
+
+            # Add detected folder name and week level folder names to module spec
+            modulespec["folder"] = weekchecker_results[1]
+            modulespec["codeloc"] = weekchecker_results[2]
+            modulespec["dataloc"] = weekchecker_results[3]
+            modulespec["resultsloc"] = weekchecker_results[4]
+
+            # Tests are only rerun if the student's work, the test itself or its config has changed since they were last cached.
+            modulehash = None
+            if cache is not None:
+                with timed(phases, "hash"):
+                    modulehash = folder_hash(os.path.join(fileloc, studentspec["folder"], modulespec["folder"]),
+                                             [os.path.relpath(f, modulespec["folder"]) for f in inventory.files(modulespec["folder"])])
+                logger.debug("Module folder hash: {}".format(modulehash))
+
+            # Each test runs in its own scratch copy of the module folder, so they can safely run side by side.
+            # Large inputs outside the code and results folders are copied once for all of them, rather than into every copy.
+            spilldir = os.path.join(outputdir, studentid, moduleid) if outputdir is not None else None
+            shared = SharedInputs(os.path.join(scratchloc, f"{os.path.basename(studentspec['folder'])}_{moduleid}_inputs"))
+            test_args = []
+            for test in module.tests:
+                cachekey = None
+                if cache is not None:
+                    cachekey = cache.key(modulehash, test.sourcehash, test.targetfile, test.testspec, modulespec)
+                test_args.append([test, fileloc, studentspec, modulespec, scratchloc, cache, cachekey, fixtures, spilldir, shared])
+            try:
+                with timed(phases, "tests"):
+                    if testjobs > 1:
+                        # Start the longest tests first, but keep the results in plan order.
+                        order = longest_first({i: (testcosts or {}).get((moduleid, x[0].targetfile), 0) for i, x in enumerate(test_args)})
+                        with ThreadPoolExecutor(testjobs) as executor:
+                            futures = {i: executor.submit(run_test, *test_args[i]) for i in order}
+                            test_results = [futures[i].result() for i in range(len(test_args))]
+                    else:
+                        test_results = [run_test(*x) for x in test_args]
+            finally:
+                shared.cleanup()
+            for targetfile, test_results_dict, cached in test_results:
+                timings["tests"].append([moduleid, targetfile, (test_results_dict.get("other") or {}).get("exectime_s"), cached])
+                if blobs is not None:
+                    with timed(phases, "blobs"):
+                        test_results_dict = blobs.externalize(test_results_dict)
+                # Pack test results into module results dict
+                module_results_dict[targetfile] = test_results_dict
+
+            # Pack module results into student results dict
+            student_results_dict[moduleid] = module_results_dict
+    finally:
+        # Get rid of student level logger
+        logger.removeHandler(sfh)
+        sfh.close()
+
+    return studentid, student_results_dict, timings
+
+
+def unchanged_students(reportfile, studentspecs, fileloc):
+    """Return {studentid: commit} of the students whose repo tools/github_interact.py found unchanged since it was last synced.
+
+    :param reportfile: location of the sync_report.json written by github_interact.py.
+    :param studentspecs: the data of each student, pulled from students.json.
+    :param fileloc: general location of student work.
+    """
+    try:
+        with open(reportfile) as f:
+            reports = json.load(f)["students"]
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Could not read sync report {} ({}), marking every student".format(reportfile, e))
+        return {}
+    unchanged = {}
+    for report in reports:
+        studentid = report.get("student")
+        if report.get("status") != "unchanged" or studentid not in studentspecs:
+            continue
+        # Only trust the report if the student's clone is still at the commit it found
+        commit = gitrepo.head(os.path.join(fileloc, studentspecs[studentid]["folder"]))
+        if commit is not None and commit == report.get("head"):
+            unchanged[studentid] = commit
+    return unchanged
+
+
+def mark_student_star(var_list):
+    """Unpack an argument list for mark_student (used by the worker pool)."""
+    return mark_student(*var_list)
+
+
+def init_worker(logqueue, level):
+    """Route the logs of a marking worker process back to the main process.
+
+    :param logqueue: queue read by a QueueListener in the main process.
+    :param level: level to set on the worker logger.
+    """
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(logqueue))
+    logger.setLevel(level)
+
+
 def main(args):
+    """Mark every student in students.json, writing the results into the output location.
+
+    :param args: dict of the command line arguments.
+    :return: dict of the results of every student, as written to overall_results.json.
+    """
     starttime = datetime.now()
+    # Time spent in each phase of the run, kept in the timing history to spot slowdowns of the marker itself.
+    phases = {}
     # First of all check to see if there's a place to put output and logs.
     logger.debug("Checking output dir")
     if not os.path.exists(args["outputloc"]):
@@ -287,8 +533,11 @@ def main(args):
         logger.info("Creating log folder...")
         os.makedirs(logdir)
 
+    scratchloc = os.path.abspath(os.path.join(args["outputloc"], "scratch"))
+    outputdir = os.path.abspath(os.path.join(args["outputloc"], "output"))
+
     # Init logging file handler
-    fh = logging.FileHandler(os.path.join(logdir, "mark.log"), mode="w")
+    fh = logging.FileHandler(os.path.join(logdir, "mark.log"), mode="a" if args["resume"] else "w")
     fh.setLevel(logging.DEBUG)
     fh.setFormatter(logging.Formatter("%(asctime)s - %(filename)s - %(levelname)s: %(message)s"))
     logger.addHandler(fh)
@@ -318,84 +567,145 @@ def main(args):
         config = json.load(f)
     logger.debug("Loaded JSON files:\n{}\n{}".format(pformat(students), pformat(config)))
 
-    overall_results_dict = {}
-    # Main loop through config
-    for studentid,studentspec in students["students"].items():
-        # Set up student level logger
-        sfh = logging.FileHandler(os.path.join(logdir, f"{studentid}.log"), mode="w")
-        sfh.setLevel(logging.INFO)
-        sfh.setFormatter(logging.Formatter("%(asctime)s - %(filename)s - %(levelname)s: %(message)s"))
-        logger.addHandler(sfh)
-
-        logger.info("Marking {}...".format(studentspec["name"]))
-        repo_results_raw = repochecker(args["fileloc"], studentspec["folder"])
-        repo_results = {"deductions": repo_results_raw[1]}
-        student_results_dict = {"repo_results": repo_results}
-
-        for moduleid, modulespec in config.items():
-            if repo_results_raw[0]:
-                # Just skip through if the repo has a catastrophic error.
-                continue
-            logger.info("  Marking {}...".format(moduleid))
-            module_results_dict = {}
-
-            # Load test config
-            testloc = os.path.join(pathstub, modulespec["test_location"])
-            with open(os.path.join(testloc, f"{modulespec['name']}_config.json")) as f:
-                module_config = json.load(f)
-            module_tests = module_config["tests"]
-
-            # Check week structure if arg given, possibly identify alternate names for code, data, and results folders if required
-            weekchecker_results = weekchecker(args["fileloc"], studentspec["folder"], modulespec["folder"], module_config)
-            module_results_dict["weekchecker_results"] = {"deductions": weekchecker_results[5]}
-
-            if weekchecker_results[0]:
-                logger.critical("Fatal error at week level for {}, skipping...".format(moduleid))
-                student_results_dict[moduleid] = module_results_dict
-                continue
+    # Load and check every module config and test up front, so that config errors are found before marking anyone.
+    logger.info("Planning marking run...")
+    try:
+        with timed(phases, "plan"):
+            plan = build_plan(config, pathstub, strict=args["strict"])
+    except PlanError as e:
+        for error in e.errors:
+            logger.critical("CONFIG ERROR - {}".format(error))
+        logger.critical("Aborting, please fix the marking configuration and try again.")
+        sys.exit(1)
+
+    cache = None
+    if not args["nocache"]:
+        cache = ResultCache(os.path.join(args["outputloc"], "cache"), marker_hash([__file__]))
+        logger.debug("Using result cache in {}".format(cache.cacheloc))
+
+    # Long stdout and linter output is stored once per distinct text, with the results just referring to it.
+    blobs = None
+    if not args["noblobs"]:
+        blobs = BlobStore(os.path.join(args["outputloc"], "blobs"))
+
+    # Test inputs are written once here, then each test places the ones it needs into its workspace.
+    fixtures = FixtureStore(os.path.join(args["outputloc"], "fixtures"))
+    with timed(phases, "fixtures"):
+        fixtures.materialize(plan)
+
+    # Results are journaled as soon as each student is done, so a crash loses at most the students in progress.
+    journalpath = os.path.join(args["outputloc"], "overall_results.jsonl")
+    previous = None
+    if args["unchanged"] and not args["resume"] and os.path.exists(journalpath):
+        # Keep the last run's results, to carry over those of students whose repo has not changed
+        previous = journalpath + ".prev"
+        os.replace(journalpath, previous)
+    journal = ResultsJournal(journalpath, resume=args["resume"])
+    planhash = fingerprint(plan)
+    to_mark = students["students"]
+    if args["resume"]:
+        completed = journal.completed()
+        to_mark = {studentid: studentspec for studentid, studentspec in to_mark.items() if studentid not in completed}
+        logger.info("Resuming, {} student/s already marked, {} left to mark...".format(len(students["students"]) - len(to_mark), len(to_mark)))
+
+    # Optionally also write results into a SQLite database, which keeps every run for querying later.
+    db = None
+    if args["db"] is not None:
+        db = ResultsDB(args["db"] or os.path.join(args["outputloc"], "results.sqlite"))
+        db.start_run(config, resume=args["resume"])
+        logger.debug("Writing results to {} as run {}".format(db.path, db.run_id))
+
+    # The timings of every run are kept, so that a run can be compared against previous ones with timing_report.py.
+    history = None
+    if not args["nohistory"]:
+        history = TimingHistory(os.path.join(args["outputloc"], "history.sqlite"))
+        history.start_run(plan, args["jobs"], args["testjobs"], resume=args["resume"])
+
+    def save(studentid, student_results_dict, timings, meta=None):
+        if meta is None:
+            meta = {"commit": student_results_dict.get("repo_results", {}).get("commit"), "plan": planhash}
+        journal.append(studentid, student_results_dict, meta)
+        if db is not None:
+            db.add_student(studentid, students["students"][studentid], student_results_dict)
+        if history is not None and timings is not None:
+            history.add_student(studentid, timings)
+
+    if previous is not None:
+        # Students reported unchanged by github_interact.py keep their last results, as long as they were
+        # marked at the same commit with the same marking plan.
+        unchanged = unchanged_students(os.path.join(os.path.dirname(os.path.abspath(args["students"])), "sync_report.json"),
+                                       students["students"], args["fileloc"])
+        carried = set()
+        for studentid, student_results_dict, meta in ResultsJournal(previous, resume=True).iter_entries():
+            if studentid in unchanged and meta.get("commit") == unchanged[studentid] and meta.get("plan") == planhash:
+                save(studentid, student_results_dict, None, meta)
+                carried.add(studentid)
+        os.remove(previous)
+        to_mark = {studentid: studentspec for studentid, studentspec in to_mark.items() if studentid not in carried}
+        logger.info("{} student/s unchanged since they were last marked, {} left to mark...".format(len(carried), len(to_mark)))
+
+    # Predict how long each student will take from the timing history, and mark the longest first so that
+    # no slow student is left running on its own at the end.
+    testcosts = {}
+    predicted = unordered = None
+    if history is not None:
+        testcosts = test_costs(plan, to_mark, history.estimates())
+        costs = {studentid: student_cost(testcosts[studentid], args["testjobs"]) for studentid in to_mark}
+        unordered = makespan(costs.values(), args["jobs"])
+        if args["jobs"] > 1:
+            to_mark = {studentid: to_mark[studentid] for studentid in longest_first(costs)}
+        predicted = makespan([costs[studentid] for studentid in to_mark], args["jobs"])
+        logger.info("Predicted marking time: {:.1f}s ({:.1f}s in students.json order)".format(predicted, unordered))
 
-            # Add detected folder name and week level folder names to module spec
-            modulespec["folder"] = weekchecker_results[1]
-            modulespec["codeloc"] = weekchecker_results[2]
-            modulespec["dataloc"] = weekchecker_results[3]
-            modulespec["resultsloc"] = weekchecker_results[4]
-
-            # At this point we load each test module in turn using importlib.
-            for targetfile, testspec in module_tests.items():
-                # Load test module and run main function
-                try:
-                    testmodule = importlib.import_module(f"tests.{modulespec['name']}.{os.path.splitext(testspec['testfile'])[0]}")
-                except ModuleNotFoundError as e:
-                    logger.critical("CONFIG ERROR - test file '{}' not found! Skipping...".format(testspec['testfile']))
-                    logger.critical("Expected based upon {}_config.json: \n    '{}': {}".format(modulespec['name'], targetfile, pformat(testspec)))
-                    continue
-                try:
-                    runout, lintout, deductions, other = testmodule.main(args["fileloc"], targetfile, studentspec, modulespec, testspec)
-                except Exception as e:
-                    logger.debug("TEST ERROR")
-                    logger.debug(e, exc_info=True)
-                    raise
-                # Pack test results into module results dict
-                module_results_dict[targetfile] = {"stdout": runout, "linterout": lintout, "deductions": deductions, "other": other}
-
-            # Pack module results into student results dict
-            student_results_dict[moduleid] = module_results_dict
-
-        # Pack student results into overall results
-        overall_results_dict[studentid] = student_results_dict
-        # Get rid of student level logger
-        logger.removeHandler(logger.handlers[-1])
+    # Main loop through config
+    if args["jobs"] > 1:
+        logger.info("Marking {} student/s across {} worker processes...".format(len(to_mark), args["jobs"]))
+        # Workers send their log records back here so that mark.log and the console still see everything.
+        logqueue = multiprocessing.Queue()
+        listener = QueueListener(logqueue, *logger.handlers, respect_handler_level=True)
+        listener.start()
+        var_list = [[studentid, studentspec, plan, args["fileloc"], logdir, scratchloc, args["testjobs"], cache, fixtures, outputdir, blobs,
+                     testcosts.get(studentid), args["largehistory"]] for studentid, studentspec in to_mark.items()]
+        try:
+            with timed(phases, "marking"), multiprocessing.Pool(args["jobs"], initializer=init_worker, initargs=(logqueue, logger.level)) as p:
+                for studentid, student_results_dict, timings in p.imap_unordered(mark_student_star, var_list):
+                    save(studentid, student_results_dict, timings)
+        finally:
+            listener.stop()
+    else:
+        with timed(phases, "marking"):
+            for studentid, studentspec in to_mark.items():
+                _, student_results_dict, timings = mark_student(studentid, studentspec, plan, args["fileloc"], logdir, scratchloc, args["testjobs"],
+                                                                cache, fixtures, outputdir, blobs, testcosts.get(studentid), args["largehistory"])
+                # Pack student results into overall results
+                save(studentid, student_results_dict, timings)
 
     # Finishing up
-    # logger.info(pformat(overall_results_dict))
+    try:
+        os.rmdir(scratchloc)
+    except OSError:
+        pass
     endtime = datetime.now()
     elapsed = endtime - starttime
     logger.info("Finished marking in {}".format(elapsed))
+    if predicted is not None:
+        logger.info("Marking phase took {:.1f}s, predicted {:.1f}s".format(phases["marking"], predicted))
+        history.add_schedule(predicted, unordered, phases["marking"])
     logger.info("Done!")
     # Save file to output location for further parsing
-    with open(os.path.join(args["outputloc"], "overall_results.json"), "w") as f:
-        json.dump(overall_results_dict, f)
-    return overall_results_dict
+    resultsfile = os.path.join(args["outputloc"], "overall_results.json")
+    with timed(phases, "write_results"):
+        journal.write_json(resultsfile, order=list(students["students"]))
+    if history is not None:
+        phases["total"] = (datetime.now() - starttime).total_seconds()
+        history.finish_run(phases)
+        history.close()
+    if db is not None:
+        db.finish_run()
+        db.close()
+    # Read back from the file just written, as the results of each student were only ever held in memory one at a time.
+    # Long output stays in the blob store until used, as BlobRefs.
+    return load_results(resultsfile, blobs)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Mark a set of files according to a grading structure.")
@@ -406,6 +716,20 @@ if __name__ == '__main__':
     parser.add_argument("outputloc", help="The folder within which to write output and logs.", nargs="?",
                         const="results", default="results")
     parser.add_argument("-d", "--debug", action="store_true", help="enable debugging information")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of students to mark in parallel (default: 1)")
+    parser.add_argument("-t", "--testjobs", type=int, default=1, help="number of tests to run in parallel for each student (default: 1)")
+    parser.add_argument("--nocache", action="store_true", help="rerun every test, ignoring (and not updating) cached results from previous runs")
+    parser.add_argument("--noblobs", action="store_true", help="keep all stdout and linter output inline in the results, rather than in the blob store")
+    parser.add_argument("--nohistory", action="store_true", help="do not add the timings of this run to the timing history")
+    parser.add_argument("--db", nargs="?", const="", default=None, metavar="PATH",
+                        help="also write results into a SQLite database, kept across runs (default path: OUTPUTLOC/results.sqlite)")
+    parser.add_argument("--largehistory", action="store_true",
+                        help="also dock points for files over 100MB committed to a repo's history and deleted since")
+    parser.add_argument("-u", "--unchanged", action="store_true",
+                        help="keep the last results of students that tools/github_interact.py found unchanged, rather than marking them again")
+    parser.add_argument("--strict", action="store_true",
+                        help="abort if there is anything wrong with the marking configuration, rather than leaving out the tests affected")
+    parser.add_argument("-r", "--resume", action="store_true", help="skip students already in the results journal of a previous (interrupted) run")
     parser.add_argument("-n", "--noweekcheck", action="store_true", help="do not check directory structure (could cause later tests to fail unexpectedly, currently unused)")
 
     arglist = parser.parse_args()
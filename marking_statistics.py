@@ -1,70 +1,117 @@
 #!/usr/bin/env python
 import argparse
-import json
 import os
 from pprint import pformat
-from collections import Counter
 import plotext as plt
-from statistics import mean
 
-def count_deduction_reasons(d):
-    reasons = []
-    for module in d.values():
-        reasons += module.get("deductions", {}).get("reasons", [])
-    return reasons
+from markutils.resultsdb import ResultsDB
+from markutils.stats import RESOURCE_METRICS, summarise
 
-def find_timings(d):
-    timings = []
-    for name, module in d.items():
-        timing = module.get("other", {}).get("exectime_s", None)
-        if timing is not None:
-            timings.append([name, timing])
-    return timings
+# Resource usage recorded by the tests in "other", and the chart title for each
+RESOURCE_CHARTS = {
+    "cpu_s": "Most CPU time (user + system, seconds):",
+    "maxrss_kb": "Highest peak memory (max RSS, KB):",
+    "blocks_out": "Most data written (512-byte blocks):",
+    "blocks_in": "Most data read (512-byte blocks):",
+    "procs": "Most processes spawned:",
+}
 
-def main(args):
-    with open(args["results"], "r") as f:
-        results = json.load(f)
+def plot_means(title, values, barplot):
+    """Bar chart of [(name, mean)], largest first."""
+    print("\n\n" + title)
+    valuesmean = dict(sorted(values, key=lambda item: item[1], reverse=True))
+    barplot(valuesmean.keys(), valuesmean.values(), width=plt.tw() - 5)
+    plt.theme("clear")
+    plt.show()
+
+def print_timings(summary, metric="exectime_s"):
+    """Print count, mean, percentiles and max of a metric for every test, then any outliers."""
+    print("\n\nDistribution of {} per script (percentiles estimated to within ~12%):".format(metric))
+    print("{:<28} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10}".format("script", "count", "mean", "p50", "p90", "p99", "max"))
+    ranked = summary.ranked(metric)
+    for name, h in ranked:
+        print("{:<28} {:>6} {:>10.4g} {:>10.4g} {:>10.4g} {:>10.4g} {:>10.4g}".format(
+            name, h.count, h.mean, h.percentile(50), h.percentile(90), h.percentile(99), h.max))
+    outliers = [(name, value, studentid) for name, h in ranked for value, studentid in h.outliers()]
+    if outliers:
+        print("\nOutliers (beyond Q3 + 3 * IQR):")
+        for name, value, studentid in outliers:
+            print("  {:<28} {:<20} {:.4g}".format(name, studentid, value))
+
+def print_histogram(summary, metric="exectime_s"):
+    for name, h in summary.ranked(metric):
+        print("\n{} - {}:".format(name, metric))
+        width = max(n for _, _, n in h.bins())
+        for lower, upper, n in h.bins():
+            print("  {:>10.4g} - {:<10.4g} {:>6} {}".format(lower, upper, n, "#" * max(1, round(40 * n / width))))
+
+def print_frequencies(summary):
+    print("\n\nShare of students losing points on each script:")
+    for name, test in summary.tests.items():
+        frequencies = test.frequencies()
+        if frequencies:
+            print("  {} ({} students): {}".format(name, test.runs, ", ".join(
+                "{} {:.0%}".format(reason, f) for reason, f in frequencies.items())))
+
+def main_db(args, barplot):
+    """Print the same statistics from a results database, letting SQLite do the counting."""
+    db = ResultsDB(args["results"])
+    run_id = args["run"] or db.latest_run()
+    counted_reasons = dict(db.deduction_counts(run_id))
+    print("Reasons for lost points (run {}):".format(run_id))
+    barplot(counted_reasons.keys(), counted_reasons.values(), width=plt.tw() - 5)
+    plt.theme("clear")
+    plt.show()
+    plot_means("Longest running scripts:", db.metric_means("exectime_s", run_id), barplot)
+    if args["resources"]:
+        for k, title in RESOURCE_CHARTS.items():
+            means = db.metric_means(k, run_id)
+            if means:
+                plot_means(title, means, barplot)
+    db.close()
 
+def main(args):
     # barplot = plt.bar
     barplot = plt.simple_bar
     if args["simple"]:
         barplot = plt.simple_bar
 
-    # Count all different error classes
-    reasons = []
-    timings = []
-    for v in results.values():
-        reasons += count_deduction_reasons(v)
-        for w in v.values():
-            reasons += count_deduction_reasons(w)
-            timings += find_timings(w)
-    counted_reasons = Counter(reasons)
-    counted_reasons = {k: v for k, v in sorted(counted_reasons.items(), key=lambda item: item[1], reverse=True)}
-    print("Reasons for lost points:")
+    if args["results"].endswith((".sqlite", ".db")):
+        return main_db(args, barplot)
+
+    # One streaming pass over the results, one student at a time
+    metrics = ("exectime_s",) + (RESOURCE_METRICS if args["resources"] else ())
+    summary = summarise(args["results"], metrics)
+
+    counted_reasons = dict(summary.reasons.most_common())
+    print("Reasons for lost points ({} students):".format(summary.students))
     barplot(counted_reasons.keys(), counted_reasons.values(), width = plt.tw()-5)
     plt.theme("clear")
     plt.show()
     # plt.themes()
     # Find all analysed weeks
 
-    timingsdict = {}
     # Find longest running activities
-    for t in timings:
-        timingsdict.setdefault(t[0], []).append(t[1])
+    plot_means("Longest running scripts:", [(name, h.mean) for name, h in summary.ranked()], barplot)
+    print_timings(summary)
+    if args["histogram"]:
+        print_histogram(summary)
+    print_frequencies(summary)
 
-    print("\n\nLongest running scripts:")
-    timingsmean = {k: mean(v) for k, v in timingsdict.items()}
-    timingsmean = {k: v for k, v in sorted(timingsmean.items(), key=lambda item: item[1], reverse=True)}
-    # print(pformat(timingsmean))
-    barplot(timingsmean.keys(), timingsmean.values(), width=plt.tw() - 5)
-    plt.theme("clear")
-    plt.show()
+    # Find the scripts using the most resources (mean across students)
+    for k, title in RESOURCE_CHARTS.items():
+        if args["resources"] and summary.ranked(k):
+            plot_means(title, [(name, h.mean) for name, h in summary.ranked(k)], barplot)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Print vital statistics from a marking results json.")
-    parser.add_argument("results", help="The results json file to analyse", nargs="?",
+    parser.add_argument("results", help="The results json (or jsonl journal, or .sqlite database written by mark.py --db) to analyse", nargs="?",
                         const="results/overall_results.json", default="results/overall_results.json")
     parser.add_argument("-s", "--simple", action="store_true", help="simple plots")
+    parser.add_argument("-r", "--resources", action="store_true",
+                        help="also chart CPU time, peak memory, block I/O and process counts of each script")
+    parser.add_argument("-g", "--histogram", action="store_true", help="also print a histogram of the run times of each script")
+    parser.add_argument("--run", type=int, default=None, help="run to analyse from a results database (default: the latest)")
 
     arglist = parser.parse_args()
     arglist = vars(arglist)
@@ -0,0 +1 @@
+"""Shared helpers used by mark.py and the test modules in tests/."""
@@ -0,0 +1,116 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+# Key marking a dict in the results as a reference to a blob, e.g. {"$blob": "<sha256>", "bytes": 1234}
+BLOB_KEY = "$blob"
+# Text shorter than this stays inline, as a reference would be no smaller.
+MIN_BYTES = 128
+# Fields of each test's results that are moved into the store.
+BLOB_FIELDS = ("stdout", "linterout")
+
+
+def is_ref(value):
+    return isinstance(value, dict) and BLOB_KEY in value
+
+
+class BlobStore:
+    """A content-addressed store of gzip compressed text, used to keep large, often repeated output out of the results.
+
+    Each blob is stored once under the sha256 of its text, so identical output from any number of
+    students (e.g. the same shellcheck warnings) takes the space of a single copy.
+    """
+    def __init__(self, storeloc):
+        # Only created once something is put in it, so that reading results does not leave an empty store behind.
+        self.storeloc = storeloc
+
+    def _path(self, digest):
+        return os.path.join(self.storeloc, digest[:2], f"{digest}.gz")
+
+    def put(self, text):
+        """Store a str (if not already stored) and return a reference to it."""
+        data = text.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(gzip.compress(data, mtime=0))
+                os.replace(tmppath, path)
+            except BaseException:
+                os.remove(tmppath)
+                raise
+        return {BLOB_KEY: digest, "bytes": len(data)}
+
+    def get(self, ref):
+        """Return the text of a blob, given its reference (or digest)."""
+        digest = ref[BLOB_KEY] if is_ref(ref) else ref
+        with gzip.open(self._path(digest)) as f:
+            return f.read().decode()
+
+    def externalize(self, results, fields=BLOB_FIELDS, min_bytes=MIN_BYTES):
+        """Return a copy of a test's results with its long text fields replaced by blob references.
+
+        :param results: results dict of a single test.
+        :param fields: keys of the fields to move into the store.
+        :param min_bytes: text shorter than this is left inline.
+        :return: dict
+        """
+        results = dict(results)
+        for field in fields:
+            value = results.get(field)
+            if isinstance(value, str) and len(value) >= min_bytes:
+                results[field] = self.put(value)
+        return results
+
+
+class BlobRef:
+    """A reference to a blob, which is only read from the store when its text is asked for."""
+    __slots__ = ("store", "digest", "bytes")
+
+    def __init__(self, store, digest, size=None):
+        self.store = store
+        self.digest = digest
+        self.bytes = size
+
+    @property
+    def text(self):
+        return self.store.get(self.digest)
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"BlobRef({self.digest[:12]}, {self.bytes} bytes)"
+
+
+def store_for(path):
+    """Return the BlobStore of a results file, i.e. the `blobs` folder next to it."""
+    return BlobStore(os.path.join(os.path.dirname(os.path.abspath(path)), "blobs"))
+
+
+def object_hook(store):
+    """Return a json object_hook replacing every blob reference with a BlobRef into the given store."""
+    def _hook(d):
+        if BLOB_KEY in d:
+            return BlobRef(store, d[BLOB_KEY], d.get("bytes"))
+        return d
+    return _hook
+
+
+def load_results(path, store=None):
+    """Load a results json, leaving any blob references unresolved until they are used.
+
+    Memory use is therefore proportional to the metadata in the results, not to all of the
+    captured output.
+
+    :param path: location of the results json (e.g. overall_results.json).
+    :param store: optional BlobStore, defaulting to the `blobs` folder next to the results.
+    :return: the results dict, with every blob reference replaced by a BlobRef.
+    """
+    with open(path) as f:
+        return json.load(f, object_hook=object_hook(store or store_for(path)))
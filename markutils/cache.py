@@ -0,0 +1,157 @@
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+from functools import lru_cache
+
+logger = logging.getLogger("mark")
+
+
+@lru_cache(maxsize=None)
+def source_hash(path):
+    """Return the sha256 hex digest of a source file, only reading it once per process."""
+    return file_hash(path)
+
+
+def file_hash(path):
+    """Return the sha256 hex digest of a file's contents."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1048576), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def marker_hash(extra=()):
+    """Return a hash of the marker's own source: every module of markutils, plus any extra files (e.g. mark.py).
+
+    Results cached by one version of the marker are then never handed out by another.
+
+    :param extra: paths of further source files to include.
+    """
+    package = os.path.dirname(os.path.abspath(__file__))
+    paths = sorted(os.path.join(package, name) for name in os.listdir(package) if name.endswith(".py"))
+    h = hashlib.sha256()
+    for path in paths + [os.path.abspath(p) for p in extra]:
+        h.update(os.path.basename(path).encode())
+        h.update(source_hash(path).encode())
+    return h.hexdigest()
+
+
+def git_tree_hash(path):
+    """Return the git tree hash of a folder, if it is tracked and unmodified in a git repo.
+
+    The tree hash only covers tracked files, so a folder holding any untracked or ignored files (which
+    tests may still read) gets no tree hash either.
+
+    :param path: folder to hash.
+    :return: the tree hash as a str, or None if it could not be determined or the folder has local changes.
+    """
+    try:
+        tree = subprocess.run(["git", "-C", path, "rev-parse", "HEAD:./"], text=True, timeout=30,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if tree.returncode != 0:
+            return None
+        status = subprocess.run(["git", "-C", path, "status", "--porcelain", "--untracked-files=all", "--ignored", "--", "."], text=True, timeout=30,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if status.returncode != 0 or status.stdout.strip():
+        return None
+    return tree.stdout.strip()
+
+
+def folder_hash(path, files=None):
+    """Return a hash identifying the contents of a folder.
+
+    The git tree hash is used where possible as it costs next to nothing. Otherwise every file in
+    the folder is hashed along with its path relative to the folder.
+
+    :param path: folder to hash.
+    :param files: optional list of the paths (relative to path) of every file in the folder, to save walking it.
+    :return: a hex digest prefixed with the method used (e.g. "git:..." or "sha256:...").
+    """
+    tree = git_tree_hash(path)
+    if tree is not None:
+        return f"git:{tree}"
+    if files is None:
+        files = [os.path.relpath(os.path.join(dirpath, name), path) for dirpath, _, filenames in os.walk(path) for name in filenames]
+    h = hashlib.sha256()
+    for relpath in sorted(files):
+        filepath = os.path.join(path, relpath)
+        h.update(relpath.encode())
+        if os.path.islink(filepath):
+            h.update(b"l" + os.readlink(filepath).encode())
+        elif os.path.isfile(filepath):
+            h.update(b"f" + file_hash(filepath).encode())
+    return f"sha256:{h.hexdigest()}"
+
+
+class ResultCache:
+    """A persistent store of test results keyed on everything that can change them.
+
+    Each entry is a small json file named after its key, written atomically so that several marking
+    processes may share one cache. Every key also includes `marker`, the hash of the marker's own
+    source (see marker_hash), so changing the marker invalidates the whole cache.
+    """
+    def __init__(self, cacheloc, marker=None):
+        self.cacheloc = cacheloc
+        self.marker = marker if marker is not None else marker_hash()
+        os.makedirs(cacheloc, exist_ok=True)
+
+    def key(self, *parts):
+        """Build a cache key from any number of json-serialisable parts."""
+        return hashlib.sha256(json.dumps([self.marker, parts], sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cacheloc, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Return the cached value for key, or None if there is none."""
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, key, value):
+        """Store a json-serialisable value under key."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(value, f)
+            os.replace(tmppath, path)
+        except BaseException:
+            os.remove(tmppath)
+            raise
+
+
+class LogRecorder(logging.Handler):
+    """Record the log messages emitted by the current thread, so they can be replayed from the cache."""
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.records = []
+        self.thread = threading.get_ident()
+
+    def emit(self, record):
+        if record.thread != self.thread:
+            return
+        self.records.append({"name": record.name, "levelno": record.levelno, "levelname": record.levelname,
+                             "pathname": record.pathname, "filename": record.filename, "module": record.module,
+                             "lineno": record.lineno, "funcName": record.funcName, "msg": record.getMessage()})
+
+
+def replay(records, target):
+    """Re-emit log records captured by a LogRecorder through a logger.
+
+    :param records: list of record dicts, as stored by LogRecorder.
+    :param target: logger to emit them through.
+    """
+    for record in records:
+        if target.isEnabledFor(record["levelno"]):
+            target.handle(logging.makeLogRecord(record))
@@ -0,0 +1,100 @@
+import gzip
+import logging
+import os
+
+logger = logging.getLogger("mark")
+
+# Bytes of output kept in memory from the start and end of each run, unless configured otherwise.
+HEAD_BYTES = 32768
+TAIL_BYTES = 32768
+
+
+def check_output(output):
+    """Return a list of problems with an output capture config from a module-level config."""
+    if not isinstance(output, dict):
+        return ["'output' must be a dict"]
+    errors = []
+    for name, value in output.items():
+        if name not in ("head_bytes", "tail_bytes"):
+            errors.append("unknown output setting '{}' (expected head_bytes or tail_bytes)".format(name))
+        elif isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            errors.append("output setting '{}' must be a whole number of bytes (not {!r})".format(name, value))
+    return errors
+
+
+class OutputCapture:
+    """How the output of the commands run by a single test should be captured.
+
+    Only the first `head_bytes` and last `tail_bytes` of each run are held in memory. If a run
+    produces more than that, everything it printed is written to a gzip file at `spill_path`
+    (one gzip member per run, so several runs of the same test simply follow one another in it).
+    """
+    def __init__(self, spill_path=None, head_bytes=HEAD_BYTES, tail_bytes=TAIL_BYTES):
+        self.spill_path = spill_path
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        # Totals across every run using this capture
+        self.total_bytes = 0
+        self.spilled = False
+        if spill_path is not None and os.path.exists(spill_path):
+            # Left over from a previous run of the same test
+            os.remove(spill_path)
+
+    def buffer(self):
+        """Return a new BoundedBuffer for a single run."""
+        return BoundedBuffer(self)
+
+    def summary(self):
+        """Return the byte count and spill path of everything captured, for the test results."""
+        return {"stdout_bytes": self.total_bytes, "stdout_spill": self.spill_path if self.spilled else None}
+
+
+class BoundedBuffer:
+    """Collects the output of a single run, keeping at most head + tail bytes in memory."""
+    def __init__(self, capture):
+        self.capture = capture
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self.spill = None
+
+    def write(self, data):
+        self.total += len(data)
+        self.capture.total_bytes += len(data)
+        if self.spill is None and self.total > self.capture.head_bytes + self.capture.tail_bytes:
+            self._start_spill()
+        if self.spill:
+            self.spill.write(data)
+        room = self.capture.head_bytes - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data and self.capture.tail_bytes > 0:
+            self.tail += data
+            if len(self.tail) > self.capture.tail_bytes:
+                del self.tail[:len(self.tail) - self.capture.tail_bytes]
+
+    def _start_spill(self):
+        if self.capture.spill_path is None:
+            self.spill = False
+            return
+        os.makedirs(os.path.dirname(self.capture.spill_path), exist_ok=True)
+        # Fastest compression, as this may be fed a very chatty script for the whole of its timeout.
+        self.spill = gzip.open(self.capture.spill_path, "ab", compresslevel=1)
+        self.capture.spilled = True
+        # Nothing has been dropped yet, so the head and tail still hold everything written so far.
+        self.spill.write(bytes(self.head))
+        self.spill.write(bytes(self.tail))
+
+    def close(self):
+        if self.spill:
+            self.spill.close()
+
+    def getvalue(self):
+        """Return the captured output, with a marker in place of anything dropped from the middle."""
+        omitted = self.total - len(self.head) - len(self.tail)
+        if omitted <= 0:
+            return bytes(self.head + self.tail)
+        # No spill path here: it differs per run and would stop identical output sharing a blob.
+        marker = f"\n\n[... {omitted} bytes omitted ...]\n\n".encode()
+        return bytes(self.head) + marker + bytes(self.tail)
@@ -0,0 +1,104 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+from markutils.workspace import clone_file
+
+logger = logging.getLogger("mark")
+
+
+class FixtureStore:
+    """The input files declared by tests, written to disk once per marking run.
+
+    A test module declares its fixtures in a module-level FIXTURES dict of {filename: contents}, with
+    contents given as str or bytes. Each fixture is stored under the hash of its contents, so identical
+    fixtures are only ever written once and a store may be shared between runs.
+    """
+    def __init__(self, storeloc):
+        self.storeloc = storeloc
+        # (test module name, fixture name) -> path of the stored fixture
+        self.paths = {}
+        os.makedirs(storeloc, exist_ok=True)
+
+    def add(self, modulename, name, contents):
+        """Store a single fixture (if it is not already stored).
+
+        :param modulename: name of the test module declaring the fixture.
+        :param name: file name of the fixture.
+        :param contents: str or bytes to write to the file.
+        :return: path of the stored fixture.
+        """
+        if isinstance(contents, str):
+            contents = contents.encode()
+        path = os.path.join(self.storeloc, f"{hashlib.sha256(contents).hexdigest()[:16]}_{name}")
+        if not os.path.exists(path):
+            fd, tmppath = tempfile.mkstemp(dir=self.storeloc, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(contents)
+                os.chmod(tmppath, 0o444)
+                os.replace(tmppath, path)
+            except BaseException:
+                os.remove(tmppath)
+                raise
+        self.paths[(modulename, name)] = path
+        return path
+
+    def materialize(self, plan):
+        """Store the fixtures of every test in a marking plan.
+
+        :param plan: the marking plan, as returned by build_plan.
+        """
+        for module in plan:
+            for test in module.tests:
+                for name, contents in test.fixtures.items():
+                    self.add(test.modulename, name, contents)
+        logger.debug("Stored {} fixture/s in {}".format(len(self.paths), self.storeloc))
+
+    def placer(self, modulename):
+        """Return a FixturePlacer for the fixtures of a single test module."""
+        return FixturePlacer(self, modulename)
+
+
+class FixturePlacer:
+    """Places the fixtures of one test module into a workspace, recording every file it places.
+
+    Tests receive one of these as testspec["fixtures"] and call place() for each input they need.
+    """
+    def __init__(self, store, modulename):
+        self.store = store
+        self.modulename = modulename
+        self.placed = []
+
+    def place(self, name, destdir, destname=None):
+        """Put a copy of a fixture into a folder.
+
+        Fixtures are reflinked where the filesystem allows it and copied otherwise, just as in the scratch
+        workspace, so a script writing to one cannot change the stored fixture. The placed copy is made
+        writable, as scripts may well open their inputs for writing; only the store itself is read-only.
+
+        :param name: name of the fixture, as declared in the test module's FIXTURES.
+        :param destdir: folder to place it in.
+        :param destname: optional file name to give it, if not its fixture name.
+        :return: path of the placed file.
+        """
+        src = self.store.paths[(self.modulename, name)]
+        dst = os.path.join(destdir, destname or name)
+        if os.path.lexists(dst):
+            os.remove(dst)
+        clone_file(src, dst)
+        os.chmod(dst, 0o644)
+        self.placed.append(dst)
+        return dst
+
+    def cleanup(self):
+        """Remove every fixture placed so far."""
+        for path in self.placed:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        if self.placed:
+            logger.debug("Removed {} placed fixture/s".format(len(self.placed)))
+        self.placed = []
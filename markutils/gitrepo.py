@@ -0,0 +1,139 @@
+import logging
+import os
+import re
+import subprocess
+
+logger = logging.getLogger("mark")
+
+
+def _git(path, *args, input=None):
+    """Run a git command in a repo, returning its stdout, or None if it failed."""
+    try:
+        result = subprocess.run(["git", "-C", path] + list(args), input=input, capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout
+
+
+def head(path):
+    """Return the commit checked out in a git repo, or None if path is not the top level of one."""
+    if not os.path.exists(os.path.join(path, ".git")):
+        return None
+    commit = _git(path, "rev-parse", "--verify", "-q", "HEAD")
+    return commit.strip() if commit else None
+
+
+def is_sparse(path):
+    """Return True if path is the top level of a git repo with a sparse checkout."""
+    if not os.path.exists(os.path.join(path, ".git")):
+        return False
+    return (_git(path, "config", "--bool", "core.sparseCheckout") or "").strip() == "true"
+
+
+def blob_limit(path):
+    """Return N if the repo is a partial clone made with --filter=blob:limit=N (so every missing blob is over N bytes), else None."""
+    spec = (_git(path, "config", "remote.origin.partialclonefilter") or "").strip()
+    match = re.fullmatch(r"blob:limit=(\d+)([kmg]?)", spec.lower())
+    if not match:
+        return None
+    return int(match.group(1)) * {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}[match.group(2)]
+
+
+def large_blobs(path, threshold):
+    """Find every blob in a repo's object store larger than threshold bytes.
+
+    The size of every object (packed, loose or borrowed through alternates) is streamed from a single
+    git cat-file call, without reading any contents or walking the history. Blobs missing from a
+    partial clone are not listed.
+
+    :return: {blob id: size} of the large blobs, or None if git could not be read.
+    """
+    try:
+        proc = subprocess.Popen(["git", "-C", path, "cat-file", "--batch-all-objects", "--unordered",
+                                 "--batch-check=%(objecttype) %(objectname) %(objectsize)"],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    except OSError:
+        return None
+    large = {}
+    with proc:
+        for line in proc.stdout:
+            kind, oid, size = line.split()
+            if kind == "blob" and int(size) > threshold:
+                large[oid] = int(size)
+    if proc.returncode != 0:
+        return None
+    return large
+
+
+def added_in(path, oid):
+    """Return the earliest commit reachable from HEAD adding a blob, or None if there is none."""
+    # Only HEAD, as other refs (e.g. the remote branch of a repo reset to a deadline) may hold commits that are not being marked.
+    # Without rename detection no blob contents are read (or fetched into a partial clone)
+    commits = _git(path, "log", "HEAD", "--no-renames", "--format=%H", "--find-object=" + oid)
+    if not commits or not commits.split():
+        return None
+    return commits.split()[-1]
+
+
+def large_files(path, threshold, history=False):
+    """Find the files larger than threshold bytes committed to a repo, from git rather than the working tree.
+
+    This sees every file committed at HEAD, including those left out of a sparse checkout, and with
+    history set also those deleted since (which still bloat every clone). Blobs missing from a
+    partial clone are never fetched: with a blob:limit filter at or above the threshold they are
+    known to be large, otherwise their size is unknown.
+
+    :param path: top level of the repo.
+    :param threshold: size in bytes.
+    :param history: also look for large files in the history of HEAD, not only in HEAD itself. Commits only
+                    reachable from other refs (e.g. pushed after the deadline the repo was reset to) are ignored.
+    :return: tuple of ([(path, commit that added it)] of large files at HEAD, [paths of files at HEAD of unknown size],
+             [(path, commit that added it)] of large files no longer at HEAD), or None if git could not be read.
+    """
+    blobs = large_blobs(path, threshold)
+    if blobs is None:
+        return None
+    limit = blob_limit(path)
+    partial = bool((_git(path, "config", "remote.origin.partialclonefilter") or "").strip())
+    if not blobs and not partial:
+        # Nothing large and nothing missing, so there is no need to look at any trees
+        return [], [], []
+    listing = _git(path, "ls-tree", "-r", "-z", "--full-tree", "HEAD")
+    if listing is None:
+        return None
+    paths = {}
+    for entry in listing.split("\0"):
+        if not entry:
+            continue
+        meta, relpath = entry.split("\t", 1)
+        mode, kind, oid = meta.split()
+        if kind == "blob":
+            paths.setdefault(oid, []).append(relpath)
+    missing = set()
+    if partial:
+        objects = _git(path, "rev-list", "--objects", "--missing=print", "--no-walk", "HEAD")
+        if objects is None:
+            return None
+        missing = {line[1:] for line in objects.splitlines() if line.startswith("?")}
+    large, unknown = [], []
+    for oid, relpaths in paths.items():
+        if oid in blobs or (oid in missing and limit is not None and limit >= threshold):
+            large += [(relpath, added_in(path, oid)) for relpath in relpaths]
+        elif oid in missing:
+            unknown += relpaths
+    removed = []
+    past = [oid for oid in blobs if oid not in paths]
+    if history and past:
+        # Name each blob by the first path it was seen at in the history of HEAD (objects only reachable from other
+        # refs or the reflog, or borrowed from a reference repo but not part of this one, are skipped)
+        objects = _git(path, "rev-list", "--objects", "HEAD")
+        if objects is None:
+            return None
+        names = {}
+        for line in objects.splitlines():
+            oid, _, relpath = line.partition(" ")
+            names.setdefault(oid, relpath)
+        removed = [(names[oid], added_in(path, oid)) for oid in past if oid in names]
+    return sorted(large), sorted(unknown), sorted(removed)
@@ -0,0 +1,261 @@
+import math
+import os
+import platform
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from markutils.stats import median, robust_z, signed_rank_test
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,
+    finished TEXT,
+    host TEXT,
+    cpus INTEGER,
+    python TEXT,
+    jobs INTEGER,
+    testjobs INTEGER
+);
+CREATE TABLE IF NOT EXISTS test_versions (
+    run_id INTEGER NOT NULL REFERENCES runs,
+    module TEXT NOT NULL,
+    test TEXT NOT NULL,
+    source_hash TEXT,
+    PRIMARY KEY (run_id, module, test)
+);
+CREATE TABLE IF NOT EXISTS test_timings (
+    run_id INTEGER NOT NULL REFERENCES runs,
+    student TEXT NOT NULL,
+    module TEXT NOT NULL,
+    test TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    cached INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS phase_timings (
+    run_id INTEGER NOT NULL REFERENCES runs,
+    student TEXT,
+    phase TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS schedules (
+    run_id INTEGER PRIMARY KEY REFERENCES runs,
+    predicted_s REAL,
+    unordered_s REAL,
+    actual_s REAL
+);
+CREATE INDEX IF NOT EXISTS test_timings_test ON test_timings (module, test, run_id);
+CREATE INDEX IF NOT EXISTS test_timings_student ON test_timings (student, run_id);
+CREATE INDEX IF NOT EXISTS phase_timings_phase ON phase_timings (phase, run_id);
+"""
+
+# Number of earlier runs the timings of a run are compared against by default.
+WINDOW = 5
+# Significance level, and the smallest slowdown (as a ratio of times) worth reporting.
+ALPHA = 0.01
+MIN_RATIO = 1.2
+# Slowdowns of less than this many seconds are not reported for single students.
+MIN_SECONDS = 0.1
+# Robust z-score beyond which a single student's slowdown stands out from everyone else's.
+Z_THRESHOLD = 3.5
+
+
+@contextmanager
+def timed(phases, name):
+    """Add the wall-clock time spent in a with block to phases[name]."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+
+class TimingHistory:
+    """A SQLite store of the timings of every marking run, so that runs can be compared for slowdowns.
+
+    For each run it keeps the host it ran on, the source hash of every test, the exectime_s of every
+    test of every student (flagged if it was replayed from the result cache rather than measured)
+    and the time spent in each phase of the marker itself, both overall and per student.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.run_id = None
+
+    def start_run(self, plan, jobs=1, testjobs=1, resume=False):
+        """Record the start of a run (or continue the last unfinished one, if resuming).
+
+        :param plan: the marking plan, as returned by build_plan.
+        :param jobs: number of students marked at once.
+        :param testjobs: number of tests run at once for each student.
+        :param resume: if True, reuse the latest run that never finished.
+        :return: the run id.
+        """
+        if resume:
+            row = self.conn.execute("SELECT run_id FROM runs WHERE finished IS NULL ORDER BY run_id DESC LIMIT 1").fetchone()
+            if row is not None:
+                self.run_id = row[0]
+                return self.run_id
+        with self.conn:
+            cursor = self.conn.execute("INSERT INTO runs (started, host, cpus, python, jobs, testjobs) VALUES (?, ?, ?, ?, ?, ?)",
+                                       (datetime.now().isoformat(timespec="seconds"), socket.gethostname(), os.cpu_count(),
+                                        platform.python_version(), jobs, testjobs))
+            self.run_id = cursor.lastrowid
+            self.conn.executemany("INSERT INTO test_versions VALUES (?, ?, ?, ?)",
+                                  [(self.run_id, module.moduleid, test.targetfile, test.sourcehash) for module in plan for test in module.tests])
+        return self.run_id
+
+    def add_student(self, studentid, timings):
+        """Record the timings of a single student, replacing any earlier ones of theirs in this run.
+
+        :param studentid: identifier of the student.
+        :param timings: dict of {"tests": [[moduleid, targetfile, seconds, cached]], "phases": {phase: seconds}},
+                        as returned by mark_student.
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM test_timings WHERE run_id = ? AND student = ?", (self.run_id, studentid))
+            self.conn.execute("DELETE FROM phase_timings WHERE run_id = ? AND student = ?", (self.run_id, studentid))
+            self.conn.executemany("INSERT INTO test_timings VALUES (?, ?, ?, ?, ?, ?)",
+                                  [(self.run_id, studentid, moduleid, test, seconds, int(cached))
+                                   for moduleid, test, seconds, cached in timings["tests"] if seconds is not None])
+            self.conn.executemany("INSERT INTO phase_timings VALUES (?, ?, ?, ?)",
+                                  [(self.run_id, studentid, phase, seconds) for phase, seconds in timings["phases"].items()])
+
+    def add_schedule(self, predicted, unordered, actual):
+        """Record the predicted and actual makespan of the marking phase of this run.
+
+        :param predicted: predicted makespan in seconds, in the order the students were marked.
+        :param unordered: predicted makespan in seconds, had the students been marked in students.json order.
+        :param actual: actual wall-clock time of the marking phase in seconds.
+        """
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO schedules VALUES (?, ?, ?, ?)", (self.run_id, predicted, unordered, actual))
+
+    def schedule(self, run_id):
+        """Return (predicted_s, unordered_s, actual_s) of a run, or None if it was not recorded."""
+        return self.conn.execute("SELECT predicted_s, unordered_s, actual_s FROM schedules WHERE run_id = ?", (run_id,)).fetchone()
+
+    def estimates(self, window=WINDOW):
+        """Return {(studentid, module, test): median seconds} of the measured test timings of the last few finished runs."""
+        finished = [row[0] for row in self.runs()][-window:]
+        if not finished:
+            return {}
+        return {key: median(times) for key, times in self._test_times(finished).items()}
+
+    def finish_run(self, phases):
+        """Record the run-level phase timings and mark the run as finished.
+
+        :param phases: dict of {phase: seconds} for the whole run.
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM phase_timings WHERE run_id = ? AND student IS NULL", (self.run_id,))
+            self.conn.executemany("INSERT INTO phase_timings VALUES (?, NULL, ?, ?)",
+                                  [(self.run_id, phase, seconds) for phase, seconds in phases.items()])
+            self.conn.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (datetime.now().isoformat(timespec="seconds"), self.run_id))
+
+    def runs(self):
+        """Return [(run_id, started, host, cpus, jobs, testjobs)] of every finished run, oldest first."""
+        return self.conn.execute("SELECT run_id, started, host, cpus, jobs, testjobs FROM runs "
+                                 "WHERE finished IS NOT NULL ORDER BY run_id").fetchall()
+
+    def _test_times(self, run_ids):
+        """Return {(studentid, module, test): [seconds]} of the measured (not cached) test timings of some runs."""
+        times = {}
+        rows = self.conn.execute("SELECT student, module, test, seconds FROM test_timings WHERE cached = 0 AND run_id IN ({})"
+                                 .format(",".join("?" * len(run_ids))), run_ids)
+        for student, module, test, seconds in rows:
+            times.setdefault((student, module, test), []).append(seconds)
+        return times
+
+    def _phase_times(self, run_ids):
+        """Return {(studentid or None, phase): [seconds]} of the phase timings of some runs."""
+        times = {}
+        rows = self.conn.execute("SELECT student, phase, seconds FROM phase_timings WHERE run_id IN ({})"
+                                 .format(",".join("?" * len(run_ids))), run_ids)
+        for student, phase, seconds in rows:
+            times.setdefault((student, phase), []).append(seconds)
+        return times
+
+    def changed_tests(self, run_id, baseline):
+        """Return the set of (module, test) whose source differs between a run and any of its baseline runs."""
+        rows = self.conn.execute("SELECT module, test, source_hash, run_id = ? FROM test_versions WHERE run_id IN ({})"
+                                 .format(",".join("?" * (len(baseline) + 1))), [run_id, run_id] + baseline)
+        current, previous = {}, {}
+        for module, test, source_hash, is_current in rows:
+            if is_current:
+                current[(module, test)] = source_hash
+            else:
+                previous.setdefault((module, test), set()).add(source_hash)
+        return {key for key, source_hash in current.items() if key in previous and previous[key] != {source_hash}}
+
+    def compare(self, run_id=None, window=WINDOW, alpha=ALPHA, min_ratio=MIN_RATIO, min_seconds=MIN_SECONDS):
+        """Compare the timings of a run with those of the runs before it.
+
+        Each student's time for each test (and for each per-student phase of the marker) is compared
+        with the median of their times over the baseline runs. A test or phase is flagged when a
+        one-sided Wilcoxon signed-rank test over the students finds it significantly slower and the
+        median slowdown is at least min_ratio. A single student is flagged when their slowdown on a
+        test stands out from everyone else's (robust z-score over Z_THRESHOLD). Run-level phases have
+        one value per run, so are flagged when they lie over Z_THRESHOLD from the baseline runs.
+
+        :param run_id: the run to check, defaulting to the latest finished run.
+        :param window: number of earlier finished runs to use as the baseline.
+        :param alpha: significance level of the tests.
+        :param min_ratio: smallest median slowdown (new time / old time) to flag.
+        :param min_seconds: smallest slowdown of a single student to flag.
+        :return: dict with the run, baseline run ids, changed tests and per-test, per-student and per-phase findings.
+        """
+        finished = [row[0] for row in self.runs()]
+        if run_id is None:
+            if not finished:
+                raise ValueError("No finished runs in {}".format(self.path))
+            run_id = finished[-1]
+        baseline = [r for r in finished if r < run_id][-window:]
+        report = {"run": run_id, "baseline": baseline, "changed_tests": self.changed_tests(run_id, baseline) if baseline else set(),
+                  "tests": [], "students": [], "phases": []}
+        if not baseline:
+            return report
+
+        # Student scripts, and the marker's per-student phases, are compared student by student
+        current, previous = self._test_times([run_id]), self._test_times(baseline)
+        paired = {}
+        for key, times in current.items():
+            if key in previous:
+                paired.setdefault(key[1:], []).append((key[0], median(times), median(previous[key])))
+        phase_current, phase_previous = self._phase_times([run_id]), self._phase_times(baseline)
+        for (student, phase), times in phase_current.items():
+            if student is not None and (student, phase) in phase_previous:
+                paired.setdefault(("(marker)", phase), []).append((student, median(times), median(phase_previous[(student, phase)])))
+
+        for (module, test), pairs in sorted(paired.items()):
+            logratios = [math.log(new / old) for _, new, old in pairs if new > 0 and old > 0]
+            n, p = signed_rank_test(logratios)
+            ratio = math.exp(median(logratios)) if logratios else None
+            report["tests"].append({"module": module, "test": test, "students": len(pairs), "ratio": ratio, "p": p,
+                                    "old_s": median([old for _, _, old in pairs]), "new_s": median([new for _, new, _ in pairs]),
+                                    "flagged": p is not None and p < alpha and ratio >= min_ratio})
+            for student, new, old in pairs:
+                if new <= 0 or old <= 0 or new - old < min_seconds or new / old < min_ratio:
+                    continue
+                z = robust_z(math.log(new / old), logratios)
+                if z is not None and z > Z_THRESHOLD:
+                    report["students"].append({"module": module, "test": test, "student": student, "old_s": old, "new_s": new, "z": z})
+
+        # Phases of the whole run only have one value per run
+        for (student, phase), times in sorted(phase_current.items(), key=lambda item: item[0][1]):
+            history = phase_previous.get((None, phase), [])
+            if student is not None or not history:
+                continue
+            new, old = times[0], median(history)
+            z = robust_z(new, history) if len(history) >= 3 else None
+            report["phases"].append({"phase": phase, "runs": len(history), "old_s": old, "new_s": new, "z": z,
+                                     "flagged": z is not None and z > Z_THRESHOLD and old > 0 and new / old >= min_ratio})
+        return report
+
+    def close(self):
+        self.conn.close()
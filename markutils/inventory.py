@@ -0,0 +1,156 @@
+import logging
+import os
+
+logger = logging.getLogger("mark")
+
+
+def _norm(relpath):
+    relpath = os.path.normpath(relpath)
+    return "" if relpath == "." else relpath
+
+
+class Inventory:
+    """A snapshot of every file and folder within a student's repo, taken in a single pass.
+
+    The tree is walked once with os.scandir (skipping .git), recording the size of every file along
+    with an index of lowercased names per folder. Repo, module and test checks then query this rather
+    than walking or stat-ing the filesystem themselves. All paths are relative to the repo root.
+    """
+    def __init__(self, root):
+        self.root = root
+        # relative folder -> ([subfolder names], [file names]), in scandir order just like os.walk
+        self.folders = {}
+        # relative file path -> size in bytes
+        self.sizes = {}
+        # relative folder -> {lowercased name: [actual names]}
+        self.lower = {}
+        # relative paths of symlinks (to files or folders)
+        self.links = set()
+
+    @classmethod
+    def scan(cls, root):
+        """Build the inventory of a folder.
+
+        :param root: folder to scan.
+        :return: Inventory
+        """
+        inventory = cls(root)
+        stack = [""]
+        while stack:
+            reldir = stack.pop()
+            dirnames, filenames = [], []
+            try:
+                with os.scandir(os.path.join(root, reldir)) as it:
+                    for entry in it:
+                        if entry.is_symlink():
+                            inventory.links.add(os.path.join(reldir, entry.name))
+                        if entry.is_dir():
+                            if entry.name == ".git":
+                                continue
+                            dirnames.append(entry.name)
+                            # Like os.walk, list symlinked folders but don't descend into them.
+                            if not entry.is_symlink():
+                                stack.append(os.path.join(reldir, entry.name))
+                        else:
+                            filenames.append(entry.name)
+                            try:
+                                size = entry.stat().st_size
+                            except OSError:
+                                size = 0
+                            inventory.sizes[os.path.join(reldir, entry.name)] = size
+            except OSError as e:
+                logger.debug("Could not scan {}: {}".format(os.path.join(root, reldir), e))
+            inventory._add(reldir, dirnames, filenames)
+        return inventory
+
+    def _add(self, reldir, dirnames, filenames):
+        self.folders[reldir] = (dirnames, filenames)
+        lower = {}
+        for name in dirnames + filenames:
+            lower.setdefault(name.lower(), []).append(name)
+        self.lower[reldir] = lower
+
+    def add_dir(self, reldir):
+        """Record a newly created (empty) folder."""
+        reldir = _norm(reldir)
+        parent, name = os.path.split(reldir)
+        if reldir in self.folders or parent not in self.folders:
+            return
+        self.folders[parent][0].append(name)
+        self.lower[parent].setdefault(name.lower(), []).append(name)
+        self._add(reldir, [], [])
+
+    def islink(self, relpath):
+        return _norm(relpath) in self.links
+
+    def isdir(self, relpath):
+        return _norm(relpath) in self.folders
+
+    def isfile(self, relpath):
+        return _norm(relpath) in self.sizes
+
+    def exists(self, relpath):
+        return self.isdir(relpath) or self.isfile(relpath)
+
+    def size(self, relpath):
+        return self.sizes[_norm(relpath)]
+
+    def listdir(self, reldir):
+        """Return the ([subfolders], [files]) directly within a folder (empty lists if it does not exist)."""
+        return self.folders.get(_norm(reldir), ([], []))
+
+    def find(self, reldir, name):
+        """Return the names within a folder that match name case-insensitively."""
+        return list(self.lower.get(_norm(reldir), {}).get(name.lower(), []))
+
+    def walk(self, reldir=""):
+        """Yield (reldir, [subfolders], [files]) for a folder and everything below it, like os.walk."""
+        stack = [_norm(reldir)]
+        while stack:
+            current = stack.pop(0)
+            if current not in self.folders:
+                continue
+            dirnames, filenames = self.folders[current]
+            yield current, dirnames, filenames
+            stack[0:0] = [os.path.join(current, d) for d in dirnames]
+
+    def files(self, reldir=""):
+        """Return the relative paths of every file in a folder and its subfolders."""
+        return [os.path.join(current, f) for current, _, filenames in self.walk(reldir) for f in filenames]
+
+    def large_files(self, threshold):
+        """Return the relative paths of every file larger than threshold bytes."""
+        return [relpath for relpath, size in self.sizes.items() if size > threshold]
+
+
+def find_target(studentspec, modulespec, targetfile, testspec, deductions):
+    """Find the file a test is for in a student's code folder, allowing for different capitalisation.
+
+    Looks the file up in the inventory of the student's repo taken by mark.py, and docks a point
+    (with the reason "file_missing") if it is required but absent.
+
+    :param studentspec: the data of the student, including their inventory.
+    :param modulespec: the metadata of the module, including detected folder names.
+    :param targetfile: name of the file to look for.
+    :param testspec: the test specification, for whether the file is required.
+    :param deductions: the deductions dict of the test, updated in place.
+    :return: the name of the file found (or targetfile if it is absent but not required), or None if it is required but absent.
+    """
+    # Logged on behalf of the calling test, so the log shows which test found (or missed) the file.
+    inventory = studentspec["inventory"]
+    coderelpath = os.path.join(modulespec["folder"], modulespec["codeloc"])
+    if inventory.isfile(os.path.join(coderelpath, targetfile)):
+        logger.debug("File {} present!".format(targetfile), stacklevel=2)
+        return targetfile
+    # Try to find a matching but differently capitalised file
+    potential_files = inventory.find(coderelpath, targetfile)
+    if len(potential_files) > 0:
+        logger.warning("Inferred target file as {}".format(potential_files[0]), stacklevel=2)
+        return potential_files[0]
+    if not testspec["required"]:
+        logger.warning("File {} absent but not required!".format(targetfile), stacklevel=2)
+        return targetfile
+    logger.critical("File {} absent!".format(targetfile), stacklevel=2)
+    deductions["value"] += 1
+    deductions["reasons"].append("file_missing")
+    return None
@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger("mark")
+
+
+class ResultsJournal:
+    """An append-only jsonl file holding the results of each student as soon as they are marked.
+
+    Each line is a json object of the form {"student": <STUDENTID>, "results": {...}}, plus an
+    optional "meta" dict of details about how the results were obtained (e.g. the commit marked). Only the
+    byte offset of each student's entry is kept in memory, so the results of a whole cohort never
+    need to be held at once.
+    """
+    def __init__(self, path, resume=False):
+        """Open a journal, either continuing from an existing file or starting afresh.
+
+        :param path: location of the jsonl file.
+        :param resume: if True keep the entries already in the file, otherwise truncate it.
+        """
+        self.path = path
+        self.offsets = {}
+        if resume and os.path.exists(path):
+            self._scan()
+        else:
+            open(path, "w").close()
+
+    def _scan(self):
+        """Index an existing journal, dropping any partially written entry at the end."""
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    studentid = json.loads(line)["student"]
+                except (ValueError, KeyError) as e:
+                    logger.warning("Discarding unreadable journal entry at byte {} of {} ({})".format(offset, self.path, e))
+                    break
+                self.offsets[studentid] = offset
+                offset += len(line)
+        with open(self.path, "ab") as f:
+            f.truncate(offset)
+
+    def completed(self):
+        """Return the set of student ids which already have results in the journal."""
+        return set(self.offsets)
+
+    def append(self, studentid, results, meta=None):
+        """Write the results of a student to the journal and flush them to disk.
+
+        :param studentid: identifier of the student.
+        :param results: results dict for that student.
+        :param meta: optional dict of details to keep alongside the results, which are not part of them.
+        """
+        entry = {"student": studentid, "results": results}
+        if meta:
+            entry["meta"] = meta
+        line = (json.dumps(entry) + "\n").encode()
+        with open(self.path, "ab") as f:
+            self.offsets[studentid] = f.tell()
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def iter_entries(self, order=None):
+        """Stream (studentid, results, meta) from the journal, one student at a time.
+
+        If a student appears more than once, only their latest entry is used.
+
+        :param order: optional list of student ids giving the order to yield them in. Students in the
+                      journal but not in this list are yielded afterwards in journal order.
+        """
+        order = [s for s in (order or []) if s in self.offsets]
+        ordered = set(order)
+        order += [s for s in self.offsets if s not in ordered]
+        with open(self.path, "rb") as f:
+            for studentid in order:
+                f.seek(self.offsets[studentid])
+                entry = json.loads(f.readline())
+                yield studentid, entry["results"], entry.get("meta", {})
+
+    def iter_results(self, order=None):
+        """Stream (studentid, results) pairs from the journal, as iter_entries."""
+        for studentid, results, _ in self.iter_entries(order):
+            yield studentid, results
+
+    def write_json(self, path, order=None):
+        """Assemble a single json file of all results by streaming over the journal.
+
+        The output is equivalent to json.dump of a dict of {studentid: results}.
+
+        :param path: location of the json file to write.
+        :param order: optional list of student ids giving the order of the output.
+        """
+        with open(path, "w") as out:
+            out.write("{")
+            for i, (studentid, results) in enumerate(self.iter_results(order)):
+                if i > 0:
+                    out.write(", ")
+                out.write(json.dumps(studentid))
+                out.write(": ")
+                json.dump(results, out)
+            out.write("}")
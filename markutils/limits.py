@@ -0,0 +1,164 @@
+import logging
+import os
+import signal
+import sys
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where commands are simply run without limits.
+    resource = None
+
+logger = logging.getLogger("mark")
+
+# The limits that may be set on a student script, with the text its output is likely to contain
+# (e.g. from bash, coreutils or python) if it ran into them. The text only counts if the script failed,
+# as a script may well print or handle these errors itself.
+LIMITS = {
+    "address_space_mb": ["Cannot allocate memory", "MemoryError", "std::bad_alloc", "out of memory"],
+    "cpu_s": ["CPU time limit exceeded"],
+    "file_size_mb": ["File size limit exceeded", "File too large"],
+    "open_files": ["Too many open files"],
+    "processes": ["Resource temporarily unavailable"],
+}
+
+# Signals sent by the kernel when a limit is hit, which kill the process by default.
+LIMIT_SIGNALS = {"cpu_s": signal.SIGXCPU, "file_size_mb": signal.SIGXFSZ} if hasattr(signal, "SIGXCPU") else {}
+
+
+def check_limits(limits):
+    """Return a list of problems with a dict of limits from a module-level config."""
+    if not isinstance(limits, dict):
+        return ["'limits' must be a dict"]
+    errors = []
+    for name, value in limits.items():
+        if name not in LIMITS:
+            errors.append("unknown limit '{}' (expected one of {})".format(name, ", ".join(LIMITS)))
+        elif isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            errors.append("limit '{}' must be a positive number (not {!r})".format(name, value))
+    return errors
+
+
+# Processes (and threads) the marking user already had running, counted once per marking process.
+_base_tasks = None
+
+
+def _user_tasks():
+    """Count the processes (and threads) owned by the current user, as RLIMIT_NPROC does."""
+    uid = os.getuid()
+    count = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            if os.stat(f"/proc/{entry}").st_uid == uid:
+                count += len(os.listdir(f"/proc/{entry}/task"))
+        except OSError:
+            continue
+    return count
+
+
+def rlimits(limits, concurrent=1):
+    """Convert a dict of limits into the (resource, (soft, hard)) pairs to apply to a command.
+
+    The `processes` limit itself is enforced per command by the runner, which kills a command's tree
+    once it has more than that many processes running. As that only notices between two scans of
+    /proc, RLIMIT_NPROC is set as well to stop a fork bomb outright. It counts every process of the
+    user rather than just those of the command, so it is applied on top of however many the user was
+    running when first asked (counted once, as listing /proc for every command is slow), with room
+    for that many processes for each of the commands that may be running alongside it.
+
+    :param limits: dict of limit name to value, as in LIMITS.
+    :param concurrent: the number of commands that may be running at once.
+    :return: list of (resource.RLIMIT_*, (soft, hard)).
+    """
+    global _base_tasks
+    if not limits:
+        return []
+    if resource is None:
+        logger.debug("Resource limits are not supported on this platform, ignoring them")
+        return []
+    pairs = []
+    if "address_space_mb" in limits:
+        value = int(limits["address_space_mb"] * 1048576)
+        pairs.append((resource.RLIMIT_AS, (value, value)))
+    if "cpu_s" in limits:
+        # Leave a second between SIGXCPU and SIGKILL, so a breach can be told apart from other kills.
+        value = max(int(limits["cpu_s"]), 1)
+        pairs.append((resource.RLIMIT_CPU, (value, value + 1)))
+    if "file_size_mb" in limits:
+        value = int(limits["file_size_mb"] * 1048576)
+        pairs.append((resource.RLIMIT_FSIZE, (value, value)))
+    if "open_files" in limits:
+        value = int(limits["open_files"])
+        pairs.append((resource.RLIMIT_NOFILE, (value, value)))
+    if "processes" in limits and os.path.isdir("/proc"):
+        if _base_tasks is None:
+            _base_tasks = _user_tasks()
+        value = _base_tasks + int(limits["processes"]) * concurrent
+        pairs.append((resource.RLIMIT_NPROC, (value, value)))
+    return pairs
+
+
+# Applies the limits in a fresh interpreter and then execs the command in its place, so that nothing has to
+# run between fork and exec in the marking process (which is unsafe there, as it has threads running).
+_SHIM = """
+import os, resource, sys
+try:
+    for pair in sys.argv[1].split(","):
+        res, soft, hard = map(int, pair.split(":"))
+        resource.setrlimit(res, (soft, hard))
+except (ValueError, OSError) as e:
+    sys.stderr.write("MARKER ERROR - could not apply resource limits: {}\\n".format(e))
+    sys.exit(126)
+try:
+    os.execvp(sys.argv[2], sys.argv[2:])
+except OSError:
+    sys.stderr.write(sys.argv[2] + ": command not found\\n")
+    sys.exit(127)
+"""
+
+
+def wrap(argv, pairs):
+    """Return the argv running a command under some rlimits, which keeps its pid once running.
+
+    :param argv: list of the program and its arguments.
+    :param pairs: list of (resource.RLIMIT_*, (soft, hard)), as returned by rlimits.
+    """
+    if not pairs:
+        return argv
+    spec = ",".join("{}:{}:{}".format(res, soft, hard) for res, (soft, hard) in pairs)
+    return [sys.executable, "-I", "-S", "-c", _SHIM, spec] + list(argv)
+
+
+def breached(limits, returncode, output, resources=None, killed=False):
+    """Work out which limits (if any) a finished command appears to have run into.
+
+    RLIMIT_CPU applies to each process on its own, so `cpu_s` is only reported when a process was
+    actually stopped by it: by SIGXCPU, or by the SIGKILL that follows a second later if SIGXCPU
+    was caught or ignored (unless the runner killed the command itself, or the command as a whole
+    used less CPU time than that, so was killed by something else). CPU time spread over several
+    processes is never compared against it.
+
+    :param limits: dict of the limits the command was run under.
+    :param returncode: the return code of the command.
+    :param output: the combined stdout and stderr of the command.
+    :param resources: optional resource usage of the command, as in RunResult.resources.
+    :param killed: whether the runner killed the command itself (e.g. for timing out).
+    :return: sorted list of the names of the limits breached.
+    """
+    found = set()
+    for name in limits or {}:
+        sig = LIMIT_SIGNALS.get(name)
+        # Killed directly (negative code) or a shell reporting a killed child (128 + signal)
+        if sig is not None and returncode in (-sig, 128 + sig):
+            found.add(name)
+        elif returncode != 0 and any(marker in (output or "") for marker in LIMITS[name]):
+            found.add(name)
+    hard_killed = "cpu_s" in LIMIT_SIGNALS and returncode in (-signal.SIGKILL, 128 + signal.SIGKILL)
+    if "cpu_s" in (limits or {}) and hard_killed and not killed:
+        if not resources or resources.get("cpu_user_s") is None:
+            found.add("cpu_s")
+        elif resources["cpu_user_s"] + resources["cpu_sys_s"] >= limits["cpu_s"]:
+            found.add("cpu_s")
+    return sorted(found)
@@ -0,0 +1,160 @@
+import hashlib
+import importlib
+import json
+import logging
+import os
+from collections import namedtuple
+
+from markutils.cache import source_hash
+from markutils.capture import check_output
+from markutils.limits import check_limits
+
+logger = logging.getLogger("mark")
+
+# A single test, with its test module already loaded and its main function bound.
+PlannedTest = namedtuple("PlannedTest", ["targetfile", "testspec", "modulename", "func", "sourcehash", "fixtures"])
+# A module to mark, with its module-level config loaded and all of its tests planned.
+PlannedModule = namedtuple("PlannedModule", ["moduleid", "modulespec", "module_config", "tests"])
+
+
+class PlanError(Exception):
+    """Raised when the marking configuration is invalid. `errors` holds a message for every problem found."""
+    def __init__(self, errors):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+def _check_module_config(module_config, modulespec):
+    """Return the problems with a module-level config.
+
+    :return: tuple of a list of problems with the module as a whole, and {targetfile: [problems]} of those
+             only affecting a single test.
+    """
+    errors = []
+    test_errors = {}
+    name = f"{modulespec['name']}_config.json"
+    if module_config.get("name") != modulespec["name"]:
+        errors.append("{}: 'name' is {!r} but config.json expects {!r}".format(name, module_config.get("name"), modulespec["name"]))
+    if not isinstance(module_config.get("tests"), dict):
+        errors.append("{}: 'tests' must be a dict of test specifications".format(name))
+    if not isinstance(module_config.get("extra_files"), list):
+        errors.append("{}: 'extra_files' must be a list of file names".format(name))
+    if "limits" in module_config:
+        errors += ["{}: {}".format(name, e) for e in check_limits(module_config["limits"])]
+    if "output" in module_config:
+        errors += ["{}: {}".format(name, e) for e in check_output(module_config["output"])]
+    for targetfile, testspec in (module_config.get("tests") or {}).items():
+        found = test_errors.setdefault(targetfile, [])
+        if not isinstance(testspec, dict) or "testfile" not in testspec:
+            found.append("{}: test '{}' has no 'testfile'".format(name, targetfile))
+            continue
+        if testspec.get("required") not in (0, 1):
+            found.append("{}: test '{}' must have 'required' set to 1 or 0".format(name, targetfile))
+        timeout = testspec.get("timeout", 600)
+        if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0:
+            found.append("{}: test '{}' has an invalid 'timeout' ({!r})".format(name, targetfile, timeout))
+        if "limits" in testspec:
+            found += ["{}: test '{}': {}".format(name, targetfile, e) for e in check_limits(testspec["limits"])]
+        if "output" in testspec:
+            found += ["{}: test '{}': {}".format(name, targetfile, e) for e in check_output(testspec["output"])]
+    return errors, {targetfile: found for targetfile, found in test_errors.items() if found}
+
+
+def _check_fixtures(fixtures):
+    """Return a list of problems with the FIXTURES declared by a test module."""
+    if not isinstance(fixtures, dict):
+        return ["FIXTURES must be a dict of {filename: contents}"]
+    errors = []
+    for name, contents in fixtures.items():
+        if not isinstance(name, str) or not name or os.path.basename(name) != name or name in (".", ".."):
+            errors.append("fixture name {!r} must be a plain file name".format(name))
+        elif not isinstance(contents, (str, bytes)):
+            errors.append("fixture '{}' must be str or bytes".format(name))
+    return errors
+
+
+def build_plan(config, pathstub="", strict=False):
+    """Load and validate every module config and test module named in the course config.
+
+    Everything is checked before any marking takes place, so that configuration errors are found
+    straight away rather than when the first student reaches them. Every problem found is logged,
+    and the tests (or whole modules) it affects are left out of the plan, so that one broken test
+    does not hold up the marking of all the others.
+
+    :param config: the overarching marking configuration, pulled from config.json.
+    :param pathstub: prefix to apply to each module's test_location.
+    :param strict: raise PlanError for any problem at all, rather than leaving out what it affects.
+    :return: tuple of PlannedModules, in the order given in config.
+    :raises PlanError: if strict and any part of the configuration is invalid, or if nothing valid is left to mark.
+    """
+    errors = []
+    plan = []
+    dropped_modules = dropped_tests = 0
+    for moduleid, modulespec in config.items():
+        missing = [key for key in ("name", "test_location", "folder") if key not in modulespec]
+        if missing:
+            errors.append("config.json: module '{}' is missing {}".format(moduleid, ", ".join(missing)))
+            dropped_modules += 1
+            continue
+        testloc = os.path.join(pathstub, modulespec["test_location"])
+        try:
+            with open(os.path.join(testloc, f"{modulespec['name']}_config.json")) as f:
+                module_config = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            errors.append("{}: could not load module config: {}".format(moduleid, e))
+            dropped_modules += 1
+            continue
+        module_errors, test_errors = _check_module_config(module_config, modulespec)
+        errors += module_errors
+        if module_errors:
+            errors += [e for found in test_errors.values() for e in found]
+            dropped_modules += 1
+            continue
+
+        tests = []
+        for targetfile, testspec in module_config["tests"].items():
+            if targetfile in test_errors:
+                errors += test_errors[targetfile]
+                dropped_tests += 1
+                continue
+            modulename = f"tests.{modulespec['name']}.{os.path.splitext(testspec['testfile'])[0]}"
+            try:
+                testmodule = importlib.import_module(modulename)
+            except ImportError as e:
+                errors.append("{}_config.json: test file '{}' for '{}' could not be loaded ({})".format(modulespec["name"], testspec["testfile"], targetfile, e))
+                dropped_tests += 1
+                continue
+            if not callable(getattr(testmodule, "main", None)):
+                errors.append("{}: test file has no main() function".format(testspec["testfile"]))
+                dropped_tests += 1
+                continue
+            # Tests inherit any module-level limits and output settings they do not set themselves.
+            for key in ("limits", "output"):
+                module_value = module_config.get(key) if isinstance(module_config.get(key), dict) else {}
+                test_value = testspec.get(key) if isinstance(testspec.get(key), dict) else {}
+                if module_value or test_value:
+                    testspec = dict(testspec, **{key: dict(module_value, **test_value)})
+            fixtures = getattr(testmodule, "FIXTURES", {})
+            fixture_errors = _check_fixtures(fixtures)
+            if fixture_errors:
+                errors += ["{}: {}".format(testspec["testfile"], e) for e in fixture_errors]
+                dropped_tests += 1
+                continue
+            tests.append(PlannedTest(targetfile, testspec, modulename, testmodule.main, source_hash(testmodule.__file__), fixtures))
+        plan.append(PlannedModule(moduleid, modulespec, module_config, tuple(tests)))
+
+    if errors and (strict or not any(module.tests for module in plan)):
+        raise PlanError(errors)
+    for error in errors:
+        logger.critical("CONFIG ERROR - {}".format(error))
+    if errors:
+        logger.critical("Marking without the {} module/s and {} test/s affected by these errors".format(dropped_modules, dropped_tests))
+    logger.debug("Planned {} module/s, {} test/s".format(len(plan), sum(len(m.tests) for m in plan)))
+    return tuple(plan)
+
+
+def fingerprint(plan):
+    """Return a hash identifying a marking plan, which changes whenever any module, test or its config does."""
+    parts = [[module.moduleid, module.modulespec, module.module_config,
+              [[test.targetfile, test.sourcehash, test.testspec] for test in module.tests]] for module in plan]
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
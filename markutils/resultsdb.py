@@ -0,0 +1,195 @@
+import json
+import socket
+import sqlite3
+from datetime import datetime
+
+from markutils.blobs import BLOB_KEY, is_ref
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,
+    finished TEXT,
+    host TEXT,
+    config TEXT
+);
+CREATE TABLE IF NOT EXISTS students (
+    run_id INTEGER NOT NULL REFERENCES runs,
+    student TEXT NOT NULL,
+    name TEXT,
+    folder TEXT,
+    repo_deduction REAL,
+    PRIMARY KEY (run_id, student)
+);
+CREATE TABLE IF NOT EXISTS modules (
+    run_id INTEGER NOT NULL REFERENCES runs,
+    student TEXT NOT NULL,
+    module TEXT NOT NULL,
+    deduction REAL,
+    PRIMARY KEY (run_id, student, module)
+);
+CREATE TABLE IF NOT EXISTS tests (
+    run_id INTEGER NOT NULL REFERENCES runs,
+    student TEXT NOT NULL,
+    module TEXT NOT NULL,
+    test TEXT NOT NULL,
+    deduction REAL,
+    stdout TEXT,
+    stdout_blob TEXT,
+    linterout TEXT,
+    linterout_blob TEXT,
+    other TEXT,
+    PRIMARY KEY (run_id, student, module, test)
+);
+CREATE TABLE IF NOT EXISTS deductions (
+    run_id INTEGER NOT NULL REFERENCES runs,
+    student TEXT NOT NULL,
+    module TEXT,
+    test TEXT,
+    reason TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS timings (
+    run_id INTEGER NOT NULL REFERENCES runs,
+    student TEXT NOT NULL,
+    module TEXT NOT NULL,
+    test TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS tests_student ON tests (student);
+CREATE INDEX IF NOT EXISTS tests_test ON tests (test, run_id);
+CREATE INDEX IF NOT EXISTS deductions_student ON deductions (student, run_id);
+CREATE INDEX IF NOT EXISTS deductions_test ON deductions (test, run_id);
+CREATE INDEX IF NOT EXISTS deductions_reason ON deductions (reason, run_id);
+CREATE INDEX IF NOT EXISTS timings_test ON timings (test, metric, run_id);
+CREATE INDEX IF NOT EXISTS timings_student ON timings (student, run_id);
+"""
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _deductions(value):
+    """Return a deductions field as a dict, as older results hold a bare number where a check had no reasons."""
+    if value is None:
+        return {}
+    if isinstance(value, dict):
+        return value
+    return {"value": value, "reasons": []}
+
+
+def _text(value):
+    """Split a stdout/linterout field into (inline text, blob digest)."""
+    if is_ref(value):
+        return None, value[BLOB_KEY]
+    return value, None
+
+
+class ResultsDB:
+    """A SQLite database of marking results, kept across runs so they can be queried with indexed SQL.
+
+    Each run of mark.py gets a row in `runs`, and the results of every student marked in it are
+    spread over the `students`, `modules`, `tests`, `deductions` and `timings` tables. Only the
+    marking process writes to the database, one transaction per student.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.run_id = None
+
+    def start_run(self, config=None, resume=False):
+        """Record the start of a run (or continue the last unfinished one, if resuming).
+
+        :param config: the overarching marking configuration, stored for reference.
+        :param resume: if True, reuse the latest run that never finished.
+        :return: the run id.
+        """
+        if resume:
+            row = self.conn.execute("SELECT run_id FROM runs WHERE finished IS NULL ORDER BY run_id DESC LIMIT 1").fetchone()
+            if row is not None:
+                self.run_id = row[0]
+                return self.run_id
+        with self.conn:
+            cursor = self.conn.execute("INSERT INTO runs (started, host, config) VALUES (?, ?, ?)",
+                                       (_now(), socket.gethostname(), json.dumps(config)))
+        self.run_id = cursor.lastrowid
+        return self.run_id
+
+    def finish_run(self):
+        with self.conn:
+            self.conn.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (_now(), self.run_id))
+
+    def add_student(self, studentid, studentspec, results):
+        """Write the results of a single student, replacing any earlier results of theirs in this run.
+
+        :param studentid: identifier of the student.
+        :param studentspec: the data of the student, pulled from students.json.
+        :param results: results dict for that student, as returned by mark_student.
+        """
+        run = self.run_id
+        with self.conn:
+            for table in ("students", "modules", "tests", "deductions", "timings"):
+                self.conn.execute(f"DELETE FROM {table} WHERE run_id = ? AND student = ?", (run, studentid))
+            repo = _deductions(results.get("repo_results", {}).get("deductions", {}))
+            self.conn.execute("INSERT INTO students VALUES (?, ?, ?, ?, ?)",
+                              (run, studentid, studentspec.get("name"), studentspec.get("folder"), repo.get("value")))
+            self._add_deductions(studentid, None, None, repo)
+            for moduleid, module_results in results.items():
+                if moduleid == "repo_results" or not isinstance(module_results, dict):
+                    continue
+                week = _deductions(module_results.get("weekchecker_results", {}).get("deductions", {}))
+                self.conn.execute("INSERT INTO modules VALUES (?, ?, ?, ?)", (run, studentid, moduleid, week.get("value")))
+                self._add_deductions(studentid, moduleid, None, week)
+                for test, test_results in module_results.items():
+                    if test == "weekchecker_results" or not isinstance(test_results, dict):
+                        continue
+                    self._add_test(studentid, moduleid, test, test_results)
+
+    def _add_deductions(self, studentid, moduleid, test, deductions):
+        self.conn.executemany("INSERT INTO deductions VALUES (?, ?, ?, ?, ?)",
+                              [(self.run_id, studentid, moduleid, test, reason) for reason in deductions.get("reasons", [])])
+
+    def _add_test(self, studentid, moduleid, test, results):
+        deductions = _deductions(results.get("deductions", {}))
+        other = results.get("other") or {}
+        stdout, stdout_blob = _text(results.get("stdout"))
+        linterout, linterout_blob = _text(results.get("linterout"))
+        self.conn.execute("INSERT INTO tests VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                          (self.run_id, studentid, moduleid, test, deductions.get("value"),
+                           stdout, stdout_blob, linterout, linterout_blob, json.dumps(other)))
+        self._add_deductions(studentid, moduleid, test, deductions)
+        self.conn.executemany("INSERT INTO timings VALUES (?, ?, ?, ?, ?, ?)",
+                              [(self.run_id, studentid, moduleid, test, metric, value) for metric, value in other.items()
+                               if isinstance(value, (int, float)) and not isinstance(value, bool)])
+
+    def latest_run(self):
+        """Return the id of the most recent run, or None if there are none."""
+        row = self.conn.execute("SELECT MAX(run_id) FROM runs").fetchone()
+        return row[0]
+
+    def deduction_counts(self, run_id=None):
+        """Return [(reason, count)] of every deduction reason in a run (default: the latest), most common first."""
+        run_id = run_id or self.latest_run()
+        return self.conn.execute("SELECT reason, COUNT(*) AS n FROM deductions WHERE run_id = ? GROUP BY reason ORDER BY n DESC",
+                                 (run_id,)).fetchall()
+
+    def metric_means(self, metric="exectime_s", run_id=None):
+        """Return [(test, mean value)] of a metric from `other` in a run (default: the latest), largest first.
+
+        The metric "cpu_s" is the sum of cpu_user_s and cpu_sys_s, as total CPU time is not stored.
+        """
+        run_id = run_id or self.latest_run()
+        if metric == "cpu_s":
+            return self.conn.execute("SELECT test, AVG(value) AS m FROM "
+                                     "(SELECT test, SUM(value) AS value FROM timings WHERE run_id = ? AND metric IN ('cpu_user_s', 'cpu_sys_s') "
+                                     "GROUP BY student, module, test HAVING COUNT(value) = 2) GROUP BY test ORDER BY m DESC",
+                                     (run_id,)).fetchall()
+        return self.conn.execute("SELECT test, AVG(value) AS m FROM timings WHERE run_id = ? AND metric = ? GROUP BY test ORDER BY m DESC",
+                                 (run_id, metric)).fetchall()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,546 @@
+import asyncio
+import ctypes
+import io
+import itertools
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from markutils import limits as rlimits
+
+logger = logging.getLogger("mark")
+
+# Maximum number of subprocesses the shared loop will have running at any one time.
+MAX_PROCS = max((os.cpu_count() or 1) * 2, 4)
+
+_loop = None
+_loop_pid = None
+_semaphore = None
+_sampler = None
+_lock = threading.Lock()
+_ids = itertools.count()
+
+# prctl option (linux/prctl.h) making a process adopt its orphaned descendants in place of init.
+PR_SET_CHILD_SUBREAPER = 36
+# Environment variable marking every process started by a command, so that the command's descendants
+# can still be told apart once they have left its tree.
+RUN_ID_VAR = "MARKUTILS_RUN"
+# Pass as the input of a command to leave its stdin open without ever writing to it, like a user who never
+# types anything, so that a script asking for input waits (and times out) rather than reading end of file.
+HOLD_STDIN = object()
+
+
+class RunResult(subprocess.CompletedProcess):
+    """The result of a command run through the runner.
+
+    Behaves like subprocess.CompletedProcess (stdout always holds decoded text, with stderr merged
+    into it) with a couple of extra attributes:
+
+    - `timedout` - _bool_ - whether the command was killed for running past its timeout.
+    - `elapsed` - _float_ - wall-clock time in seconds from launch to exit.
+    - `resources` - _dict_ - resources used by the command and its descendants (None if unavailable):
+      `cpu_user_s`, `cpu_sys_s`, `maxrss_kb`, `blocks_in`, `blocks_out` (512-byte blocks) and
+      `procs` (number of processes seen in its tree). `maxrss_kb` is the highest peak resident set
+      (VmHWM) of any single process in the tree, as sampled from /proc, so a process too short-lived to
+      be sampled does not count towards it (and it is None if none was).
+    - `limits_exceeded` - _list_ - names of the resource limits the command appears to have run into.
+    - `survivors` - _list_ - (pid, name) of any processes from the command's tree still alive after it was killed.
+    """
+    def __init__(self, args, returncode, stdout, timedout=False, elapsed=0.0, resources=None, limits_exceeded=None,
+                 survivors=None):
+        super().__init__(args, returncode, stdout, None)
+        self.timedout = timedout
+        self.elapsed = elapsed
+        self.resources = resources
+        self.limits_exceeded = limits_exceeded or []
+        self.survivors = survivors or []
+
+
+def _decode(data):
+    # Match the universal newline handling of subprocess.run(..., text=True)
+    return data.decode(errors="replace").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def get_loop():
+    """Return the event loop shared by every runner call in this process, starting it if required.
+
+    The loop runs forever in a daemon thread, so it can be used from any number of (synchronous)
+    tests and students at once. A new loop is started if we find ourselves in a forked child.
+    """
+    global _loop, _loop_pid, _semaphore, _sampler
+    with _lock:
+        if _loop is None or _loop_pid != os.getpid() or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _semaphore = asyncio.Semaphore(MAX_PROCS)
+            _sampler = _ProcessSampler()
+            threading.Thread(target=_loop.run_forever, name="markutils-runner", daemon=True).start()
+    return _loop
+
+
+def _proc_stat(pid):
+    """Return (state, ppid, pgrp, starttime, session) of a process from /proc, or None if it no longer exists."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name may itself contain spaces or brackets, so split after the last ")".
+    fields = stat[stat.rindex(b")") + 2:].split()
+    return fields[0].decode(), int(fields[1]), int(fields[2]), int(fields[19]), int(fields[3])
+
+
+def _run_id(pid):
+    """Return the value of RUN_ID_VAR in the environment a process started with, or None."""
+    try:
+        with open(f"/proc/{pid}/environ", "rb") as f:
+            environ = f.read()
+    except OSError:
+        return None
+    prefix = RUN_ID_VAR.encode() + b"="
+    for entry in environ.split(b"\0"):
+        if entry.startswith(prefix):
+            return entry[len(prefix):].decode(errors="replace")
+    return None
+
+
+def _become_subreaper():
+    """Make this process adopt orphaned descendants rather than init, returning True if it worked.
+
+    A process that double-forks or calls setsid to get away from its command then stays visible
+    (as a child of the marker), so it can still be killed and reaped.
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def _proc_hwm(pid):
+    """Return the peak resident set size of a process in KB, or None if it has exited (or is a zombie)."""
+    try:
+        with open(f"/proc/{pid}/status", "rb") as f:
+            for line in f:
+                if line.startswith(b"VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _proc_name(pid):
+    try:
+        with open(f"/proc/{pid}/comm") as f:
+            return f.read().strip()
+    except OSError:
+        return "?"
+
+
+class _ProcessSampler:
+    """Keep track of the process tree of each running command by periodically scanning /proc.
+
+    A single scan of /proc is shared by every command being tracked, and scanning stops whenever
+    nothing is running. Processes that start and exit between two scans are missed, so the counts
+    and memory peaks are a lower bound.
+
+    This process is made a child subreaper, so descendants orphaned by a double fork or setsid are
+    adopted by it rather than init. Each is put back into the tree of the command whose run id its
+    environment carries, and reaped once it exits.
+
+    A command may also be given a cap on the number of processes in its tree, in which case the whole
+    tree is killed as soon as a scan finds more than that running at once.
+    """
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        # root pid -> {pid: start time} of every process seen in its tree (the start time guards against pid reuse)
+        self.seen = {}
+        # root pid -> highest VmHWM (KB) sampled from any process in its tree
+        self.peaks = {}
+        # root pid -> most processes its tree may have running at once
+        self.caps = {}
+        # root pids of the commands killed for going over their cap
+        self.capped = set()
+        # run id -> root pid of each command being tracked
+        self.roots = {}
+        # pid -> (start time, root pid or None) of every orphan adopted by this process
+        self.orphans = {}
+        self.task = None
+        self.enabled = os.path.isdir("/proc")
+        self.subreaper = self.enabled and _become_subreaper()
+        self.pid = os.getpid()
+        self.session = os.getsid(0) if self.enabled else None
+
+    def track(self, pid, run_id=None, max_procs=None):
+        if not self.enabled:
+            return
+        stat = _proc_stat(pid)
+        self.seen[pid] = {pid: stat[3]} if stat is not None else {}
+        if run_id is not None:
+            self.roots[run_id] = pid
+        if max_procs is not None:
+            self.caps[pid] = max_procs
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+
+    def untrack(self, pid):
+        """Stop tracking a command.
+
+        :return: (number of processes seen, peak RSS in KB) of its tree, either of which may be None if unknown,
+                 and whether it was killed for going over its cap on processes.
+        """
+        self.roots = {run_id: root for run_id, root in self.roots.items() if root != pid}
+        self.caps.pop(pid, None)
+        capped = pid in self.capped
+        self.capped.discard(pid)
+        seen = self.seen.pop(pid, None)
+        return None if seen is None else len(seen), self.peaks.pop(pid, None), capped
+
+    def scan(self):
+        """Scan /proc now, e.g. to catch anything a command started just before it exited."""
+        if self.enabled:
+            self._scan()
+
+    def _scan(self):
+        children = {}
+        stats = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            stat = _proc_stat(entry)
+            if stat is not None:
+                children.setdefault(stat[1], []).append((int(entry), stat[3]))
+                stats[int(entry)] = stat
+        if self.subreaper:
+            self._adopt(children.get(self.pid, []), stats)
+        for root, seen in self.seen.items():
+            stack = [root]
+            for pid, (starttime, owner) in self.orphans.items():
+                if owner == root and pid not in seen:
+                    seen[pid] = starttime
+                    stack.append(pid)
+            while stack:
+                for child, starttime in children.get(stack.pop(), []):
+                    if child not in seen:
+                        seen[child] = starttime
+                        stack.append(child)
+            live = 0
+            for pid, starttime in seen.items():
+                stat = stats.get(pid)
+                if stat is None or stat[3] != starttime or stat[0] == "Z":
+                    continue
+                live += 1
+                hwm = _proc_hwm(pid)
+                if hwm is not None and hwm > self.peaks.get(root, 0):
+                    self.peaks[root] = hwm
+            cap = self.caps.get(root)
+            if cap is not None and live > cap and root not in self.capped:
+                logger.debug("Process {} had {} processes running (at most {} allowed), killing it".format(root, live, cap))
+                self.capped.add(root)
+                _kill_tree(root, seen)
+
+    def _adopt(self, children, stats):
+        """Attribute the orphans adopted by this process to their commands, and reap any that have exited."""
+        orphans = {}
+        for pid, starttime in children:
+            if pid in self.seen:
+                # One of the commands themselves, which are reaped by arun
+                continue
+            if stats[pid][0] == "Z":
+                # Commands run in sessions of their own, so an exited child in another session than ours is an
+                # orphan of theirs. Children in our session (e.g. from subprocess.run) are left to whoever started them.
+                if stats[pid][4] != self.session:
+                    try:
+                        os.waitpid(pid, os.WNOHANG)
+                    except ChildProcessError:
+                        pass
+                continue
+            known = self.orphans.get(pid)
+            if known is not None and known[0] == starttime:
+                orphans[pid] = known
+                continue
+            run_id = _run_id(pid)
+            if run_id is not None and run_id.startswith(f"{self.pid}-"):
+                orphans[pid] = (starttime, self.roots.get(run_id))
+        self.orphans = orphans
+
+    async def _run(self):
+        while self.seen or self.orphans:
+            try:
+                self._scan()
+            except OSError as e:
+                logger.debug("Could not scan /proc: {}".format(e))
+            await asyncio.sleep(self.interval)
+
+
+def _tree(pgid, seen=None):
+    """Return {pid: start time} of the live (non-zombie) processes in a process group, plus any
+    previously seen descendants that have since left it (e.g. by calling setsid)."""
+    if not os.path.isdir("/proc"):
+        return {}
+    members = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            stat = _proc_stat(entry)
+            if stat is not None and stat[2] == pgid and stat[0] != "Z":
+                members[int(entry)] = stat[3]
+    for pid, starttime in (seen or {}).items():
+        stat = _proc_stat(pid)
+        if stat is not None and stat[3] == starttime and stat[0] != "Z":
+            members[pid] = starttime
+    return members
+
+
+def _kill_tree(pgid, seen=None):
+    """SIGKILL a command's process group and any of its descendants that have left the group.
+
+    :param pgid: process group of the command (its pid, as it is started in a new session).
+    :param seen: optional {pid: start time} of descendants seen by the sampler.
+    """
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    for pid, starttime in (seen or {}).items():
+        stat = _proc_stat(pid)
+        # Only kill a pid if it is still the same process we saw, never a newcomer that reused it.
+        if stat is not None and stat[3] == starttime and stat[2] != pgid and stat[0] != "Z":
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+
+async def _survivors(pgid, seen=None, grace=1.0):
+    """Wait for a killed process tree to die, returning a list of (pid, name) of any processes left alive."""
+    deadline = time.monotonic() + grace
+    while True:
+        members = _tree(pgid, seen)
+        if not members or time.monotonic() >= deadline:
+            return [(pid, _proc_name(pid)) for pid in sorted(members)]
+        await asyncio.sleep(0.05)
+
+
+async def _wait4(pid, before_reap=None):
+    """Wait for a child process without blocking the loop, returning (status, rusage) from os.wait4.
+
+    :param pid: child process to wait for.
+    :param before_reap: optional function to call once the child has exited but before it is reaped,
+                        while its pid (and so its process group id) is still guaranteed not to be reused.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        # No pidfd support (older kernels, non-linux), so sit in a thread instead.
+        await loop.run_in_executor(None, os.waitid, os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+    else:
+        try:
+            exited = loop.create_future()
+            loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+            try:
+                await exited
+            finally:
+                loop.remove_reader(pidfd)
+        finally:
+            os.close(pidfd)
+    if before_reap is not None:
+        before_reap()
+    _, status, rusage = os.wait4(pid, 0)
+    return status, rusage
+
+
+def _resources(rusage, procs, maxrss_kb):
+    # Not rusage.ru_maxrss, which is inherited from the marker through fork() and so never lower than its own peak.
+    return {"cpu_user_s": rusage.ru_utime, "cpu_sys_s": rusage.ru_stime, "maxrss_kb": maxrss_kb,
+            "blocks_in": rusage.ru_inblock, "blocks_out": rusage.ru_oublock, "procs": procs}
+
+
+def total_resources(*results):
+    """Combine the resource usage of several RunResults, e.g. to record against a test in `other`.
+
+    CPU times, block I/O and process counts are summed, while the peak RSS is the largest of any run.
+
+    :param results: RunResults to combine (any without resource data are skipped).
+    :return: dict with the same keys as RunResult.resources.
+    """
+    total = {}
+    for result in results:
+        for key, value in (result.resources or {}).items():
+            if value is None:
+                continue
+            if key == "maxrss_kb":
+                total[key] = max(total.get(key, 0), value)
+            else:
+                total[key] = total.get(key, 0) + value
+    return total
+
+
+async def arun(argv, cwd=None, timeout=None, input=None, env=None, limits=None, capture=None):
+    """Run a command without a shell, capturing its combined stdout and stderr.
+
+    The command is started in a new session. When it exits or times out, everything else in its
+    process group (plus any descendants seen to have left the group) is killed, so nothing it
+    started is left running. Whatever output was captured before then is always returned.
+
+    The resources used by the command and every descendant it waited for are collected with
+    os.wait4, while the number of processes in its tree and their peak memory are sampled from /proc as it runs.
+
+    :param argv: list of the program and its arguments.
+    :param cwd: folder to run the command in.
+    :param timeout: seconds to allow the command to run before killing it (None to wait forever).
+    :param input: optional str to send to stdin, or HOLD_STDIN to keep stdin open but empty. If not given
+                  stdin is closed.
+    :param env: optional environment for the command.
+    :param limits: optional dict of resource limits to run the command under (see markutils.limits.LIMITS).
+    :param capture: optional markutils.capture.OutputCapture, to keep only the head and tail of the output in
+                    memory (spilling the rest to disk). If not given the whole output is kept.
+    :return: RunResult
+    """
+    argv = [str(a) for a in argv]
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphore if _semaphore is not None and loop is _loop else None
+    sampler = _sampler if loop is _loop else None
+    if semaphore is not None:
+        await semaphore.acquire()
+    try:
+        starttime = time.monotonic()
+        try:
+            # Popen rather than asyncio's own subprocesses, so that we reap the child ourselves and get its rusage.
+            # Each command gets its own session (and so process group), so that its whole tree can be killed at once.
+            run_id = f"{os.getpid()}-{next(_ids)}"
+            env = dict(os.environ if env is None else env, **{RUN_ID_VAR: run_id})
+            proc = subprocess.Popen(rlimits.wrap(argv, rlimits.rlimits(limits, MAX_PROCS)), cwd=cwd, env=env,
+                                    stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True)
+        except (FileNotFoundError, PermissionError) as e:
+            logger.debug("Could not launch {}: {}".format(argv[0], e))
+            return RunResult(argv, 127, f"{argv[0]}: command not found\n", elapsed=time.monotonic() - starttime)
+        seen = None
+        if sampler is not None:
+            sampler.track(proc.pid, run_id, (limits or {}).get("processes"))
+            seen = sampler.seen.get(proc.pid)
+
+        def _kill():
+            # Look again first, so that anything started (or orphaned) since the last scan is killed too
+            if sampler is not None:
+                sampler.scan()
+            _kill_tree(proc.pid, seen)
+
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), proc.stdout)
+        buffer = capture.buffer() if capture is not None else io.BytesIO()
+        exit_info = []
+
+        async def _read():
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                buffer.write(data)
+
+        async def _wait():
+            # Anything the command left running in the background is killed as soon as it exits.
+            exit_info.extend(await _wait4(proc.pid, before_reap=_kill))
+
+        def _write():
+            try:
+                proc.stdin.write(input.encode())
+                proc.stdin.close()
+            except (BrokenPipeError, ConnectionResetError, ValueError):
+                pass
+
+        tasks = {asyncio.ensure_future(_read()), asyncio.ensure_future(_wait())}
+        if input is not None and input is not HOLD_STDIN:
+            tasks.add(loop.run_in_executor(None, _write))
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        timedout = len(pending) > 0
+        if timedout:
+            _kill()
+            # Anything left holding the pipe open should not keep us waiting forever.
+            _, pending = await asyncio.wait(pending, timeout=1)
+            for task in pending:
+                task.cancel()
+        transport.close()
+        if input is HOLD_STDIN:
+            proc.stdin.close()
+        if capture is not None:
+            buffer.close()
+        elapsed = time.monotonic() - starttime
+        survivors = []
+        if timedout or (seen is not None and len(seen) > 1):
+            survivors = await _survivors(proc.pid, seen)
+            if survivors:
+                logger.warning("MARKER WARNING - {} process/es started by {} survived being killed: {}".format(
+                    len(survivors), argv[0], ", ".join(f"{name} ({pid})" for pid, name in survivors)))
+        procs, maxrss_kb, capped = sampler.untrack(proc.pid) if sampler is not None else (None, None, False)
+        resources = None
+        if exit_info:
+            status, rusage = exit_info
+            # Let Popen know the child has already been reaped.
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            resources = _resources(rusage, procs, maxrss_kb)
+        stdout = _decode(buffer.getvalue())
+        exceeded = rlimits.breached(limits, proc.returncode, stdout, resources, killed=timedout or capped)
+        if capped:
+            exceeded = sorted(set(exceeded) | {"processes"})
+        if exceeded:
+            logger.debug("{} appears to have exceeded its limits: {}".format(argv[0], ", ".join(exceeded)))
+        return RunResult(argv, proc.returncode, stdout, timedout=timedout, elapsed=elapsed, resources=resources,
+                         limits_exceeded=exceeded, survivors=survivors)
+    finally:
+        if semaphore is not None:
+            semaphore.release()
+
+
+def cut_short(run_result, targetfile, deductions):
+    """Dock a point if a student script timed out or ran into its resource limits.
+
+    :param run_result: the RunResult of the script.
+    :param targetfile: name of the script, for logging.
+    :param deductions: the deductions dict of the test, updated in place.
+    :return: True if the script was cut short, in which case its output should not be verified.
+    """
+    if run_result.timedout:
+        logger.critical("{} timed out! -1 point".format(targetfile))
+        deductions["value"] += 1
+        deductions["reasons"].append("timeout")
+        return True
+    return exceeded_limits(run_result, targetfile, deductions)
+
+
+def exceeded_limits(run_result, targetfile, deductions):
+    """Dock a point if a student script ran into its resource limits, for tests where a timeout is expected.
+
+    :return: True if the script ran into its limits, in which case it should be treated like a timeout from here on.
+    """
+    if not run_result.limits_exceeded:
+        return False
+    logger.critical("{} exceeded its resource limits ({})! -1 point".format(targetfile, ", ".join(run_result.limits_exceeded)))
+    deductions["value"] += 1
+    deductions["reasons"].append("limit_exceeded")
+    return True
+
+
+def submit(argv, cwd=None, timeout=None, input=None, env=None, limits=None, capture=None):
+    """Start a command on the shared loop without waiting for it.
+
+    Call `.result()` on the returned future to wait for the RunResult. This allows e.g. linting
+    while the student script runs.
+
+    :return: concurrent.futures.Future resolving to a RunResult.
+    """
+    return asyncio.run_coroutine_threadsafe(arun(argv, cwd=cwd, timeout=timeout, input=input, env=env, limits=limits, capture=capture),
+                                            get_loop())
+
+
+def run(argv, cwd=None, timeout=None, input=None, env=None, limits=None, capture=None):
+    """Run a command on the shared loop and wait for it to finish.
+
+    :return: RunResult
+    """
+    return submit(argv, cwd=cwd, timeout=timeout, input=input, env=env, limits=limits, capture=capture).result()
+
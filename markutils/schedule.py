@@ -0,0 +1,59 @@
+import heapq
+
+from markutils.stats import median
+
+# Seconds assumed for a test that has never been timed, when there is no history at all to go on.
+DEFAULT_TEST_S = 1.0
+
+
+def test_costs(plan, studentids, estimates):
+    """Predict how long each test of each student will take, from the timings of previous runs.
+
+    A test the student has been timed on before is predicted to take the median of their previous
+    times. Otherwise the median over every student timed on that test is used, and failing that the
+    median of all tests (or DEFAULT_TEST_S with no history at all).
+
+    :param plan: the marking plan, as returned by build_plan.
+    :param studentids: the students to be marked.
+    :param estimates: {(studentid, moduleid, targetfile): seconds}, as returned by TimingHistory.estimates.
+    :return: {studentid: {(moduleid, targetfile): predicted seconds}}
+    """
+    by_test = {}
+    for (_, moduleid, targetfile), seconds in estimates.items():
+        by_test.setdefault((moduleid, targetfile), []).append(seconds)
+    test_default = {key: median(times) for key, times in by_test.items()}
+    fallback = median(list(test_default.values())) if test_default else DEFAULT_TEST_S
+    costs = {}
+    for studentid in studentids:
+        costs[studentid] = {}
+        for module in plan:
+            for test in module.tests:
+                key = (module.moduleid, test.targetfile)
+                costs[studentid][key] = estimates.get((studentid,) + key, test_default.get(key, fallback))
+    return costs
+
+
+def makespan(costs, workers):
+    """Return the time taken to run jobs of the given costs, in order, on a number of workers that each take the next job when free."""
+    finish = [0.0] * max(workers, 1)
+    for cost in costs:
+        heapq.heappush(finish, heapq.heappop(finish) + cost)
+    return max(finish)
+
+
+def longest_first(costs):
+    """Return the keys of a {job: cost} dict, most expensive first (ties keep their original order)."""
+    return sorted(costs, key=lambda job: costs[job], reverse=True)
+
+
+def student_cost(costs, testjobs=1):
+    """Predict how long marking a student will take, from the predicted costs of their tests.
+
+    :param costs: {(moduleid, targetfile): predicted seconds} for the student, as from test_costs.
+    :param testjobs: number of tests run at once, longest first, within each module.
+    :return: predicted seconds.
+    """
+    modules = {}
+    for (moduleid, _), cost in costs.items():
+        modules.setdefault(moduleid, []).append(cost)
+    return sum(makespan(sorted(times, reverse=True), testjobs) for times in modules.values())
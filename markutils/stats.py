@@ -0,0 +1,317 @@
+import heapq
+import json
+import math
+from array import array
+from collections import Counter
+
+from markutils.blobs import object_hook, store_for
+
+# Histogram bins are spaced logarithmically, covering LOW to LOW * 10**DECADES with BINS_PER_DECADE
+# bins in each power of ten, plus one bin below and one above that range.
+LOW = 1e-4
+DECADES = 9
+BINS_PER_DECADE = 20
+NBINS = DECADES * BINS_PER_DECADE + 2
+# The largest values of each measurement are kept (with the student they came from) as outlier candidates.
+TOP_K = 20
+# Metrics recorded by the tests in "other" that are summarised, in addition to exectime_s, on request.
+RESOURCE_METRICS = ("cpu_s", "maxrss_kb", "blocks_out", "blocks_in", "procs")
+
+
+def iter_results(path, chunk_size=65536, store=None):
+    """Stream (studentid, results) pairs from a results file, holding only one student at a time in memory.
+
+    As with markutils.blobs.load_results, any blob references in the results are turned into BlobRefs.
+
+    :param path: either an overall_results.json or the overall_results.jsonl journal written by mark.py.
+    :param chunk_size: number of characters to read from the file at once.
+    :param store: optional BlobStore, defaulting to the `blobs` folder next to the results.
+    """
+    hook = object_hook(store or store_for(path))
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line, object_hook=hook)
+                    yield entry["student"], entry["results"]
+        else:
+            yield from _iter_object(f, chunk_size, hook)
+
+
+def _iter_object(f, chunk_size, hook=None):
+    """Incrementally parse a file holding a single json object, yielding its (key, value) pairs."""
+    decoder = json.JSONDecoder(object_hook=hook)
+    buf, pos, eof = "", 0, False
+
+    def more(size):
+        nonlocal buf, pos, eof
+        chunk = f.read(size)
+        eof = not chunk
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def peek():
+        # Skip whitespace and return the next character, without consuming it
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if eof:
+                raise ValueError("Unexpected end of {}".format(f.name))
+            more(chunk_size)
+
+    def expect(chars):
+        nonlocal pos
+        c = peek()
+        if c not in chars:
+            raise ValueError("Expected one of {!r} at {!r} in {}".format(chars, buf[pos:pos + 20], f.name))
+        pos += 1
+        return c
+
+    def value():
+        nonlocal pos
+        peek()
+        size = chunk_size
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+                # A value reaching the end of the buffer (e.g. a number) may have been cut short
+                if end < len(buf) or eof:
+                    pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            # Grow the reads geometrically, so that a large value is not re-parsed too many times
+            more(size)
+            size *= 2
+
+    expect("{")
+    if peek() == "}":
+        return
+    while True:
+        key = value()
+        expect(":")
+        yield key, value()
+        if expect(",}") == "}":
+            return
+
+
+def metric_value(other, metric):
+    """Return a metric from the "other" dict of a test, or None. "cpu_s" is the sum of cpu_user_s and cpu_sys_s."""
+    if metric == "cpu_s":
+        if other.get("cpu_user_s") is None or other.get("cpu_sys_s") is None:
+            return None
+        return other["cpu_user_s"] + other["cpu_sys_s"]
+    value = other.get(metric)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+class Histogram:
+    """A streaming summary of a non-negative measurement, in constant memory however many values are added.
+
+    Values are counted in fixed logarithmic bins, so percentiles are estimates accurate to within a
+    bin (about 12% of the value); count, mean, min and max are exact. The TOP_K largest values are
+    kept with their labels, from which the outliers are picked.
+    """
+    def __init__(self):
+        self.counts = array("L", [0]) * NBINS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.top = []
+
+    @staticmethod
+    def _bin(value):
+        if value < LOW:
+            return 0
+        return min(int(math.log10(value / LOW) * BINS_PER_DECADE) + 1, NBINS - 1)
+
+    @staticmethod
+    def _edges(i):
+        """Return the (lower, upper) edges of bin i."""
+        if i == 0:
+            return 0.0, LOW
+        if i == NBINS - 1:
+            return LOW * 10 ** DECADES, math.inf
+        return LOW * 10 ** ((i - 1) / BINS_PER_DECADE), LOW * 10 ** (i / BINS_PER_DECADE)
+
+    def add(self, value, label=""):
+        self.counts[self._bin(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.top) < TOP_K:
+            heapq.heappush(self.top, (value, label))
+        elif value > self.top[0][0]:
+            heapq.heapreplace(self.top, (value, label))
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, p):
+        """Estimate the p-th percentile (0-100), interpolating within its bin."""
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower, upper = self._edges(i)
+                lower, upper = max(lower, self.min), min(upper, self.max)
+                fraction = (rank - seen) / n
+                if lower > 0:
+                    estimate = lower * (upper / lower) ** fraction
+                else:
+                    estimate = lower + (upper - lower) * fraction
+                return min(max(estimate, self.min), self.max)
+            seen += n
+        return self.max
+
+    def bins(self):
+        """Return [(lower, upper, count)] of every non-empty bin, in increasing order."""
+        return [self._edges(i) + (n,) for i, n in enumerate(self.counts) if n]
+
+    def outliers(self, k=3.0):
+        """Return [(value, label)] of the largest values beyond Q3 + k * IQR, largest first.
+
+        Only the TOP_K largest values are candidates, so at most that many are returned.
+        """
+        if not self.count:
+            return []
+        q1, q3 = self.percentile(25), self.percentile(75)
+        fence = q3 + k * (q3 - q1)
+        return sorted(((v, label) for v, label in self.top if v > fence), reverse=True)
+
+
+class TargetSummary:
+    """Accumulates the measurements and deductions of a single test (target file) across every student."""
+    def __init__(self, metrics):
+        self.runs = 0
+        self.metrics = {metric: Histogram() for metric in metrics}
+        self.reasons = Counter()
+
+    def add(self, studentid, results):
+        self.runs += 1
+        other = results.get("other") or {}
+        for metric, histogram in self.metrics.items():
+            value = metric_value(other, metric)
+            if value is not None:
+                histogram.add(value, studentid)
+        self.reasons.update((results.get("deductions") or {}).get("reasons", []))
+
+    def frequencies(self):
+        """Return {reason: fraction of students that lost points for it on this test}."""
+        return {reason: n / self.runs for reason, n in self.reasons.most_common()}
+
+
+class ResultsSummary:
+    """Summary statistics of a whole marking run, built up one student at a time.
+
+    Memory use depends on the number of distinct tests, metrics and deduction reasons, but not on the
+    number of students.
+    """
+    def __init__(self, metrics=("exectime_s",)):
+        self.metrics = metrics
+        self.students = 0
+        self.reasons = Counter()
+        self.tests = {}
+
+    def add_student(self, studentid, results):
+        """Add the results dict of a single student, as written by mark.py."""
+        self.students += 1
+        for section in results.values():
+            if not isinstance(section, dict):
+                continue
+            # Repo-level deductions sit directly in repo_results, the rest one level further down
+            self.reasons.update(section.get("deductions", {}).get("reasons", []))
+            for name, entry in section.items():
+                if not isinstance(entry, dict):
+                    continue
+                deductions = entry.get("deductions")
+                if isinstance(deductions, dict):
+                    self.reasons.update(deductions.get("reasons", []))
+                if "other" in entry:
+                    if name not in self.tests:
+                        self.tests[name] = TargetSummary(self.metrics)
+                    self.tests[name].add(studentid, entry)
+
+    def ranked(self, metric="exectime_s"):
+        """Return [(test, Histogram)] of the tests with any values of a metric, highest mean first."""
+        found = [(name, test.metrics[metric]) for name, test in self.tests.items() if test.metrics[metric].count]
+        return sorted(found, key=lambda item: item[1].mean, reverse=True)
+
+
+def summarise(path, metrics=("exectime_s",)):
+    """Build a ResultsSummary from a results file in a single streaming pass.
+
+    :param path: location of overall_results.json or overall_results.jsonl.
+    :param metrics: the metrics in "other" to summarise for each test.
+    :return: ResultsSummary
+    """
+    summary = ResultsSummary(metrics)
+    for studentid, results in iter_results(path):
+        summary.add_student(studentid, results)
+    return summary
+
+
+def median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+
+def signed_rank_test(differences):
+    """One-sided Wilcoxon signed-rank test of whether paired differences tend to be positive.
+
+    Uses the normal approximation (with tie and continuity corrections), which is reasonable from
+    about 6 non-zero differences upwards.
+
+    :param differences: list of paired differences, e.g. log(new time) - log(old time) per student.
+    :return: tuple of (number of non-zero differences, p-value), the p-value being None if there are none.
+    """
+    differences = [d for d in differences if d != 0]
+    n = len(differences)
+    if n == 0:
+        return 0, None
+    # Rank the absolute differences, giving tied values the mean of their ranks
+    order = sorted(range(n), key=lambda i: abs(differences[i]))
+    ranks = [0.0] * n
+    ties = 0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and abs(differences[order[j + 1]]) == abs(differences[order[i]]):
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2 + 1
+        t = j - i + 1
+        ties += t ** 3 - t
+        i = j + 1
+    w = sum(r for r, d in zip(ranks, differences) if d > 0)
+    expected = n * (n + 1) / 4
+    variance = n * (n + 1) * (2 * n + 1) / 24 - ties / 48
+    if variance <= 0:
+        return n, None
+    z = (w - expected - 0.5) / math.sqrt(variance)
+    return n, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def robust_z(value, values):
+    """Return how many (MAD-based) standard deviations a value lies above the median of some values, or None."""
+    centre = median(values)
+    if centre is None:
+        return None
+    mad = median([abs(v - centre) for v in values])
+    if not mad:
+        return None
+    return (value - centre) / (1.4826 * mad)
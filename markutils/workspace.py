@@ -0,0 +1,195 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, so we simply never try to reflink there.
+    fcntl = None
+
+logger = logging.getLogger("mark")
+
+# ioctl request number for FICLONE (linux/fs.h), which asks the filesystem for a copy-on-write clone.
+FICLONE = 0x40049409
+# Where files cannot be reflinked, input files larger than this are shared between workspaces rather than copied into each.
+SHARE_BYTES = 1048576
+
+def _reflink(src, dst):
+    """Try to make dst a copy-on-write clone of src.
+
+    :param src: file to clone.
+    :param dst: path of the new clone.
+    :return: True if the clone was made, False if the filesystem does not support it.
+    """
+    if fcntl is None:
+        return False
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            failed = True
+        else:
+            failed = False
+    if failed:
+        os.remove(dst)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def clone_file(src, dst, can_reflink=True):
+    """Make dst an independent copy of src, reflinking it where the filesystem allows.
+
+    Files are never hardlinked, as a script writing to the link would write to the original too.
+
+    :return: True if the file was reflinked, False if it was copied.
+    """
+    if can_reflink and _reflink(src, dst):
+        return True
+    shutil.copy2(src, dst)
+    return False
+
+
+class SharedInputs:
+    """Read-only copies of the large input files of a module folder, shared by the workspaces of every test.
+
+    Each file is only copied once (when first asked for), however many tests link to it. The copies
+    are made read-only, so a script cannot change them for the tests after it (unless marking as root).
+    """
+    def __init__(self, root, threshold=SHARE_BYTES):
+        self.root = root
+        self.threshold = threshold
+        # path relative to the module folder -> path of the shared copy
+        self.paths = {}
+        self.lock = threading.Lock()
+
+    def get(self, srcfile, relpath, size):
+        """Return the path of the shared copy of a file, or None if it is too small to be worth sharing.
+
+        :param srcfile: the original file.
+        :param relpath: its path relative to the module folder.
+        :param size: its size in bytes.
+        """
+        if size <= self.threshold:
+            return None
+        # Tests of the same student may be populating their workspaces at the same time.
+        with self.lock:
+            path = self.paths.get(relpath)
+            if path is None:
+                path = os.path.join(self.root, relpath)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                clone_file(srcfile, path)
+                os.chmod(path, 0o444)
+                self.paths[relpath] = path
+        return path
+
+    def cleanup(self):
+        """Remove every shared copy."""
+        shutil.rmtree(self.root, ignore_errors=True)
+        self.paths = {}
+
+
+def _copy_entry(srcfile, dstfile, relpath, islink, counts, can_reflink, shared=None, size=None):
+    """Replicate a single file using the cheapest method available.
+
+    :return: whether reflinking should still be attempted for further files.
+    """
+    if islink:
+        os.symlink(os.readlink(srcfile), dstfile)
+        return can_reflink
+    if can_reflink and _reflink(srcfile, dstfile):
+        counts["reflink"] += 1
+        return True
+    if size is None:
+        size = os.path.getsize(srcfile)
+    target = shared.get(srcfile, relpath, size) if shared is not None else None
+    if target is not None:
+        os.symlink(target, dstfile)
+        counts["shared"] += 1
+    else:
+        shutil.copy2(srcfile, dstfile)
+        counts["copy"] += 1
+        counts["bytes"] += size
+    # Don't bother trying to reflink again for the rest of the tree.
+    return False
+
+
+def populate(src, dst, inventory=None, reldir=None, shared=None, private=()):
+    """Recreate the tree at src within dst as cheaply as possible.
+
+    Files are reflinked where the filesystem allows it. Otherwise they are copied, except for large
+    files outside the private folders, which are linked to a read-only copy in `shared` if given.
+
+    :param src: folder to replicate.
+    :param dst: folder to create (must not yet exist).
+    :param inventory: optional Inventory containing src, used instead of walking src again.
+    :param reldir: path of src relative to the root of inventory.
+    :param shared: optional SharedInputs to link large files to, rather than copying them.
+    :param private: names of the folders directly within src (e.g. the code and results folders) to always copy in full.
+    :return: dict counting how many files were reflinked, copied and shared, and the number of bytes copied.
+    """
+    counts = {"reflink": 0, "copy": 0, "shared": 0, "bytes": 0}
+    can_reflink = fcntl is not None
+
+    def _shared_for(relpath):
+        return None if relpath.split(os.sep, 1)[0] in private else shared
+
+    if inventory is not None:
+        for current, dirnames, filenames in inventory.walk(reldir):
+            targetdir = os.path.normpath(os.path.join(dst, os.path.relpath(current, reldir)))
+            os.makedirs(targetdir, exist_ok=True)
+            for name in dirnames:
+                if inventory.islink(os.path.join(current, name)):
+                    os.symlink(os.readlink(os.path.join(inventory.root, current, name)), os.path.join(targetdir, name))
+            for name in filenames:
+                relfile = os.path.join(current, name)
+                relpath = os.path.relpath(relfile, reldir)
+                can_reflink = _copy_entry(os.path.join(inventory.root, relfile), os.path.join(targetdir, name), relpath,
+                                          inventory.islink(relfile), counts, can_reflink, _shared_for(relpath),
+                                          inventory.size(relfile))
+        return counts
+    for dirpath, dirnames, filenames in os.walk(src):
+        targetdir = os.path.normpath(os.path.join(dst, os.path.relpath(dirpath, src)))
+        os.makedirs(targetdir, exist_ok=True)
+        for name in filenames:
+            srcfile = os.path.join(dirpath, name)
+            relpath = os.path.relpath(srcfile, src)
+            can_reflink = _copy_entry(srcfile, os.path.join(targetdir, name), relpath, os.path.islink(srcfile), counts,
+                                      can_reflink, _shared_for(relpath))
+    return counts
+
+
+@contextmanager
+def scratch_workspace(fileloc, studentfolder, modulefolder, scratchloc, prefix="scratch_", inventory=None, shared=None,
+                      private=()):
+    """Provide a throwaway copy of a student's module folder for a single test.
+
+    The copy is laid out exactly as the original (<root>/<studentfolder>/<modulefolder>), so a test
+    may simply be handed the yielded root in place of the usual student work location. Everything
+    under the root is deleted when the context exits, so tests do not need to clean up after themselves
+    and several tests may safely run against the same student at once.
+
+    :param fileloc: general location of student work.
+    :param studentfolder: folder containing specific student work.
+    :param modulefolder: folder containing the module assignments to replicate.
+    :param scratchloc: folder within which to create the workspace.
+    :param prefix: prefix for the name of the workspace folder.
+    :param inventory: optional Inventory of the student folder, to save walking it again.
+    :param shared: optional SharedInputs, to link large input files to rather than copy them (see populate).
+    :param private: names of the folders within the module folder that are always copied in full.
+    :return: the root folder of the workspace, to be used in place of fileloc.
+    """
+    os.makedirs(scratchloc, exist_ok=True)
+    root = tempfile.mkdtemp(prefix=prefix, dir=scratchloc)
+    try:
+        counts = populate(os.path.join(fileloc, studentfolder, modulefolder), os.path.join(root, studentfolder, modulefolder),
+                          inventory=inventory, reldir=modulefolder, shared=shared, private=private)
+        logger.debug("Created workspace {} ({} reflinked, {} copied ({} bytes), {} shared)".format(
+            root, counts["reflink"], counts["copy"], counts["bytes"], counts["shared"]))
+        yield root
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
@@ -1,8 +1,9 @@
 import logging
 import os
-import subprocess
 from datetime import datetime
-from pathlib import Path
+
+from markutils import runner, verify
+from markutils.inventory import find_target
 
 logger = logging.getLogger("mark")
 
@@ -24,72 +25,47 @@ def main(filelocation, targetfile,studentspec, modulespec, testspec):
     datadirpath = os.path.join(moduledirpath, modulespec["dataloc"])
     resultsdirpath = os.path.join(moduledirpath, modulespec["resultsloc"])
 
-    # Check if file is present
-    filepath = Path(os.path.join(codedirpath, targetfile))
-    if filepath.is_file():
-        logger.debug("File {} present!".format(targetfile))
-    else:
-        # Try to find a matching but differently capitalised file
-        potential_files = [file for file in os.listdir(codedirpath) if file.lower() == targetfile.lower()]
-        if len(potential_files) > 0:
-            targetfile = potential_files[0]
-            logger.warning("Inferred target file as {}".format(targetfile))
-        else:
-            if not testspec["required"]:
-                logger.warning("File {} absent but not required!".format(targetfile))
-            else:
-                logger.critical("File {} absent!".format(targetfile))
-                deductions["value"] += 1
-                deductions["reasons"].append("file_missing")
-                return "File missing!", "File missing!", deductions, other
-
-    # Lint
-    linter_result = subprocess.run(f"shellcheck {targetfile}", cwd=codedirpath, shell=True, text=True, timeout = timeout,
-                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    # Check if file is present (allowing for different capitalisation)
+    targetfile = find_target(studentspec, modulespec, targetfile, testspec, deductions)
+    if targetfile is None:
+        return "File missing!", "File missing!", deductions, other
+
+    # Lint (in the background while the rest of the test runs)
+    linter_future = runner.submit(["shellcheck", targetfile], cwd=codedirpath, timeout=timeout)
 
     # Veracity setup
-    target_wc = subprocess.run(f"wc -l < {targetfile}", cwd=codedirpath,
-                               shell=True, text=True, timeout=timeout,
-                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    target_lines = int(target_wc.stdout.strip())
+    target_lines = verify.line_count(os.path.join(codedirpath, targetfile))
     logger.debug("{} lines in target.".format(target_lines))
 
     # Run script
     starttime = datetime.now()
-    try:
-        teststr = f"bash {targetfile} {targetfile} {targetfile} ../{modulespec['dataloc']}/testout.demo"
-        logger.info("Running {} using following command: {}".format(targetfile, teststr))
-        # Actually run script
-        run_result = subprocess.run(teststr, cwd=codedirpath, shell=True, text=True, timeout = timeout,
-                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    except subprocess.TimeoutExpired as e:
-        timedout = True
-        run_result = e
-        logger.critical("{} timed out! -1 point".format(targetfile))
-        deductions["value"] += 1
-        deductions["reasons"].append("timeout")
+    testargs = ["bash", targetfile, targetfile, targetfile, f"../{modulespec['dataloc']}/testout.demo"]
+    logger.info("Running {} using following command: {}".format(targetfile, " ".join(testargs)))
+    # Actually run script
+    run_result = runner.run(testargs, cwd=codedirpath, timeout=timeout, limits=testspec.get("limits"),
+                            capture=testspec.get("capture"))
+    timedout = runner.cut_short(run_result, targetfile, deductions)
     endtime = datetime.now()
 
     # Parse exec time
     elapsed = endtime - starttime
     other["exectime_s"] = elapsed.total_seconds()
+    # CPU time, peak memory, block I/O and process count of the student script
+    other.update(runner.total_resources(run_result))
     logger.info("Ran {} in {}".format(targetfile, elapsed))
 
     # Veracity post-test
     #
-    final_wc = subprocess.run(f"wc -l < ../{modulespec['dataloc']}/testout.demo", cwd=codedirpath,
-                              shell=True, text=True, timeout=timeout,
-                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    final_lines = 0
-    try:
-        final_lines = int(final_wc.stdout.strip())
-        logger.debug("{} lines in final.".format(final_lines))
-    except ValueError:
+    final_lines = verify.line_count(os.path.join(datadirpath, "testout.demo"))
+    if final_lines is None:
+        final_lines = 0
         logger.warning("Ouput file not found!")
+    else:
+        logger.debug("{} lines in final.".format(final_lines))
 
     # Check error code
     if timedout:
-        run_stdout = run_result.stdout.decode()
+        run_stdout = run_result.stdout
     else:
         if run_result.returncode != 0:
             logger.critical("{} errored! -1 point".format(targetfile))
@@ -105,12 +81,5 @@ def main(filelocation, targetfile,studentspec, modulespec, testspec):
 
         run_stdout = run_result.stdout
 
-    # Cleanup
-    for x in ["testout.demo"]:
-        try:
-            os.remove(os.path.join(datadirpath, x))
-            logger.debug("Removed {}".format(os.path.join(datadirpath, x)))
-        except FileNotFoundError:
-            pass
 
-    return run_stdout, linter_result.stdout, deductions, other
+    return run_stdout, linter_future.result().stdout, deductions, other
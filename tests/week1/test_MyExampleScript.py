@@ -1,8 +1,9 @@
 import logging
 import os
-import subprocess
 from datetime import datetime
-from pathlib import Path
+
+from markutils import runner
+from markutils.inventory import find_target
 
 logger = logging.getLogger("mark")
 
@@ -20,50 +21,32 @@ def main(filelocation, targetfile,studentspec, modulespec, testspec):
     datadirpath = os.path.join(moduledirpath, modulespec["dataloc"])
     resultsdirpath = os.path.join(moduledirpath, modulespec["resultsloc"])
 
-    filepath = Path(os.path.join(codedirpath, targetfile))
-    if filepath.is_file():
-        logger.debug("File {} present!".format(targetfile))
-    else:
-        # Try to find a matching but differently capitalised file
-        potential_files = [file for file in os.listdir(codedirpath) if file.lower() == targetfile.lower()]
-        if len(potential_files) > 0:
-            targetfile = potential_files[0]
-            logger.warning("Inferred target file as {}".format(targetfile))
-        else:
-            if not testspec["required"]:
-                logger.warning("File {} absent but not required!".format(targetfile))
-            else:
-                logger.critical("File {} absent!".format(targetfile))
-                deductions["value"] += 1
-                deductions["reasons"].append("file_missing")
-                return "File missing!", "File missing!", deductions, other
+    # Check if file is present (allowing for different capitalisation)
+    targetfile = find_target(studentspec, modulespec, targetfile, testspec, deductions)
+    if targetfile is None:
+        return "File missing!", "File missing!", deductions, other
 
-    # Lint
-    linter_result = subprocess.run(f"shellcheck {targetfile}", cwd=codedirpath, shell=True, text=True, timeout = timeout,
-                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    # Lint (in the background while the rest of the test runs)
+    linter_future = runner.submit(["shellcheck", targetfile], cwd=codedirpath, timeout=timeout)
     # Run script
     starttime = datetime.now()
-    try:
-        teststr = f"bash {targetfile}"
-        logger.info("Running {} using following command: {}".format(targetfile, teststr))
-        run_result = subprocess.run(teststr, cwd=codedirpath, shell=True, text=True, timeout = timeout,
-                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    except subprocess.TimeoutExpired as e:
-        timedout = True
-        run_result = e
-        logger.critical("{} timed out! -1 point".format(targetfile))
-        deductions["value"] += 1
-        deductions["reasons"].append("timeout")
+    testargs = ["bash", targetfile]
+    logger.info("Running {} using following command: {}".format(targetfile, " ".join(testargs)))
+    run_result = runner.run(testargs, cwd=codedirpath, timeout=timeout, limits=testspec.get("limits"),
+                            capture=testspec.get("capture"))
+    timedout = runner.cut_short(run_result, targetfile, deductions)
     endtime = datetime.now()
 
     # Parse exec time
     elapsed = endtime - starttime
     other["exectime_s"] = elapsed.total_seconds()
+    # CPU time, peak memory, block I/O and process count of the student script
+    other.update(runner.total_resources(run_result))
     logger.info("Ran {} in {}".format(targetfile, elapsed))
 
     # Check error code
     if timedout:
-        run_stdout = run_result.stdout.decode()
+        run_stdout = run_result.stdout
     else:
         if run_result.returncode != 0:
             logger.critical("{} errored! -1 point".format(targetfile))
@@ -72,4 +55,4 @@ def main(filelocation, targetfile,studentspec, modulespec, testspec):
             deductions["reasons"].append("run_error")
         run_stdout = run_result.stdout
 
-    return run_stdout, linter_result.stdout, deductions, other
+    return run_stdout, linter_future.result().stdout, deductions, other
@@ -1,6 +1,7 @@
 import logging
 import os
-from pathlib import Path
+
+from markutils.inventory import find_target
 
 logger = logging.getLogger("mark")
 
@@ -16,24 +17,9 @@ def main(filelocation, targetfile,studentspec, modulespec, testspec):
     datadirpath = os.path.join(moduledirpath, modulespec["dataloc"])
     resultsdirpath = os.path.join(moduledirpath, modulespec["resultsloc"])
 
-    # Check if file is present
-    filepath = Path(os.path.join(codedirpath, targetfile))
-
-    if filepath.is_file():
-        logger.debug("File {} present!".format(targetfile))
-    else:
-        # Try to find a matching but differently capitalised file
-        potential_files = [file for file in os.listdir(codedirpath) if file.lower() == targetfile.lower()]
-        if len(potential_files) > 0:
-            targetfile = potential_files[0]
-            logger.warning("Inferred target file as {}".format(targetfile))
-        else:
-            if not testspec["required"]:
-                logger.warning("File {} absent but not required!".format(targetfile))
-            else:
-                logger.critical("File {} absent!".format(targetfile))
-                deductions["value"] += 1
-                deductions["reasons"].append("file_missing")
-                return "File missing!", "File missing!", deductions, other
+    # Check if file is present (allowing for different capitalisation)
+    targetfile = find_target(studentspec, modulespec, targetfile, testspec, deductions)
+    if targetfile is None:
+        return "File missing!", "File missing!", deductions, other
 
     return "", "", deductions, other
\ No newline at end of file
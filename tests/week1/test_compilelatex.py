@@ -1,8 +1,9 @@
 import logging
 import os
-import subprocess
 from datetime import datetime
-from pathlib import Path
+
+from markutils import runner
+from markutils.inventory import find_target
 
 logger = logging.getLogger("mark")
 
@@ -20,54 +21,33 @@ def main(filelocation, targetfile,studentspec, modulespec, testspec):
     datadirpath = os.path.join(moduledirpath, modulespec["dataloc"])
     resultsdirpath = os.path.join(moduledirpath, modulespec["resultsloc"])
 
-    # Check if file is present
-    filepath = Path(os.path.join(codedirpath, targetfile))
-    if filepath.is_file():
-        logger.debug("File {} present!".format(targetfile))
-    else:
-        # Try to find a matching but differently capitalised file
-        potential_files = [file for file in os.listdir(codedirpath) if file.lower() == targetfile.lower()]
-        if len(potential_files) > 0:
-            targetfile = potential_files[0]
-            logger.warning("Inferred target file as {}".format(targetfile))
-        else:
-            if not testspec["required"]:
-                logger.warning("File {} absent but not required!".format(targetfile))
-            else:
-                logger.critical("File {} absent!".format(targetfile))
-                deductions["value"] += 1
-                deductions["reasons"].append("file_missing")
-                return "File missing!", "File missing!", deductions, other
+    # Check if file is present (allowing for different capitalisation)
+    targetfile = find_target(studentspec, modulespec, targetfile, testspec, deductions)
+    if targetfile is None:
+        return "File missing!", "File missing!", deductions, other
 
-    # Lint
-    linter_result = subprocess.run(f"shellcheck {targetfile}", cwd=codedirpath, shell=True, text=True, timeout = timeout,
-                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    # Lint (in the background while the rest of the test runs)
+    linter_future = runner.submit(["shellcheck", targetfile], cwd=codedirpath, timeout=timeout)
 
     # Setup (if required)
     # Assume firstexample exists, but check for it
-    firstexample = [file for file in os.listdir(codedirpath) if file.lower() == "firstexample.tex"]
+    firstexample = studentspec["inventory"].find(os.path.join(modulespec["folder"], modulespec["codeloc"]), "firstexample.tex")
     if len(firstexample) > 0:
         firstexample = os.path.splitext(firstexample[0])[0]
     else:
         logger.critical("No FirstExample.tex file present to parse!")
         deductions["value"] += 1
         deductions["reasons"].append("data_missing")
-        return "Data missing!", linter_result.stdout, deductions, other
+        return "Data missing!", linter_future.result().stdout, deductions, other
 
 
     # Run script
     starttime = datetime.now()
-    try:
-        teststr = f"bash {targetfile} {firstexample}"
-        logger.info("Running {} using following command: {}".format(targetfile, teststr))
-        run_result = subprocess.run(teststr, cwd=codedirpath, shell=True, text=True, timeout = timeout,
-                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    except subprocess.TimeoutExpired as e:
-        timedout = True
-        run_result = e
-        logger.critical("{} timed out! -1 point".format(targetfile))
-        deductions["value"] += 1
-        deductions["reasons"].append("timeout")
+    testargs = ["bash", targetfile, firstexample]
+    logger.info("Running {} using following command: {}".format(targetfile, " ".join(testargs)))
+    run_result = runner.run(testargs, cwd=codedirpath, timeout=timeout, limits=testspec.get("limits"),
+                            capture=testspec.get("capture"))
+    timedout = runner.cut_short(run_result, targetfile, deductions)
     endtime = datetime.now()
 
     # Verify
@@ -76,11 +56,13 @@ def main(filelocation, targetfile,studentspec, modulespec, testspec):
     # Parse exec time
     elapsed = endtime - starttime
     other["exectime_s"] = elapsed.total_seconds()
+    # CPU time, peak memory, block I/O and process count of the student script
+    other.update(runner.total_resources(run_result))
     logger.info("Ran {} in {}".format(targetfile, elapsed))
 
     # Check error code
     if timedout:
-        run_stdout = run_result.stdout.decode()
+        run_stdout = run_result.stdout
     else:
         if run_result.returncode != 0:
             logger.critical("{} errored! -1 point".format(targetfile))
@@ -91,12 +73,5 @@ def main(filelocation, targetfile,studentspec, modulespec, testspec):
         # Evaluate veracity
         # <VERACITY EVALUATION CODE HERE>
 
-    # Cleanup
-    for x in [f"{firstexample}.pdf"]:
-        try:
-            os.remove(os.path.join(codedirpath, x))
-            logger.debug("Removed {}".format(os.path.join(codedirpath, x)))
-        except FileNotFoundError:
-            pass
 
-    return run_stdout, linter_result.stdout, deductions, other
+    return run_stdout, linter_future.result().stdout, deductions, other
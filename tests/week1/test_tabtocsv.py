@@ -1,11 +1,15 @@
 import logging
 import os
-import subprocess
 from datetime import datetime
-from pathlib import Path
+
+from markutils import runner, verify
+from markutils.inventory import find_target
 
 logger = logging.getLogger("mark")
 
+# Test inputs, placed into the student's data folder by main()
+FIXTURES = {"testtsv.tsv": "1\thello\tgoodbye\thmm\n5\t6\t7\t8\n"}
+
 def main(filelocation, targetfile,studentspec, modulespec, testspec):
     timedout = False
     # Default timeout of 10m.
@@ -20,100 +24,61 @@ def main(filelocation, targetfile,studentspec, modulespec, testspec):
     datadirpath = os.path.join(moduledirpath, modulespec["dataloc"])
     resultsdirpath = os.path.join(moduledirpath, modulespec["resultsloc"])
 
-    # Check if file is present
-    filepath = Path(os.path.join(codedirpath, targetfile))
-    if filepath.is_file():
-        logger.debug("File {} present!".format(targetfile))
-    else:
-        # Try to find a matching but differently capitalised file
-        potential_files = [file for file in os.listdir(codedirpath) if file.lower() == targetfile.lower()]
-        if len(potential_files) > 0:
-            targetfile = potential_files[0]
-            logger.warning("Inferred target file as {}".format(targetfile))
-        else:
-            if not testspec["required"]:
-                logger.warning("File {} absent but not required!".format(targetfile))
-            else:
-                logger.critical("File {} absent!".format(targetfile))
-                deductions["value"] += 1
-                deductions["reasons"].append("file_missing")
-                return "File missing!", "File missing!", deductions, other
+    # Check if file is present (allowing for different capitalisation)
+    targetfile = find_target(studentspec, modulespec, targetfile, testspec, deductions)
+    if targetfile is None:
+        return "File missing!", "File missing!", deductions, other
 
-    # Lint
-    linter_result = subprocess.run(f"shellcheck {targetfile}", cwd=codedirpath, shell=True, text=True, timeout = timeout,
-                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    # Lint (in the background while the rest of the test runs)
+    linter_future = runner.submit(["shellcheck", targetfile], cwd=codedirpath, timeout=timeout)
 
     # Setup
-    _ = subprocess.run(f"echo '1\thello\tgoodbye\thmm\n5\t6\t7\t8' > ../{modulespec['dataloc']}/testtsv.tsv;cp ../{modulespec['dataloc']}/testtsv.tsv ../{modulespec['dataloc']}/testtsv.txt", cwd=codedirpath, shell=True,
-                       text=True, timeout=timeout,
-                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    testspec["fixtures"].place("testtsv.tsv", datadirpath)
+    testspec["fixtures"].place("testtsv.tsv", datadirpath, destname="testtsv.txt")
     # Run script
     starttime = datetime.now()
-    try:
-        # run
-        teststr = f"bash {targetfile} ../{modulespec['dataloc']}/testtsv.tsv"
-        logger.info("Running {} using following command: {}".format(targetfile, teststr))
-        run_result = subprocess.run(teststr, cwd=codedirpath, shell=True, text=True, timeout = timeout,
-                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        teststr = f"bash {targetfile} ../{modulespec['dataloc']}/testtsv.txt"
-        logger.info("Running {} alternately using following command: {}".format(targetfile, teststr))
-        run_result_2 = subprocess.run(teststr, cwd=codedirpath,
-                                    shell=True, text=True, timeout=timeout,
-                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    except subprocess.TimeoutExpired as e:
-        timedout = True
-        run_result = e
-        logger.critical("{} timed out! -1 point".format(targetfile))
-        deductions["value"] += 1
-        deductions["reasons"].append("timeout")
+    # run
+    testargs = ["bash", targetfile, f"../{modulespec['dataloc']}/testtsv.tsv"]
+    logger.info("Running {} using following command: {}".format(targetfile, " ".join(testargs)))
+    run_result = runner.run(testargs, cwd=codedirpath, timeout=timeout, limits=testspec.get("limits"),
+                            capture=testspec.get("capture"))
+    run_results = [run_result]
+    if not run_result.timedout and not run_result.limits_exceeded:
+        testargs = ["bash", targetfile, f"../{modulespec['dataloc']}/testtsv.txt"]
+        logger.info("Running {} alternately using following command: {}".format(targetfile, " ".join(testargs)))
+        run_result_2 = runner.run(testargs, cwd=codedirpath, timeout=timeout, limits=testspec.get("limits"),
+                                  capture=testspec.get("capture"))
+        run_results.append(run_result_2)
+        if run_result_2.timedout or run_result_2.limits_exceeded:
+            run_result = run_result_2
+    timedout = runner.cut_short(run_result, targetfile, deductions)
     endtime = datetime.now()
 
     # Verify
-    # Verify csv output using `file` command of bash.
-    try:
-        # verify_out = subprocess.run(f"file ../{modulespec['dataloc']}/testtsv.csv -b", cwd=codedirpath, shell=True, text=True,
-        #                             timeout=timeout,
-        #                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        # verify_out_alt = subprocess.run(f"file ../{modulespec['dataloc']}/testtsv.tsv.csv -b", cwd=codedirpath, shell=True, text=True,
-        #                                 timeout=timeout,
-        #                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-
-        # Using grep instead to verify number of tabs (should be 0)
-
-        verify_out = []
-        char_arg = 'str=\"\t\"'
-        count_processor = "'{ c += gsub(str, str) } END { print c }'"
-        final_verify_str = f"awk -v {char_arg} {count_processor}"
-        for x in [
-            f"{modulespec['dataloc']}/testtsv.csv",
-            f"{modulespec['dataloc']}/testtsv.tsv.csv",
-            f"{modulespec['dataloc']}/testtsv.txt.csv",
-            f"{modulespec['resultsloc']}/testtsv.csv",
-            f"{modulespec['resultsloc']}/testtsv.tsv.csv",
-            f"{modulespec['resultsloc']}/testtsv.txt.csv",
-            f"{modulespec['codeloc']}/testtsv.csv",
-            f"{modulespec['codeloc']}/testtsv.tsv.csv",
-            f"{modulespec['codeloc']}/testtsv.txt.csv"
-
-        ]:
-            v = subprocess.run(f"{final_verify_str} ../{x}",
-                                             cwd=codedirpath, shell=True,
-                                             text=True,
-                                             timeout=timeout,
-                                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout.strip()
-            verify_out.append((x, v))
-
-    except subprocess.TimeoutExpired as e:
-        logger.critical("MARKER ERROR - {} verification timed out!".format(targetfile))
+    # Count the tabs in every candidate output (should be 0 in at least one of them)
+    candidates = [
+        f"{modulespec['dataloc']}/testtsv.csv",
+        f"{modulespec['dataloc']}/testtsv.tsv.csv",
+        f"{modulespec['dataloc']}/testtsv.txt.csv",
+        f"{modulespec['resultsloc']}/testtsv.csv",
+        f"{modulespec['resultsloc']}/testtsv.tsv.csv",
+        f"{modulespec['resultsloc']}/testtsv.txt.csv",
+        f"{modulespec['codeloc']}/testtsv.csv",
+        f"{modulespec['codeloc']}/testtsv.tsv.csv",
+        f"{modulespec['codeloc']}/testtsv.txt.csv"
+    ]
+    verify_out = [(x, verify.count_char(os.path.join(moduledirpath, x), "\t")) for x in candidates]
 
     # Parse exec time
     elapsed = endtime - starttime
     other["exectime_s"] = elapsed.total_seconds()
+    # CPU time, peak memory, block I/O and process count of the student script
+    other.update(runner.total_resources(*run_results))
     logger.info("Ran {} in {}".format(targetfile, elapsed))
 
     # Check error code
     if timedout:
-        run_stdout = run_result.stdout.decode()
+        run_stdout = run_result.stdout
     else:
         # Wrap up
         if run_result.returncode != 0 and run_result_2.returncode != 0:
@@ -128,21 +93,13 @@ def main(filelocation, targetfile,studentspec, modulespec, testspec):
         #     logger.warning("{} gave possibly incorrect output. -0.5 points".format(targetfile))
         #     deductions["value"] += 0.5
         #     deductions["reasons"].append("result_error")
-        elif all([v[1] != "0" for v in verify_out]):
+        elif all([v[1] != 0 for v in verify_out]):
             logger.warning("{} gave possibly incorrect output. -0.5 points".format(targetfile))
-            logger.info("One of these should have been a 0 with no error:\n{}".format("\n".join([f'{v[0]}: {v[1]}' for v in verify_out])))
+            logger.info("One of these should have been a 0 with no error:\n{}".format("\n".join([f'{v[0]}: {"not found or empty" if v[1] is None else v[1]}' for v in verify_out])))
             deductions["value"] += 0.5
             deductions["reasons"].append("result_error")
 
         run_stdout = "\n\n".join([run_result.stdout, run_result_2.stdout])
 
-    # Cleanup
-    for x in ["testtsv.tsv", "testtsv.txt", "testtsv.csv", "testtsv.tsv.csv"]:
-        for y in [datadirpath, resultsdirpath, codedirpath]:
-            try:
-                os.remove(os.path.join(y, x))
-                logger.debug("Removed {}".format(os.path.join(y, x)))
-            except FileNotFoundError:
-                pass
 
-    return run_stdout, linter_result.stdout, deductions, other
+    return run_stdout, linter_future.result().stdout, deductions, other
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+import argparse
+import os
+
+from markutils.history import ALPHA, MIN_RATIO, WINDOW, TimingHistory
+
+
+def describe(runs, run_id):
+    run_id, started, host, cpus, jobs, testjobs = runs[run_id]
+    return "run {} ({}, on {} with {} CPUs, -j {} -t {})".format(run_id, started, host, cpus, jobs, testjobs)
+
+
+def main(args):
+    if not os.path.exists(args["history"]):
+        print("No timing history at {}, run mark.py first.".format(args["history"]))
+        return
+    history = TimingHistory(args["history"])
+    runs = {row[0]: row for row in history.runs()}
+    if not runs:
+        history.close()
+        print("No finished runs in {}.".format(args["history"]))
+        return
+    if args["run"] is not None and args["run"] not in runs:
+        history.close()
+        print("Run {} is not a finished run in {} (the latest finished run is {}).".format(args["run"], args["history"], max(runs)))
+        return
+    report = history.compare(args["run"], window=args["window"], alpha=args["alpha"], min_ratio=args["ratio"])
+    schedule = history.schedule(report["run"])
+    history.close()
+
+    print("Checking {}".format(describe(runs, report["run"])))
+    if schedule is not None:
+        print("  marking took {2:.1f}s, against a predicted {0:.1f}s ({1:.1f}s had students been marked in students.json order)".format(*schedule))
+    if not report["baseline"]:
+        print("No earlier runs to compare against.")
+        return
+    print("compared against the median of {} earlier run/s:".format(len(report["baseline"])))
+    for run_id in report["baseline"]:
+        print("  {}".format(describe(runs, run_id)))
+    hosts = {runs[run_id][2:6] for run_id in report["baseline"]}
+    if hosts != {runs[report["run"]][2:6]}:
+        print("WARNING: the runs were not all made on the same host with the same settings, so timings may not be comparable.")
+
+    print("\nStudent scripts and marker phases (median time per student, slowdown = median of new / old):")
+    print("{:<12} {:<28} {:>8} {:>10} {:>10} {:>8} {:>8}".format("module", "script/phase", "students", "old (s)", "new (s)", "slowdown", "p"))
+    for t in report["tests"]:
+        notes = []
+        if t["flagged"]:
+            notes.append("SLOWER")
+        if (t["module"], t["test"]) in report["changed_tests"]:
+            notes.append("test changed")
+        print("{:<12} {:<28} {:>8} {:>10.4g} {:>10.4g} {:>8} {:>8} {}".format(
+            t["module"], t["test"], t["students"], t["old_s"], t["new_s"],
+            "-" if t["ratio"] is None else "{:.2f}x".format(t["ratio"]),
+            "-" if t["p"] is None else "{:.3g}".format(t["p"]), ", ".join(notes)))
+
+    if report["students"]:
+        print("\nStudents slowed down much more than everyone else:")
+        for s in sorted(report["students"], key=lambda s: s["z"], reverse=True):
+            print("  {:<20} {:<12} {:<28} {:.4g}s -> {:.4g}s".format(s["student"], s["module"], s["test"], s["old_s"], s["new_s"]))
+
+    if report["phases"]:
+        print("\nWhole-run phases of the marker:")
+        for ph in report["phases"]:
+            note = "SLOWER" if ph["flagged"] else ("" if ph["z"] is not None else "(too few runs to test)")
+            print("  {:<16} {:>10.4g}s -> {:>10.4g}s {}".format(ph["phase"], ph["old_s"], ph["new_s"], note))
+
+    flagged = [t for t in report["tests"] if t["flagged"]] + [ph for ph in report["phases"] if ph["flagged"]]
+    print("\n{} significant slowdown/s, {} student/s standing out.".format(len(flagged), len(report["students"])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the timings of a marking run against previous runs, flagging slowdowns.")
+    parser.add_argument("history", help="The timing history written by mark.py", nargs="?",
+                        const="results/history.sqlite", default="results/history.sqlite")
+    parser.add_argument("--run", type=int, default=None, help="run to check (default: the latest)")
+    parser.add_argument("-w", "--window", type=int, default=WINDOW, help="number of earlier runs to compare against (default: {})".format(WINDOW))
+    parser.add_argument("-a", "--alpha", type=float, default=ALPHA, help="significance level (default: {})".format(ALPHA))
+    parser.add_argument("--ratio", type=float, default=MIN_RATIO,
+                        help="smallest slowdown, as a ratio of new time to old, worth flagging (default: {})".format(MIN_RATIO))
+
+    arglist = parser.parse_args()
+    arglist = vars(arglist)
+    main(arglist)
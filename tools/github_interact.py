@@ -6,22 +6,341 @@ import json
 import argparse
 from pprint import pformat
 import shutil
-import multiprocessing
-from math import ceil
-from datetime import datetime
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 
-def download_student(student, datafolder, timeout):
+def git(args, cwd, timeout):
+    """Run a git command, returning the CompletedProcess with stdout and stderr combined."""
+    return subprocess.run(["git"] + args, cwd=cwd, text=True, timeout=timeout,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+
+def fetch_options(depth=None, blobfilter=None):
+    options = []
+    if depth:
+        options.append(f"--depth={depth}")
+    if blobfilter:
+        options.append(f"--filter={blobfilter}")
+    return options
+
+
+def is_checkout(path, timeout):
+    """Return True if path is the top level of a usable git working tree."""
+    if not os.path.isdir(os.path.join(path, ".git")):
+        return False
+    result = git(["rev-parse", "--show-toplevel"], path, timeout)
+    return result.returncode == 0 and os.path.samefile(result.stdout.strip(), path)
+
+
+def set_sparse(path, folders, timeout):
+    """Limit the checkout of a repo to some top-level folders, plus every file at the top level (cone mode).
+
+    Folders are matched case-insensitively against those in the repo, as weekchecker does when
+    looking for a module folder.
+
+    :return: the CompletedProcess of git sparse-checkout.
+    """
+    result = git(["ls-tree", "-d", "-z", "--name-only", "HEAD"], path, timeout)
+    topdirs = result.stdout.split("\0") if result.returncode == 0 else []
+    wanted = {folder.lower() for folder in folders}
+    dirs = sorted(set(folders) | {d for d in topdirs if d and d.lower() in wanted})
+    return git(["sparse-checkout", "set", "--cone", "--"] + dirs, path, timeout)
+
+
+def update_reference(url, refdir, timeout):
+    """Create or update a local bare mirror of the course template, to be shared as an object store by every student repo.
+
+    Refs are never pruned and the mirror is never garbage collected, as the student repos borrowing
+    its objects would be broken if any of them were deleted.
+
+    :return: the CompletedProcess of the last git command.
+    """
+    if os.path.isdir(refdir):
+        result = git(["fetch", "origin"], refdir, timeout)
+    else:
+        result = git(["clone", "--mirror", url, refdir], os.path.dirname(refdir), timeout)
+    if result.returncode == 0:
+        git(["config", "gc.auto", "0"], refdir, timeout)
+        git(["config", "gc.pruneExpire", "never"], refdir, timeout)
+    return result
+
+
+def alternates_file(path):
+    return os.path.join(path, ".git", "objects", "info", "alternates")
+
+
+def borrow_objects(path, refdir, timeout):
+    """Make an existing clone use the objects of the reference repo, then drop its own copies of them."""
+    alternates = alternates_file(path)
+    objects = os.path.join(refdir, "objects")
+    if os.path.exists(alternates):
+        with open(alternates) as f:
+            if objects in f.read().splitlines():
+                return git(["rev-parse", "HEAD"], path, timeout)
+    with open(alternates, "a") as f:
+        f.write(objects + "\n")
+    return git(["repack", "-a", "-d", "-l", "-q"], path, timeout)
+
+
+def dissociate_repo(path, timeout):
+    """Copy any objects borrowed from a reference repo into a clone, so that it no longer depends on it."""
+    alternates = alternates_file(path)
+    if not os.path.exists(alternates):
+        return git(["rev-parse", "HEAD"], path, timeout)
+    result = git(["repack", "-a", "-d", "-q"], path, timeout)
+    if result.returncode == 0:
+        os.remove(alternates)
+    return result
+
+
+def update_student(student, datafolder, timeout, depth=None, blobfilter=None, sparse=None, reference=None, dissociate=False):
+    """Bring an existing clone up to date with the remote's default branch, discarding any local changes.
+
+    :return: tuple of (success, output of the git commands).
+    """
+    path = os.path.join(datafolder, student["folder"])
+    output = ""
+    if reference and not dissociate:
+        result = borrow_objects(path, reference, timeout)
+        output += result.stdout
+        if result.returncode != 0:
+            return False, output
+    steps = [["remote", "set-url", "origin", student["git"]],
+             ["fetch", "--prune", "--no-tags"] + fetch_options(depth, blobfilter) + ["origin", "HEAD"],
+             ["reset", "--hard", "FETCH_HEAD"],
+             ["clean", "-ffdx"]]
+    for step in steps:
+        result = git(step, path, timeout)
+        output += result.stdout
+        if result.returncode != 0:
+            return False, output
+    if sparse:
+        result = set_sparse(path, sparse, timeout)
+    else:
+        result = git(["sparse-checkout", "disable"], path, timeout)
+    output += result.stdout
+    if result.returncode == 0 and dissociate:
+        result = dissociate_repo(path, timeout)
+        output += result.stdout
+    return result.returncode == 0, output
+
+
+def download_student(student, datafolder, timeout, depth=None, blobfilter=None, reclone=False, sparse=None, reference=None,
+                     dissociate=False):
+    """Download or update the repo of a single student into datafolder/student["folder"].
+
+    An existing clone is updated in place by fetching the remote's default branch and hard resetting
+    to it, which only transfers new objects. A fresh clone is only made if there is no clone yet, it
+    is unusable, updating it fails or reclone is set, and replaces the existing one only once it has
+    succeeded.
+
+    :param student: the data of the student, pulled from students.json.
+    :param datafolder: the folder holding every student's repo.
+    :param timeout: seconds to allow each git command.
+    :param depth: optional number of commits of history to fetch (a shallow clone).
+    :param blobfilter: optional partial clone filter (e.g. "blob:none"), so that file contents are only downloaded when checked out.
+    :param reclone: always delete any existing clone and clone afresh.
+    :param sparse: optional list of top-level folders to limit the checkout to (along with the top-level files).
+    :param reference: optional bare repo (e.g. of the course template) to borrow objects from rather than download and store them again.
+    :param dissociate: copy any borrowed objects into the student's repo, so that it no longer depends on the reference repo.
+    :return: tuple of the status ("updated", "cloned", "skipped", "failed" or "timeout") and the output of the git commands.
+    """
     if not student["git"]:
-        return f"No git defined for {student['name']}"
-    if os.path.isdir(student["folder"]):
-        shutil.rmtree(student["folder"])
+        return "skipped", f"No git defined for {student['name']}"
+    path = os.path.join(datafolder, student["folder"])
+    output = ""
     try:
-        run_result = subprocess.run(f"git clone {student['git']} {student['folder']}", cwd=datafolder,
-                                    shell=True, text=True, timeout=timeout,
-                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if not reclone and is_checkout(path, timeout):
+            updated, output = update_student(student, datafolder, timeout, depth, blobfilter, sparse, reference, dissociate)
+            if updated:
+                return "updated", output
+            output += f"Update of {student['folder']} failed, recloning\n"
+        # Clone alongside any existing copy, only replacing it once the clone has succeeded
+        tmpfolder = f"{student['folder']}.clone"
+        if os.path.lexists(os.path.join(datafolder, tmpfolder)):
+            shutil.rmtree(os.path.join(datafolder, tmpfolder))
+        clone_options = fetch_options(depth, blobfilter)
+        if sparse:
+            clone_options.append("--sparse")
+        if reference:
+            clone_options += ["--reference", reference] + (["--dissociate"] if dissociate else [])
+        run_result = git(["clone"] + clone_options + [student["git"], tmpfolder], datafolder, timeout)
+        if run_result.returncode == 0 and sparse:
+            sparse_result = set_sparse(os.path.join(datafolder, tmpfolder), sparse, timeout)
+            run_result.stdout += sparse_result.stdout
+            run_result.returncode = sparse_result.returncode
+        if run_result.returncode != 0:
+            if os.path.lexists(os.path.join(datafolder, tmpfolder)):
+                shutil.rmtree(os.path.join(datafolder, tmpfolder))
+            return "failed", output + run_result.stdout
+        if os.path.lexists(path):
+            shutil.rmtree(path)
+        os.rename(os.path.join(datafolder, tmpfolder), path)
+    except subprocess.TimeoutExpired as e:
+        return "timeout", f"{output}Git timed out: {str(e)}"
     except Exception as e:
-        return f"Git error: {str(e)}"
-    return run_result.stdout
+        return "failed", f"{output}Git error: {str(e)}"
+    return "cloned", output + run_result.stdout
+
+
+# Git errors that are worth retrying, as they are likely due to the network or the server rather than the repo.
+TRANSIENT_ERRORS = ["Could not resolve host", "Failed to connect", "Couldn't connect to server", "ssh: connect to host",
+                    "Connection closed", "Connection timed out", "Connection reset", "Connection refused",
+                    "early EOF", "RPC failed", "The remote end hung up unexpectedly", "unexpected disconnect",
+                    "Operation timed out", "Temporary failure", "HTTP 429", "returned error: 5", "SSL_ERROR", "gnutls_handshake"]
+
+
+def is_transient(status, output):
+    return status == "timeout" or (status == "failed" and any(error in output for error in TRANSIENT_ERRORS))
+
+
+def local_head(path, timeout):
+    """Return the commit checked out in a clone, or None if there is no usable clone."""
+    try:
+        if not is_checkout(path, timeout):
+            return None
+        result = git(["rev-parse", "--verify", "-q", "HEAD"], path, timeout)
+    except subprocess.TimeoutExpired:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def remote_head(url, timeout):
+    """Return the commit the remote HEAD points to, or None if it could not be found."""
+    if not url:
+        return None
+    try:
+        result = git(["ls-remote", url, "HEAD"], None, timeout)
+    except subprocess.TimeoutExpired:
+        return None
+    if result.returncode != 0 or not result.stdout.strip():
+        return None
+    return result.stdout.split()[0]
+
+
+def find_unchanged(students, datafolder, timeout, jobs):
+    """Check every student's remote HEAD against their clone with one concurrent pass of git ls-remote.
+
+    :return: {studentid: commit} of the students whose clone is already at their remote HEAD.
+    """
+    def check(item):
+        studentid, student = item
+        head = remote_head(student["git"], timeout)
+        return studentid, head, head is not None and head == local_head(os.path.join(datafolder, student["folder"]), timeout)
+
+    with ThreadPoolExecutor(jobs) as executor:
+        return {studentid: head for studentid, head, same in executor.map(check, students.items()) if same}
+
+
+def parse_deadline(value):
+    """Parse an ISO 8601 timestamp (e.g. 2024-11-01T17:00), taken as local time unless it has a UTC offset."""
+    deadline = datetime.fromisoformat(value)
+    return deadline if deadline.tzinfo else deadline.astimezone()
+
+
+def student_deadline(student, deadline):
+    """Return the deadline of a single student, applying any "extension" in students.json.
+
+    The extension is either a number of hours added to the deadline, or a timestamp replacing it.
+    Raises ValueError if it is neither.
+    """
+    extension = student.get("extension")
+    if extension is None:
+        return deadline
+    if isinstance(extension, (int, float)) and not isinstance(extension, bool):
+        return deadline + timedelta(hours=extension)
+    if not isinstance(extension, str):
+        raise ValueError(f"extension must be a number of hours or a timestamp, not {extension!r}")
+    try:
+        return parse_deadline(extension)
+    except ValueError:
+        raise ValueError(f"extension {extension!r} is not a valid timestamp (e.g. 2024-11-01T17:00)") from None
+
+
+def checkout_snapshot(path, deadline, timeout):
+    """Check out the last commit made before a deadline on the branch currently checked out.
+
+    Commits are dated by their committer date, following first parents only so that commits merged
+    in after the deadline do not count. A shallow clone is deepened if it does not reach the deadline.
+
+    :return: tuple of (commit checked out or None if there is none before the deadline, number of commits after it, output).
+    """
+    before = ["rev-list", "-1", "--first-parent", "--before=" + deadline.strftime("%Y-%m-%d %H:%M:%S %z"), "HEAD"]
+    result = git(before, path, timeout)
+    output = result.stdout
+    if result.returncode == 0 and not result.stdout.strip() and os.path.exists(os.path.join(path, ".git", "shallow")):
+        result = git(["fetch", "--unshallow", "--no-tags", "origin", "HEAD"], path, timeout)
+        output += result.stdout
+        if result.returncode == 0:
+            result = git(before, path, timeout)
+            output += result.stdout
+    commit = result.stdout.strip()
+    if result.returncode != 0 or not commit:
+        return None, None, output
+    late = git(["rev-list", "--count", "--first-parent", f"{commit}..HEAD"], path, timeout)
+    for step in (["reset", "--hard", commit], ["clean", "-ffdx"]):
+        result = git(step, path, timeout)
+        output += result.stdout
+        if result.returncode != 0:
+            return None, None, output
+    return commit, int(late.stdout) if late.returncode == 0 else None, output
+
+
+def git_size(path):
+    """Return the total size in bytes of the .git folder of a repo, or 0 if there is none."""
+    total = 0
+    for root, _, files in os.walk(os.path.join(path, ".git")):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def sync_student(studentid, student, datafolder, timeout, depth=None, blobfilter=None, reclone=False, sparse=None, reference=None,
+                 dissociate=False, retries=3, backoff=2.0, deadline=None):
+    """Download or update the repo of a single student, retrying transient failures with exponential backoff.
+
+    :param studentid: identifier of the student.
+    :param student: the data of the student, pulled from students.json.
+    :param retries: number of times to retry after a transient failure.
+    :param backoff: seconds to wait before the first retry, doubling (with some jitter) for each one after.
+    :param deadline: optional datetime, to check out the last commit before it (or the student's extended deadline) rather than the latest.
+    :return: a report dict of the student's status, commit checked out, attempts, bytes added to their .git folder, duration and output.
+    """
+    path = os.path.join(datafolder, student["folder"])
+    before = git_size(path)
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        status, output = download_student(student, datafolder, timeout, depth, blobfilter, reclone, sparse, reference, dissociate)
+        if attempt > retries or not is_transient(status, output):
+            break
+        wait = backoff * 2 ** (attempt - 1) * random.uniform(0.75, 1.25)
+        print(f"{studentid}: {status} on attempt {attempt}, retrying in {wait:.1f}s")
+        time.sleep(wait)
+    report = {"student": studentid, "status": status}
+    if deadline is not None and status in ("updated", "cloned"):
+        deadline = student_deadline(student, deadline)
+        report["deadline"] = deadline.isoformat()
+        try:
+            commit, report["late_commits"], snapshot_output = checkout_snapshot(path, deadline, timeout)
+        except subprocess.TimeoutExpired as e:
+            commit, snapshot_output = None, f"Git timed out: {str(e)}"
+        output += snapshot_output
+        if commit is None:
+            report["status"] = "failed"
+            output += f"Could not check out a commit from before {deadline.isoformat()}, the repo is left at the latest commit\n"
+    after = git_size(path)
+    report.update({"head": local_head(path, timeout), "attempts": attempt,
+                   "bytes": after if status == "cloned" else max(after - before, 0),
+                   "duration_s": round(time.monotonic() - start, 3), "output": output})
+    return report
 
 
 def main(args):
@@ -29,25 +348,86 @@ def main(args):
     with open(args["students"], "r") as f:
         students = json.load(f)["students"]
     print(pformat(students))
-    os.chdir(args["datafolder"])
-    outlist = []
+    sparse = None
+    if args["sparse"]:
+        with open(args["sparse"], "r") as f:
+            sparse = [modulespec["folder"] for modulespec in json.load(f).values()]
+        print(f"Only checking out {', '.join(sparse)} and top-level files")
+    # Resolve every path given on the command line before moving into the data folder
+    datafolder = os.path.abspath(args["datafolder"])
+    reportfile = os.path.join(os.path.dirname(os.path.abspath(args["students"])), "sync_report.json")
+    refdir = os.path.abspath(args["reference_dir"]) if args["reference_dir"] else os.path.join(datafolder, ".template.git")
+    os.chdir(datafolder)
     starttime = datetime.now()
-    if args["multicore"]:
-        cpus = max(multiprocessing.cpu_count() - 4, 1)
-        print(f"Running on {cpus} CPUs")
-        var_list = [[student, args["datafolder"], timeout] for student in students.values()]
-        chunksize = int(ceil(len(var_list) / cpus))
-        with multiprocessing.Pool(cpus) as p:
-            for result in p.starmap(download_student, var_list, chunksize=chunksize):
-                # print("Completed %s", result[0])
-                outlist.append(result)
+    reference = None
+    if args["reference"]:
+        # Objects shared with the course template are fetched and stored once, in a bare mirror of it
+        reference = refdir
+        print(f"Updating shared template repo {reference} from {args['reference']}")
+        result = update_reference(args["reference"], reference, timeout * 10)
+        if result.returncode != 0 and os.path.isdir(reference):
+            print(f"Could not update the template repo, using it as it is:\n{result.stdout}")
+        elif result.returncode != 0:
+            print(f"Could not create the template repo, so it will not be used:\n{result.stdout}")
+            reference = None
+    elif args["dissociate"]:
+        print("Nothing to dissociate from without --reference, ignoring --dissociate")
+    deadline = parse_deadline(args["before"]) if args["before"] else None
+    if deadline is not None:
+        print(f"Checking out the last commit before {deadline.isoformat()} (or each student's extension)")
+    reports = []
+    if args["unchanged"] and deadline is not None:
+        # A clone already at the remote HEAD may still hold commits made after the deadline
+        print("Every repo has to be checked against the deadline, ignoring -u")
+    elif args["unchanged"] and not args["reclone"]:
+        # Repos that nobody has pushed to since they were last synced need neither fetching nor marking again
+        unchanged = find_unchanged(students, datafolder, timeout, args["jobs"])
+        print(f"{len(unchanged)} of {len(students)} repos unchanged since they were last synced")
+        reports += [{"student": studentid, "status": "unchanged", "head": head, "attempts": 0, "bytes": 0, "duration_s": 0.0, "output": ""}
+                    for studentid, head in unchanged.items()]
+        students_to_sync = {studentid: student for studentid, student in students.items() if studentid not in unchanged}
     else:
-        for student in students.values():
-            result = download_student(student, args["datafolder"], timeout)
-            outlist.append(result)
+        students_to_sync = students
+    if deadline is not None:
+        # Check every extension before starting, so that a typo in students.json fails that student rather than the whole run
+        invalid = {}
+        for studentid, student in students_to_sync.items():
+            try:
+                student_deadline(student, deadline)
+            except ValueError as e:
+                invalid[studentid] = str(e)
+        if invalid:
+            print(f"{len(invalid)} student/s have an invalid extension and will not be synced")
+            reports += [{"student": studentid, "status": "failed", "head": local_head(students[studentid]["folder"], timeout),
+                         "attempts": 0, "bytes": 0, "duration_s": 0.0, "output": f"Not synced, as the {error}\n"}
+                        for studentid, error in invalid.items()]
+            students_to_sync = {studentid: student for studentid, student in students_to_sync.items() if studentid not in invalid}
+    # Syncing is bound by the network and the git server rather than the CPU, so threads are plenty.
+    print(f"Syncing {len(students_to_sync)} repos, {args['jobs']} at a time")
+    with ThreadPoolExecutor(args["jobs"]) as executor:
+        futures = [executor.submit(sync_student, studentid, student, datafolder, timeout, args["depth"], args["filter"],
+                                   args["reclone"], sparse, reference, args["dissociate"], args["retries"], deadline=deadline)
+                   for studentid, student in students_to_sync.items()]
+        for future in as_completed(futures):
+            report = future.result()
+            late = f", {report['late_commits']} commit/s after the deadline" if report.get("late_commits") else ""
+            print(f"{report['student']}: {report['status']} in {report['duration_s']}s ({report['bytes']} bytes{late})")
+            reports.append(report)
     endtime = datetime.now()
     elapsed = endtime - starttime
-    print(f"Ran in {elapsed.total_seconds()}s")
+
+    # Report in students.json order, next to students.json
+    order = {studentid: i for i, studentid in enumerate(students)}
+    reports.sort(key=lambda r: order[r["student"]])
+    counts = Counter(r["status"] for r in reports)
+    with open(reportfile, "w") as f:
+        json.dump({"started": starttime.isoformat(timespec="seconds"), "duration_s": elapsed.total_seconds(),
+                   "counts": dict(counts), "students": reports}, f, indent=4)
+    for report in reports:
+        if report["status"] in ("failed", "timeout"):
+            print(f"FAILED {report['student']} after {report['attempts']} attempt/s:\n{report['output']}")
+    print(", ".join(f"{n} {status}" for status, n in counts.most_common()))
+    print(f"Ran in {elapsed.total_seconds()}s, report written to {reportfile}")
 
 
 if __name__ == '__main__':
@@ -56,8 +436,27 @@ if __name__ == '__main__':
                         const="../data/students.json", default="../data/students.json")
     parser.add_argument("datafolder", help="The folder to save data in.", nargs="?",
                         const="../data", default="../data")
-    parser.add_argument("-m", "--multicore", action="store_true", help="enable multicore cloning.")
+    parser.add_argument("-j", "--jobs", type=int, default=8, help="number of repos to sync at once (default: 8).")
+    parser.add_argument("-m", "--multicore", action="store_true", help="deprecated, repos are now always synced in parallel (see -j).")
+    parser.add_argument("--retries", type=int, default=3, help="times to retry a repo after a network error or timeout (default: 3).")
+    parser.add_argument("--depth", type=int, default=None, help="only fetch this many commits of history (a shallow clone).")
+    parser.add_argument("--filter", default=None, help="partial clone filter, e.g. blob:none to only download file contents as they are checked out.")
+    parser.add_argument("--sparse", nargs="?", const="../data/config.json", default=None, metavar="CONFIG",
+                        help="only check out the module folders named in a marking config (default: ../data/config.json) and top-level files.")
+    parser.add_argument("--reference", default=None, metavar="URL",
+                        help="git URL of the course template, a local mirror of which is shared by every student repo so common objects are only stored and downloaded once.")
+    parser.add_argument("--reference-dir", default=None,
+                        help="where to keep the mirror of the course template (default: DATAFOLDER/.template.git).")
+    parser.add_argument("--dissociate", action="store_true",
+                        help="with --reference, copy the shared objects into each student repo so it stands alone (e.g. before archiving).")
+    parser.add_argument("-u", "--unchanged", action="store_true",
+                        help="first check every remote HEAD with git ls-remote, skipping repos already at it (and reporting them to mark.py -u as unchanged).")
+    parser.add_argument("--before", default=None, metavar="TIMESTAMP",
+                        help="check out the last commit before this deadline (e.g. 2024-11-01T17:00), extended by any \"extension\" in students.json.")
+    parser.add_argument("--reclone", action="store_true", help="delete existing clones and clone afresh, rather than updating them.")
 
     arglist = parser.parse_args()
     arglist = vars(arglist)
+    if arglist["multicore"]:
+        print(f"-m/--multicore is deprecated and can be left out, repos are synced {arglist['jobs']} at a time (set with -j)")
     main(arglist)
\ No newline at end of file
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The scripts in the repo root and tools/ are run directly rather than installed, so import them from there
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "tools")]
@@ -0,0 +1,41 @@
+import json
+import os
+
+from markutils.blobs import BlobRef, BlobStore, load_results
+from markutils.stats import iter_results
+
+
+def test_results_round_trip(tmp_path):
+    results = {
+        "alice": {"week1": {"test.sh": {"stdout": "line\n" * 100, "linterout": "short", "deductions": {"value": 0}}}},
+        "bob": {"week1": {"test.sh": {"stdout": "line\n" * 100, "linterout": "warning\n" * 50, "deductions": {"value": 1}}}},
+    }
+    store = BlobStore(str(tmp_path / "blobs"))
+    stored = {studentid: {module: {test: store.externalize(test_results) for test, test_results in tests.items()}
+                          for module, tests in modules.items()}
+              for studentid, modules in results.items()}
+    # The same output from both students is only stored once
+    assert stored["alice"]["week1"]["test.sh"]["stdout"] == stored["bob"]["week1"]["test.sh"]["stdout"]
+    assert sum(len(files) for _, _, files in os.walk(tmp_path / "blobs")) == 2
+    path = tmp_path / "overall_results.json"
+    path.write_text(json.dumps(stored))
+
+    def resolved(value):
+        if isinstance(value, BlobRef):
+            return value.text
+        if isinstance(value, dict):
+            return {k: resolved(v) for k, v in value.items()}
+        return value
+
+    loaded = load_results(str(path))
+    assert isinstance(loaded["bob"]["week1"]["test.sh"]["linterout"], BlobRef)
+    assert loaded["alice"]["week1"]["test.sh"]["linterout"] == "short"
+    assert resolved(loaded) == results
+    assert {studentid: resolved(r) for studentid, r in iter_results(str(path), chunk_size=16)} == results
+
+
+def test_reading_results_without_blobs_leaves_no_store(tmp_path):
+    path = tmp_path / "overall_results.json"
+    path.write_text(json.dumps({"alice": {"week1": {}}}))
+    assert load_results(str(path)) == {"alice": {"week1": {}}}
+    assert not (tmp_path / "blobs").exists()
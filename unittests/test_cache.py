@@ -0,0 +1,61 @@
+import subprocess
+
+from markutils.cache import ResultCache, folder_hash
+
+
+def git(path, *args):
+    subprocess.run(["git", "-C", str(path), *args], check=True, capture_output=True)
+
+
+def test_hits_and_invalidation(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), marker="v1")
+    key = cache.key("sha256:abc", "testsource", "script.sh", {"timeout": 5})
+    assert cache.get(key) is None
+    cache.put(key, {"results": {"deductions": {"value": 0}}})
+    assert cache.get(key) == {"results": {"deductions": {"value": 0}}}
+    # The same parts give the same key, even from another process sharing the cache
+    assert ResultCache(str(tmp_path / "cache"), marker="v1").key("sha256:abc", "testsource", "script.sh", {"timeout": 5}) == key
+    assert cache.key("sha256:abd", "testsource", "script.sh", {"timeout": 5}) != key
+    assert cache.key("sha256:abc", "testsource", "script.sh", {"timeout": 6}) != key
+    # A different version of the marker never reuses the results
+    assert ResultCache(str(tmp_path / "cache"), marker="v2").key("sha256:abc", "testsource", "script.sh", {"timeout": 5}) != key
+    # A corrupt entry is a miss
+    with open(cache._path(key), "w") as f:
+        f.write("{")
+    assert cache.get(key) is None
+
+
+def test_marker_hash_default(tmp_path):
+    assert ResultCache(str(tmp_path)).marker == ResultCache(str(tmp_path)).marker
+
+
+def test_folder_hash(tmp_path):
+    repo = tmp_path / "repo"
+    module = repo / "week1"
+    (module / "code").mkdir(parents=True)
+    (module / "code" / "script.sh").write_text("echo hi\n")
+    (repo / ".gitignore").write_text("*.tmp\n")
+    plain = folder_hash(str(module))
+    assert plain.startswith("sha256:")
+
+    git(repo, "init", "-q")
+    git(repo, "add", "-A")
+    git(repo, "-c", "user.name=t", "-c", "user.email=t@t", "commit", "-qm", "init")
+    tracked = folder_hash(str(module))
+    assert tracked.startswith("git:")
+
+    # Untracked and ignored files are not in the tree, so the contents are hashed instead
+    (module / "code" / "new.sh").write_text("echo new\n")
+    assert folder_hash(str(module)).startswith("sha256:")
+    (module / "code" / "new.sh").unlink()
+    assert folder_hash(str(module)) == tracked
+    (module / "code" / "data.tmp").write_text("1,2\n")
+    with_ignored = folder_hash(str(module))
+    assert with_ignored.startswith("sha256:")
+    (module / "code" / "data.tmp").write_text("3,4\n")
+    assert folder_hash(str(module)) not in (with_ignored, tracked)
+
+    # Changes to tracked files also fall back to hashing, which sees the change
+    (module / "code" / "data.tmp").unlink()
+    (module / "code" / "script.sh").write_text("echo bye\n")
+    assert folder_hash(str(module)) not in (plain, tracked)
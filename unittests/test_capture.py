@@ -0,0 +1,61 @@
+import gzip
+
+from markutils.capture import OutputCapture, check_output
+
+
+def test_short_output_kept_whole(tmp_path):
+    capture = OutputCapture(str(tmp_path / "out.log.gz"), head_bytes=8, tail_bytes=8)
+    buffer = capture.buffer()
+    buffer.write(b"hello")
+    buffer.write(b" world")
+    buffer.close()
+    assert buffer.getvalue() == b"hello world"
+    assert capture.summary() == {"stdout_bytes": 11, "stdout_spill": None}
+    assert not (tmp_path / "out.log.gz").exists()
+
+
+def test_long_output_truncated_and_spilled(tmp_path):
+    spill = tmp_path / "output" / "out.log.gz"
+    capture = OutputCapture(str(spill), head_bytes=4, tail_bytes=4)
+    data = bytes(range(48, 48 + 40))
+    buffer = capture.buffer()
+    for start in range(0, len(data), 3):
+        buffer.write(data[start:start + 3])
+    buffer.close()
+    value = buffer.getvalue()
+    assert value == data[:4] + b"\n\n[... 32 bytes omitted ...]\n\n" + data[-4:]
+    # The marker is the same wherever the output was spilled to
+    assert str(tmp_path).encode() not in value
+    assert capture.summary() == {"stdout_bytes": 40, "stdout_spill": str(spill)}
+    with gzip.open(spill) as f:
+        assert f.read() == data
+
+
+def test_runs_append_to_spill(tmp_path):
+    spill = tmp_path / "out.log.gz"
+    capture = OutputCapture(str(spill), head_bytes=2, tail_bytes=2)
+    for run in (b"first run\n", b"second run\n"):
+        buffer = capture.buffer()
+        buffer.write(run)
+        buffer.close()
+    with gzip.open(spill) as f:
+        assert f.read() == b"first run\nsecond run\n"
+    assert capture.total_bytes == 21
+    # A new capture for the same test starts afresh
+    OutputCapture(str(spill))
+    assert not spill.exists()
+
+
+def test_without_spill_path(tmp_path):
+    capture = OutputCapture(None, head_bytes=2, tail_bytes=0)
+    buffer = capture.buffer()
+    buffer.write(b"abcdef")
+    buffer.close()
+    assert buffer.getvalue() == b"ab\n\n[... 4 bytes omitted ...]\n\n"
+    assert capture.summary() == {"stdout_bytes": 6, "stdout_spill": None}
+
+
+def test_check_output():
+    assert check_output({"head_bytes": 10, "tail_bytes": 0}) == []
+    assert len(check_output({"head": 1, "tail_bytes": -1, "head_bytes": True})) == 3
+    assert check_output([]) == ["'output' must be a dict"]
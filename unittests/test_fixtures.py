@@ -0,0 +1,27 @@
+import os
+import stat
+
+from markutils.fixtures import FixtureStore
+
+
+def test_placed_fixtures_are_writable_copies(tmp_path):
+    store = FixtureStore(str(tmp_path / "store"))
+    stored = store.add("week1.test_x", "in.txt", "a\tb\n")
+    assert stat.S_IMODE(os.stat(stored).st_mode) == 0o444
+
+    placer = store.placer("week1.test_x")
+    dest = tmp_path / "work"
+    dest.mkdir()
+    placed = placer.place("in.txt", str(dest))
+    assert stat.S_IMODE(os.stat(placed).st_mode) == 0o644
+    with open(placed, "a") as f:
+        f.write("changed\n")
+    with open(stored) as f:
+        assert f.read() == "a\tb\n"
+
+    # Placing again replaces the modified copy, and cleanup removes it
+    placer.place("in.txt", str(dest))
+    with open(placed) as f:
+        assert f.read() == "a\tb\n"
+    placer.cleanup()
+    assert not os.path.exists(placed)
@@ -0,0 +1,154 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+import github_interact
+
+TIMEOUT = 30
+
+
+def run(*args, cwd=None):
+    return subprocess.run(["git"] + list(args), cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def commit(work, name, content, date):
+    """Commit a file to a working repo and push it to its origin, returning the new commit."""
+    with open(os.path.join(work, name), "w") as f:
+        f.write(content)
+    run("add", name, cwd=work)
+    env = dict(os.environ, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+    subprocess.run(["git", "commit", "-q", "-m", name], cwd=work, env=env, check=True)
+    run("push", "-q", "origin", "HEAD", cwd=work)
+    return run("rev-parse", "HEAD", cwd=work)
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    """A bare repo with one commit, reachable over file://, plus a working repo pushing to it."""
+    for key, value in {"GIT_AUTHOR_NAME": "Student", "GIT_AUTHOR_EMAIL": "s@example.com",
+                       "GIT_COMMITTER_NAME": "Student", "GIT_COMMITTER_EMAIL": "s@example.com"}.items():
+        monkeypatch.setenv(key, value)
+    bare = tmp_path / "student.git"
+    run("init", "-q", "--bare", str(bare))
+    work = tmp_path / "work"
+    run("clone", "-q", str(bare), str(work))
+    commit(work, "README.md", "first", "2024-11-01T12:00:00+00:00")
+    datafolder = tmp_path / "data"
+    datafolder.mkdir()
+    student = {"name": "Student", "folder": "Student_", "git": "file://" + str(bare)}
+    return student, str(datafolder), str(work)
+
+
+def test_update_in_place_and_reclone(remote):
+    student, datafolder, work = remote
+    path = os.path.join(datafolder, student["folder"])
+    status, output = github_interact.download_student(student, datafolder, TIMEOUT)
+    assert status == "cloned", output
+
+    head = commit(work, "script.sh", "echo hi", "2024-11-02T12:00:00+00:00")
+    # Local changes and untracked files are thrown away by an update
+    with open(os.path.join(path, "README.md"), "w") as f:
+        f.write("local edit")
+    open(os.path.join(path, "untracked.txt"), "w").close()
+    inode = os.stat(os.path.join(path, ".git")).st_ino
+    status, output = github_interact.download_student(student, datafolder, TIMEOUT)
+    assert status == "updated", output
+    assert os.stat(os.path.join(path, ".git")).st_ino == inode
+    assert github_interact.local_head(path, TIMEOUT) == head
+    assert open(os.path.join(path, "README.md")).read() == "first"
+    assert not os.path.exists(os.path.join(path, "untracked.txt"))
+
+    status, output = github_interact.download_student(student, datafolder, TIMEOUT, reclone=True)
+    assert status == "cloned", output
+    assert github_interact.local_head(path, TIMEOUT) == head
+    assert not os.path.exists(path + ".clone")
+
+
+def test_corrupt_clone_is_recloned(remote):
+    student, datafolder, work = remote
+    path = os.path.join(datafolder, student["folder"])
+    github_interact.download_student(student, datafolder, TIMEOUT)
+    head = commit(work, "script.sh", "echo hi", "2024-11-02T12:00:00+00:00")
+    # Corrupt the index, so that the clone still looks like a repo but can no longer be updated
+    with open(os.path.join(path, ".git", "index"), "w") as f:
+        f.write("garbage")
+    assert github_interact.is_checkout(path, TIMEOUT)
+    status, output = github_interact.download_student(student, datafolder, TIMEOUT)
+    assert status == "cloned", output
+    assert "recloning" in output
+    assert github_interact.local_head(path, TIMEOUT) == head
+    assert run("fsck", cwd=path) == ""
+
+
+def test_unusable_folder_is_replaced_only_by_a_good_clone(remote):
+    student, datafolder, _ = remote
+    path = os.path.join(datafolder, student["folder"])
+    os.makedirs(os.path.join(path, ".git"))
+    status, output = github_interact.download_student(dict(student, git=student["git"] + ".missing"), datafolder, TIMEOUT)
+    assert status == "failed"
+    assert os.path.isdir(os.path.join(path, ".git"))
+    status, output = github_interact.download_student(student, datafolder, TIMEOUT)
+    assert status == "cloned", output
+
+
+def test_unchanged_repos_are_found_with_ls_remote(remote):
+    student, datafolder, work = remote
+    students = {"s1": student, "nogit": {"name": "No git", "folder": "None_", "git": ""}}
+    assert github_interact.find_unchanged(students, datafolder, TIMEOUT, 4) == {}
+
+    report = github_interact.sync_student("s1", student, datafolder, TIMEOUT)
+    assert report["status"] == "cloned"
+    assert github_interact.find_unchanged(students, datafolder, TIMEOUT, 4) == {"s1": report["head"]}
+
+    commit(work, "script.sh", "echo hi", "2024-11-02T12:00:00+00:00")
+    assert github_interact.find_unchanged(students, datafolder, TIMEOUT, 4) == {}
+
+
+def test_before_checks_out_the_last_commit_before_the_deadline(remote):
+    student, datafolder, work = remote
+    on_time = commit(work, "script.sh", "echo on time", "2024-11-02T12:00:00+00:00")
+    late = commit(work, "script.sh", "echo late", "2024-11-04T12:00:00+00:00")
+    deadline = github_interact.parse_deadline("2024-11-03T17:00:00+00:00")
+
+    # A shallow clone only holds the late commit, so has to be deepened to find the deadline
+    report = github_interact.sync_student("s1", student, datafolder, TIMEOUT, depth=1, deadline=deadline)
+    assert report["status"] == "cloned", report["output"]
+    assert (report["head"], report["late_commits"]) == (on_time, 1)
+    path = os.path.join(datafolder, student["folder"])
+    assert open(os.path.join(path, "script.sh")).read() == "echo on time"
+
+    # Extensions move the deadline, by hours or to a new timestamp
+    report = github_interact.sync_student("s1", dict(student, extension=48), datafolder, TIMEOUT, deadline=deadline)
+    assert (report["status"], report["head"], report["late_commits"]) == ("updated", late, 0)
+    report = github_interact.sync_student("s1", dict(student, extension="2024-11-01T00:00:00+00:00"), datafolder, TIMEOUT,
+                                          deadline=deadline)
+    assert report["status"] == "failed"
+    assert report["head"] == late
+
+    # Without a deadline the repo comes back up to date
+    report = github_interact.sync_student("s1", student, datafolder, TIMEOUT)
+    assert (report["status"], report["head"]) == ("updated", late)
+
+
+def test_invalid_extension_only_fails_that_student(remote, tmp_path, monkeypatch):
+    student, datafolder, work = remote
+    commit(work, "script.sh", "echo on time", "2024-11-02T12:00:00+00:00")
+    students = {"good": student, "typo": dict(student, folder="Typo_", extension="next tuesday"),
+                "wrong": dict(student, folder="Wrong_", extension=[48])}
+    studentsfile = tmp_path / "students.json"
+    studentsfile.write_text(json.dumps({"students": students}))
+    # main moves into the data folder
+    monkeypatch.chdir(tmp_path)
+    github_interact.main({"students": str(studentsfile), "datafolder": datafolder, "jobs": 2, "retries": 0, "depth": None,
+                          "filter": None, "sparse": None, "reference": None, "reference_dir": None, "dissociate": False,
+                          "unchanged": False, "before": "2024-11-03T17:00:00+00:00", "reclone": False})
+    with open(tmp_path / "sync_report.json") as f:
+        reports = {report["student"]: report for report in json.load(f)["students"]}
+    assert reports["good"]["status"] == "cloned"
+    assert (reports["typo"]["status"], reports["wrong"]["status"]) == ("failed", "failed")
+    assert "next tuesday" in reports["typo"]["output"]
+    assert not os.path.exists(os.path.join(datafolder, "Typo_"))
+    with pytest.raises(ValueError):
+        github_interact.student_deadline({"extension": True}, github_interact.parse_deadline("2024-11-03T17:00"))
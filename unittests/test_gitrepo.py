@@ -0,0 +1,51 @@
+import os
+import subprocess
+
+import pytest
+
+from markutils import gitrepo
+
+
+def git(path, *args):
+    return subprocess.run(["git", "-C", str(path), "-c", "user.name=t", "-c", "user.email=t@t", *args],
+                          check=True, capture_output=True, text=True).stdout.strip()
+
+
+@pytest.fixture
+def repo(tmp_path):
+    """A repo whose history holds a large file that has since been deleted, and one that is still at HEAD."""
+    path = tmp_path / "repo"
+    path.mkdir()
+    git(path, "init", "-q")
+    (path / "small.txt").write_text("small\n")
+    (path / "old.bin").write_bytes(os.urandom(3000))
+    git(path, "add", "-A")
+    git(path, "commit", "-qm", "add old.bin")
+    old = git(path, "rev-parse", "HEAD")
+    (path / "old.bin").unlink()
+    (path / "keep.bin").write_bytes(os.urandom(2000))
+    git(path, "add", "-A")
+    git(path, "commit", "-qm", "swap old.bin for keep.bin")
+    return path, old, git(path, "rev-parse", "HEAD")
+
+
+def test_large_files_at_head(repo):
+    path, old, new = repo
+    assert gitrepo.large_files(str(path), 1000) == ([("keep.bin", new)], [], [])
+    assert gitrepo.large_files(str(path), 5000) == ([], [], [])
+
+
+def test_large_files_in_history(repo):
+    path, old, new = repo
+    assert gitrepo.large_files(str(path), 1000, history=True) == ([("keep.bin", new)], [], [("old.bin", old)])
+    # Only the history of HEAD counts, not e.g. commits made after the deadline the repo was reset to
+    git(path, "checkout", "-qb", "late")
+    (path / "late.bin").write_bytes(os.urandom(4000))
+    git(path, "add", "-A")
+    git(path, "commit", "-qm", "late")
+    git(path, "checkout", "-q", "--detach", new)
+    assert gitrepo.large_files(str(path), 1000, history=True) == ([("keep.bin", new)], [], [("old.bin", old)])
+
+
+def test_not_a_repo(tmp_path):
+    assert gitrepo.large_files(str(tmp_path), 1000) is None
@@ -0,0 +1,19 @@
+from markutils.inventory import Inventory, find_target
+
+
+def test_find_target(tmp_path):
+    code = tmp_path / "week1" / "code"
+    code.mkdir(parents=True)
+    (code / "Boilerplate.sh").write_text("echo hi\n")
+    (code / "variables.sh").write_text("read x\n")
+    studentspec = {"inventory": Inventory.scan(str(tmp_path))}
+    modulespec = {"folder": "week1", "codeloc": "code"}
+
+    def find(targetfile, required=1):
+        deductions = {"value": 0, "reasons": []}
+        return find_target(studentspec, modulespec, targetfile, {"required": required}, deductions), deductions
+
+    assert find("variables.sh") == ("variables.sh", {"value": 0, "reasons": []})
+    assert find("boilerplate.sh") == ("Boilerplate.sh", {"value": 0, "reasons": []})
+    assert find("missing.sh", required=0) == ("missing.sh", {"value": 0, "reasons": []})
+    assert find("missing.sh") == (None, {"value": 1, "reasons": ["file_missing"]})
@@ -0,0 +1,42 @@
+import json
+
+from markutils.journal import ResultsJournal
+
+
+def test_append_and_iterate(tmp_path):
+    journal = ResultsJournal(str(tmp_path / "journal.jsonl"))
+    journal.append("alice", {"score": 1}, meta={"commit": "abc"})
+    journal.append("bob", {"score": 2})
+    journal.append("alice", {"score": 3})
+    assert journal.completed() == {"alice", "bob"}
+    # Only the latest entry of a student is used, in journal order unless told otherwise
+    assert list(journal.iter_entries()) == [("alice", {"score": 3}, {}), ("bob", {"score": 2}, {})]
+    assert list(journal.iter_results(["bob", "carol"])) == [("bob", {"score": 2}), ("alice", {"score": 3})]
+    journal.write_json(str(tmp_path / "out.json"), order=["bob", "alice"])
+    with open(tmp_path / "out.json") as f:
+        assert list(json.load(f).items()) == [("bob", {"score": 2}), ("alice", {"score": 3})]
+
+
+def test_resume(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ResultsJournal(path)
+    journal.append("alice", {"score": 1})
+    assert ResultsJournal(path, resume=True).completed() == {"alice"}
+    # Without resume the journal starts afresh
+    assert ResultsJournal(path).completed() == set()
+    assert (tmp_path / "journal.jsonl").read_text() == ""
+
+
+def test_resume_truncates_partial_entry(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ResultsJournal(path)
+    journal.append("alice", {"score": 1})
+    with open(path, "a") as f:
+        f.write('{"student": "bob", "resu')
+    journal = ResultsJournal(path, resume=True)
+    assert journal.completed() == {"alice"}
+    # New entries follow on from the last complete one
+    journal.append("bob", {"score": 2})
+    with open(path) as f:
+        assert [json.loads(line)["student"] for line in f] == ["alice", "bob"]
+    assert dict(journal.iter_results()) == {"alice": {"score": 1}, "bob": {"score": 2}}
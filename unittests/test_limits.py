@@ -0,0 +1,59 @@
+import signal
+import sys
+import time
+
+from markutils import runner
+from markutils.limits import breached
+
+
+def test_error_text_only_counts_when_the_script_failed():
+    limits = {"address_space_mb": 100, "processes": 10}
+    assert breached(limits, 0, "caught MemoryError, retrying with less\nResource temporarily unavailable") == []
+    assert breached(limits, 1, "MemoryError") == ["address_space_mb"]
+
+
+def test_limit_signals():
+    limits = {"cpu_s": 1, "file_size_mb": 1}
+    assert breached(limits, -signal.SIGXCPU, "") == ["cpu_s"]
+    assert breached(limits, 128 + signal.SIGXFSZ, "") == ["file_size_mb"]
+    # CPU time added up across processes is not a breach of a per-process limit
+    assert breached(limits, 0, "", {"cpu_user_s": 0.9, "cpu_sys_s": 0.2}) == []
+    # The SIGKILL following SIGXCPU counts, but not one from the runner or from something else
+    assert breached(limits, -signal.SIGKILL, "", {"cpu_user_s": 1.9, "cpu_sys_s": 0.2}) == ["cpu_s"]
+    assert breached(limits, -signal.SIGKILL, "", {"cpu_user_s": 1.9, "cpu_sys_s": 0.2}, killed=True) == []
+    assert breached(limits, -signal.SIGKILL, "", {"cpu_user_s": 0.1, "cpu_sys_s": 0.0}) == []
+
+
+def test_limits_are_applied_to_the_command():
+    result = runner.run(["bash", "-c", "ulimit -f; ulimit -n"], timeout=30, limits={"file_size_mb": 1, "open_files": 64})
+    assert result.returncode == 0
+    # bash reports the file size limit in 1024-byte blocks
+    assert result.stdout.split() == ["1024", "64"]
+    result = runner.run(["no_such_command_here"], timeout=30, limits={"cpu_s": 5})
+    assert result.returncode == 127
+
+
+def test_busy_processes_are_not_a_cpu_breach():
+    # Two processes using 1.2 seconds of CPU each stay within a 2 second limit
+    busy = f"{sys.executable} -c 'import time\nwhile time.process_time() < 1.2: pass'"
+    result = runner.run(["bash", "-c", f"{busy} & {busy} & wait"], timeout=30, limits={"cpu_s": 2})
+    assert result.returncode == 0
+    assert result.limits_exceeded == []
+
+
+def test_cpu_limit():
+    result = runner.run(["bash", "-c", "while :; do :; done"], timeout=30, limits={"cpu_s": 1})
+    assert not result.timedout
+    assert result.limits_exceeded == ["cpu_s"]
+
+
+def test_process_cap_kills_the_tree():
+    start = time.monotonic()
+    result = runner.run(["bash", "-c", "for i in $(seq 20); do sleep 30 & done; wait"], timeout=20,
+                        limits={"processes": 5})
+    assert time.monotonic() - start < 10
+    assert not result.timedout
+    assert result.limits_exceeded == ["processes"]
+    result = runner.run(["bash", "-c", "sleep 0.5 & sleep 0.5 & wait"], timeout=20, limits={"processes": 5})
+    assert result.returncode == 0
+    assert result.limits_exceeded == []
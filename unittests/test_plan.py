@@ -0,0 +1,66 @@
+import json
+import logging
+import os
+
+import pytest
+
+from markutils.plan import PlanError, build_plan, fingerprint
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_module(tmp_path, tests, **extra):
+    folder = tmp_path / "week1"
+    folder.mkdir(exist_ok=True)
+    (folder / "week1_config.json").write_text(json.dumps(dict({"name": "week1", "tests": tests, "extra_files": []}, **extra)))
+    return {"week1": {"name": "week1", "test_location": str(folder), "folder": "week1"}}
+
+
+GOOD = {"testfile": "test_boilerplate.py", "required": 1, "timeout": 5}
+
+
+def test_valid_config():
+    config = {"week1": {"name": "week1", "test_location": "tests/week1", "folder": "week1"}}
+    plan = build_plan(config, ROOT)
+    assert [module.moduleid for module in plan] == ["week1"]
+    tests = {test.targetfile: test for test in plan[0].tests}
+    assert "boilerplate.sh" in tests
+    # Module-level limits are inherited by every test
+    assert tests["boilerplate.sh"].testspec["limits"]["cpu_s"] == 60
+    assert fingerprint(plan) == fingerprint(build_plan(config, ROOT))
+
+
+def test_broken_tests_are_left_out(tmp_path, caplog):
+    config = write_module(tmp_path, {
+        "boilerplate.sh": GOOD,
+        "notime.sh": dict(GOOD, timeout=0),
+        "optional.sh": dict(GOOD, required=2),
+        "nofile.sh": {"required": 1},
+        "missing.sh": dict(GOOD, testfile="test_no_such_module.py"),
+        "limits.sh": dict(GOOD, limits={"cpu_s": -1, "gpus": 1}),
+    })
+    with caplog.at_level(logging.CRITICAL, logger="mark"):
+        plan = build_plan(config)
+    assert [test.targetfile for test in plan[0].tests] == ["boilerplate.sh"]
+    errors = [r.getMessage() for r in caplog.records if r.getMessage().startswith("CONFIG ERROR")]
+    assert len(errors) == 6
+    assert any("notime.sh" in e and "timeout" in e for e in errors)
+    assert any("test_no_such_module.py" in e for e in errors)
+
+    with pytest.raises(PlanError) as e:
+        build_plan(config, strict=True)
+    assert len(e.value.errors) == 6
+
+
+def test_broken_module_is_left_out(tmp_path):
+    config = write_module(tmp_path, {"boilerplate.sh": GOOD}, extra_files="README.md")
+    config["week2"] = {"name": "week1", "test_location": os.path.join(ROOT, "tests", "week1"), "folder": "week1"}
+    config["week3"] = {"name": "week3", "folder": "week3"}
+    plan = build_plan(config)
+    assert [module.moduleid for module in plan] == ["week2"]
+
+
+def test_nothing_left_to_mark(tmp_path):
+    config = write_module(tmp_path, {"nofile.sh": {"required": 1}})
+    with pytest.raises(PlanError):
+        build_plan(config)
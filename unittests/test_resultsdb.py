@@ -0,0 +1,16 @@
+from markutils.resultsdb import ResultsDB
+
+
+def test_add_student_with_bare_number_deductions():
+    db = ResultsDB(":memory:")
+    db.start_run()
+    results = {"repo_results": {"deductions": {"value": 1, "reasons": ["no_repo_readme"]}},
+               "week1": {"weekchecker_results": {"deductions": 0}},
+               "week2": {"weekchecker_results": {"deductions": {"value": 100, "reasons": ["no_folder"]}},
+                         "test.sh": {"deductions": 0, "stdout": "", "linterout": "", "other": {"exectime_s": 0.5}}}}
+    db.add_student("s1", {"name": "S", "folder": "S_"}, results)
+
+    assert db.conn.execute("SELECT module, deduction FROM modules ORDER BY module").fetchall() == [("week1", 0), ("week2", 100)]
+    assert db.conn.execute("SELECT test, deduction FROM tests").fetchall() == [("test.sh", 0)]
+    assert sorted(db.deduction_counts()) == [("no_folder", 1), ("no_repo_readme", 1)]
+    db.close()
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+
+import pytest
+
+from markutils import runner
+
+pytestmark = pytest.mark.skipif(not os.path.isdir("/proc"), reason="process tracking needs /proc")
+
+
+def processes(cmdline):
+    """Return the pids of live processes started with exactly this command line."""
+    found = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                args = f.read().split(b"\0")[:-1]
+            with open(f"/proc/{entry}/stat") as f:
+                state = f.read().rsplit(")", 1)[1].split()[0]
+        except OSError:
+            continue
+        if args == [arg.encode() for arg in cmdline] and state != "Z":
+            found.append(int(entry))
+    return found
+
+
+def zombie_children():
+    pid = str(os.getpid())
+    found = []
+    for entry in os.listdir("/proc"):
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if fields[1] == pid and fields[0] == "Z":
+            found.append(int(entry))
+    return found
+
+
+@pytest.mark.parametrize("escape", ["(setsid sleep {} &)", "( (sleep {} &) &)"])
+def test_descendants_leaving_the_tree_are_killed_on_timeout(escape):
+    # A distinct duration for each case, so that its sleep can be picked out from /proc
+    duration = "101.{}".format(len(escape))
+    result = runner.run(["bash", "-c", escape.format(duration) + "; sleep 30"], timeout=1)
+    assert result.timedout
+    time.sleep(0.5)
+    assert processes(["sleep", duration]) == []
+    assert result.resources["procs"] >= 2
+
+
+def test_descendants_leaving_the_tree_are_killed_when_the_command_exits():
+    result = runner.run(["bash", "-c", "(setsid sleep 102.5 &); echo done"], timeout=10)
+    assert (result.returncode, result.stdout, result.timedout) == (0, "done\n", False)
+    time.sleep(0.5)
+    assert processes(["sleep", "102.5"]) == []
+    assert zombie_children() == []
+
+
+def test_peak_memory_is_the_commands_own():
+    # Hold on to a large allocation in the marker, which fork() would otherwise pass on as a high-water mark
+    ballast = b"x" * (200 * 1024 * 1024)
+    small = runner.run(["sleep", "0.5"])
+    big = runner.run([sys.executable, "-c", "import time; x = b\"x\" * (80 * 1024 * 1024); time.sleep(0.5)"])
+    assert small.resources["maxrss_kb"] is not None and small.resources["maxrss_kb"] < 50 * 1024
+    assert big.resources["maxrss_kb"] >= 80 * 1024
+    del ballast
+
+
+def test_stdin():
+    assert runner.run(["bash", "-c", "read x; echo $?"], timeout=10).stdout == "1\n"
+    assert runner.run(["bash", "-c", "read x; echo $x"], timeout=10, input="hi\n").stdout == "hi\n"
+    result = runner.run(["bash", "-c", "echo asking; read x"], timeout=1, input=runner.HOLD_STDIN)
+    assert result.timedout
+    assert result.stdout == "asking\n"
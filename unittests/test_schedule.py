@@ -0,0 +1,37 @@
+from markutils import schedule
+from markutils.plan import PlannedModule, PlannedTest
+
+
+def planned(moduleid, *targetfiles):
+    tests = [PlannedTest(target, {}, "test", None, "", []) for target in targetfiles]
+    return PlannedModule(moduleid, {}, {}, tests)
+
+
+def test_longest_first():
+    assert schedule.longest_first({"a": 1, "b": 5, "c": 3, "d": 5}) == ["b", "d", "c", "a"]
+
+
+def test_makespan():
+    assert schedule.makespan([], 2) == 0
+    assert schedule.makespan([4, 3, 2, 1], 1) == 10
+    assert schedule.makespan([4, 3, 2, 1], 2) == 5
+    # A long job last leaves the other workers idle, which longest first avoids
+    assert schedule.makespan([1, 1, 1, 1, 4], 2) == 6
+    assert schedule.makespan([4, 1, 1, 1, 1], 2) == 4
+    assert schedule.makespan([3], 0) == 3
+
+
+def test_costs_fall_back_on_other_history():
+    plan = [planned("week1", "a.sh", "b.sh"), planned("week2", "c.sh")]
+    estimates = {("alice", "week1", "a.sh"): 2.0, ("bob", "week1", "a.sh"): 4.0, ("bob", "week1", "b.sh"): 6.0}
+    costs = schedule.test_costs(plan, ["alice", "bob", "carol"], estimates)
+    # Own history first, then the median of the test, then the median of all tests
+    assert costs["alice"] == {("week1", "a.sh"): 2.0, ("week1", "b.sh"): 6.0, ("week2", "c.sh"): 4.5}
+    assert costs["carol"][("week1", "a.sh")] == 3.0
+    assert schedule.test_costs(plan, ["alice"], {})["alice"][("week2", "c.sh")] == schedule.DEFAULT_TEST_S
+
+
+def test_student_cost():
+    costs = {("week1", "a.sh"): 1.0, ("week1", "b.sh"): 3.0, ("week2", "c.sh"): 2.0}
+    assert schedule.student_cost(costs) == 6.0
+    assert schedule.student_cost(costs, testjobs=2) == 5.0
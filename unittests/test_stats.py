@@ -0,0 +1,39 @@
+import random
+
+from markutils.stats import Histogram
+
+
+def test_empty():
+    histogram = Histogram()
+    assert histogram.mean is None
+    assert histogram.percentile(50) is None
+    assert histogram.outliers() == []
+
+
+def test_exact_summary():
+    histogram = Histogram()
+    for value in [0, 2, 4, 10]:
+        histogram.add(value)
+    assert (histogram.count, histogram.min, histogram.max, histogram.mean) == (4, 0, 10, 4)
+    assert histogram.percentile(0) == 0
+    assert histogram.percentile(100) == 10
+    assert sum(n for _, _, n in histogram.bins()) == 4
+
+
+def test_percentiles_within_a_bin():
+    rng = random.Random(1)
+    values = sorted(rng.lognormvariate(0, 2) for _ in range(10000))
+    histogram = Histogram()
+    for value in values:
+        histogram.add(value)
+    for p in [1, 10, 25, 50, 75, 90, 99]:
+        exact = values[int(p / 100 * len(values))]
+        assert abs(histogram.percentile(p) - exact) <= 0.13 * exact
+
+
+def test_outliers():
+    histogram = Histogram()
+    for i in range(100):
+        histogram.add(1.0 + i / 100, "student{}".format(i))
+    histogram.add(500.0, "slow")
+    assert histogram.outliers() == [(500.0, "slow")]
@@ -0,0 +1,63 @@
+import pytest
+
+from markutils import verify
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(verify, "CHUNKSIZE", 4)
+
+
+def test_count_char(tmp_path, small_chunks):
+    path = tmp_path / "out.csv"
+    path.write_bytes(b"a,b,c\n1,2,3\n")
+    assert verify.count_char(str(path), ",") == 4
+    assert verify.count_char(str(path), "\t") == 0
+    (tmp_path / "empty.csv").write_bytes(b"")
+    assert verify.count_char(str(tmp_path / "empty.csv"), ",") is None
+    assert verify.count_char(str(tmp_path / "missing.csv"), ",") is None
+
+
+def test_count_char_across_chunks(tmp_path, small_chunks):
+    path = tmp_path / "out.txt"
+    # With 4 byte chunks, the first "::" straddles the first boundary and "é" (2 bytes) the second
+    path.write_bytes("abc::xyé-é-é".encode())
+    assert verify.count_char(str(path), "::") == 1
+    assert verify.count_char(str(path), "é") == 3
+    assert verify.count_char(str(path), "xyé") == 1
+    # A separator several characters long, split in every possible place
+    for offset in range(8):
+        path.write_bytes(b"." * offset + "→|".encode() + b"." * 3 + "→|".encode())
+        assert verify.count_char(str(path), "→|") == 2
+
+
+def test_line_count(tmp_path, small_chunks):
+    path = tmp_path / "out.txt"
+    path.write_bytes(b"one\ntwo\nthree")
+    assert verify.line_count(str(path)) == 2
+    assert verify.line_count(str(tmp_path / "missing.txt")) is None
+
+
+@pytest.mark.parametrize("data, mime", [
+    (b"", "inode/x-empty"),
+    (b"\x89PNG\r\n\x1a\n....", "image/png"),
+    (b"II*\x00....", "image/tiff"),
+    (b"MM\x00*....", "image/tiff"),
+    (b"%PDF-1.5", "application/pdf"),
+    (b"hello, world\n", "text/plain"),
+    ("naïve café\n".encode(), "text/plain"),
+    (b"text\x00with a null", "application/octet-stream"),
+    (b"\xff\xfe not utf-8 at all" * 10, "application/octet-stream"),
+])
+def test_sniff(tmp_path, data, mime):
+    path = tmp_path / "file"
+    path.write_bytes(data)
+    assert verify.sniff(str(path)) == mime
+
+
+def test_sniff_text_cut_mid_character(tmp_path):
+    # Only the first 512 bytes are read, which may end part way through a multi-byte character
+    path = tmp_path / "file.txt"
+    path.write_bytes(b"a" * 511 + "é".encode() + b"more")
+    assert verify.sniff(str(path)) == "text/plain"
+    assert verify.sniff(str(tmp_path / "missing")) is None
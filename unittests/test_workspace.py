@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from markutils import workspace
+from markutils.workspace import SharedInputs, populate
+
+
+def test_workspace_files_are_independent_of_the_originals(tmp_path):
+    src = tmp_path / "src"
+    (src / "data").mkdir(parents=True)
+    (src / "data" / "big.csv").write_bytes(b"x" * 2000000)
+    (src / "small.txt").write_text("hello")
+    dst = tmp_path / "dst"
+    counts = populate(str(src), str(dst))
+    assert counts["reflink"] + counts["copy"] == 2
+
+    with open(dst / "data" / "big.csv", "r+b") as f:
+        f.write(b"changed")
+    assert (src / "data" / "big.csv").read_bytes()[:7] == b"xxxxxxx"
+    assert os.stat(src / "data" / "big.csv").st_ino != os.stat(dst / "data" / "big.csv").st_ino
+
+
+def test_large_inputs_are_shared_without_reflinks(tmp_path, monkeypatch):
+    # As on a filesystem without reflinks
+    monkeypatch.setattr(workspace, "fcntl", None)
+    src = tmp_path / "src"
+    for folder in ("code", "data", "results"):
+        (src / folder).mkdir(parents=True)
+    (src / "data" / "big.csv").write_bytes(b"x" * 3000)
+    (src / "data" / "small.csv").write_bytes(b"x" * 10)
+    (src / "code" / "big.py").write_bytes(b"#" * 3000)
+    shared = SharedInputs(str(tmp_path / "shared"), threshold=1000)
+
+    for dst in ("dst1", "dst2"):
+        counts = populate(str(src), str(tmp_path / dst), shared=shared, private=["code", "results"])
+        assert counts == {"reflink": 0, "copy": 2, "shared": 1, "bytes": 3010}
+        big = tmp_path / dst / "data" / "big.csv"
+        assert os.path.islink(big) and big.read_bytes() == b"x" * 3000
+        # Everything in the private folders is a copy of its own
+        assert not os.path.islink(tmp_path / dst / "code" / "big.py")
+    assert os.readlink(tmp_path / "dst1" / "data" / "big.csv") == os.readlink(tmp_path / "dst2" / "data" / "big.csv")
+    if os.geteuid() != 0:
+        with pytest.raises(PermissionError):
+            open(tmp_path / "dst1" / "data" / "big.csv", "w")
+    # The original is never written to through the link
+    assert not os.path.samefile(tmp_path / "dst1" / "data" / "big.csv", src / "data" / "big.csv")
+    shared.cleanup()
+    assert not (tmp_path / "shared").exists()